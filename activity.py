@@ -0,0 +1,178 @@
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+from sqlalchemy import event
+from app import db
+from models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'pending_activity'
+
+
+class ActivityLogWriter:
+    """Write activity log entries without a commit of their own.
+
+    Entries recorded during a unit of work are staged on the session and
+    written when it commits:
+
+    - ``transaction`` (default): one executemany INSERT inside the business
+      transaction, just before COMMIT, so the entry is atomic with the change.
+    - ``background``: after COMMIT the entries go to a bounded in-process queue
+      that a worker thread drains in batches. When the queue is full the
+      caller writes the batch itself instead of dropping it.
+    - ``sync``: the background write path run inline after COMMIT, for tests.
+
+    Entries of a rolled back transaction are discarded in every mode.
+    """
+
+    MODES = ('transaction', 'background', 'sync')
+
+    def __init__(self):
+        self.mode = 'transaction'
+        self.engine = None
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self._queue = None
+        self._worker = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'entries_recorded': 0,
+            'entries_written': 0,
+            'insert_statements': 0,
+            'log_commits': 0,
+            'caller_flushes': 0,
+            'write_errors': 0,
+        }
+
+    def init_app(self, app):
+        self.mode = app.config.setdefault('ACTIVITY_LOG_MODE', 'transaction')
+        if self.mode not in self.MODES:
+            raise ValueError(f'ACTIVITY_LOG_MODE must be one of {self.MODES}, not {self.mode!r}')
+        self.batch_size = app.config.setdefault('ACTIVITY_LOG_BATCH_SIZE', 500)
+        self.flush_interval = app.config.setdefault('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0)
+        with app.app_context():
+            self.engine = db.engine
+        event.listen(db.session, 'before_commit', self._before_commit)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        if self.mode == 'background':
+            self._queue = queue.Queue(maxsize=app.config.setdefault('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+            self._worker = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+        app.extensions['activity_writer'] = self
+
+    # --- RECORDING ---
+
+    def record(self, action, table_name, record_id, details=None, user='System'):
+        """Stage an entry on the current session; it is written when the session commits"""
+        db.session.info.setdefault(PENDING_KEY, []).append({
+            'action': action,
+            'table_name': table_name,
+            'record_id': record_id,
+            'details': details,
+            'user': user,
+            'timestamp': datetime.utcnow(),
+        })
+        self._count('entries_recorded')
+
+    def _before_commit(self, session):
+        if self.mode == 'transaction' and session.info.get(PENDING_KEY):
+            entries = session.info.pop(PENDING_KEY)
+            session.execute(ActivityLog.__table__.insert(), entries)
+            self._count('entries_written', len(entries))
+            self._count('insert_statements')
+
+    def _after_commit(self, session):
+        entries = session.info.pop(PENDING_KEY, None)
+        if not entries:
+            return
+        if self.mode == 'sync':
+            self._write(entries)
+            return
+        try:
+            self._queue.put(entries, timeout=self.flush_interval)
+        except queue.Full:
+            # Back-pressure rather than loss: the request pays for this batch itself
+            self._count('caller_flushes')
+            self._write(entries)
+
+    def _after_rollback(self, session):
+        session.info.pop(PENDING_KEY, None)
+
+    # --- BACKGROUND WRITER ---
+
+    def _write(self, entries):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(ActivityLog.__table__.insert(), entries)
+        except Exception:
+            self._count('write_errors')
+            logger.exception('Failed to write %d activity log entries', len(entries))
+            return
+        self._count('entries_written', len(entries))
+        self._count('insert_statements')
+        self._count('log_commits')
+
+    def _drain(self, first=None):
+        batch = list(first or [])
+        while len(batch) < self.batch_size:
+            try:
+                batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = self._drain(first)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        if self._queue is None:
+            return
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def close(self):
+        """Stop the worker, writing any queued entries first"""
+        if self._worker is None:
+            return
+        self._stopping.set()
+        self._worker.join(timeout=10)
+        self.flush()
+        self._worker = None
+        logger.info('Activity log writer stopped: %s', self.metrics())
+
+    # --- METRICS ---
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def metrics(self):
+        """Counters plus derived write amplification (statements and commits per entry)"""
+        with self._lock:
+            data = dict(self._metrics)
+        written = data['entries_written'] or 1
+        data['mode'] = self.mode
+        data['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        data['statements_per_entry'] = round(data['insert_statements'] / written, 4)
+        data['commits_per_entry'] = round(data['log_commits'] / written, 4)
+        return data
+
+
+activity_writer = ActivityLogWriter()
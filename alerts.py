@@ -0,0 +1,182 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import delete, event, func, insert, literal, select, tuple_, update
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Item, IncomingItem, OutgoingItem, LocationLowStockAlert, LotBalance, LowStockAlert, StockBalance
+
+PENDING_KEY = 'alert_items'
+
+
+# --- LOW STOCK ---
+# Writers mark the items whose stock they touch (locations.py marks every
+# item whose balance moves); just before the commit only those items, and
+# their balances at each location, are re-evaluated against their reorder
+# level, so the cost of keeping low_stock_alerts and
+# location_low_stock_alerts current follows the size of the change, not of
+# the catalog.
+
+def mark(session, item_ids):
+    """Re-evaluate the low-stock state of item_ids when session commits"""
+    session.info.setdefault(PENDING_KEY, set()).update(item_ids)
+
+
+def _after_flush(session, flush_context):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Item):
+            changed.add(obj.id)
+        elif isinstance(obj, (IncomingItem, OutgoingItem)):
+            changed.add(obj.item_id)
+    if changed:
+        mark(session, changed)
+
+
+def _before_commit(session):
+    # Flush first so pending changes are marked and evaluated at their final quantities
+    session.flush()
+    if session.info.get(PENDING_KEY):
+        evaluate(session.info.pop(PENDING_KEY), session)
+
+
+def _after_rollback(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def evaluate(item_ids, session=None):
+    """Bring the low-stock rows of item_ids in line with their current quantities"""
+    session = session or db.session
+    item_ids = list(item_ids)
+    if not item_ids:
+        return
+    current = {id: (quantity, level) for id, quantity, level in session.execute(
+        select(Item.id, Item.quantity, Item.reorder_level).where(Item.id.in_(item_ids)))}
+    low = {id: values for id, values in current.items() if values[0] < values[1]}
+    alerted = set(session.scalars(select(LowStockAlert.item_id).where(LowStockAlert.item_id.in_(item_ids))))
+    cleared = [id for id in item_ids if id in alerted and id not in low]
+    if cleared:
+        session.execute(delete(LowStockAlert).where(LowStockAlert.item_id.in_(cleared)))
+    raised = [{'item_id': id, 'quantity': q, 'reorder_level': level, 'since': datetime.utcnow()}
+              for id, (q, level) in low.items() if id not in alerted]
+    if raised:
+        session.execute(insert(LowStockAlert), raised)
+    still = [{'item_id': id, 'quantity': q, 'reorder_level': level}
+             for id, (q, level) in low.items() if id in alerted]
+    if still:
+        session.execute(update(LowStockAlert), still)
+    _evaluate_locations(item_ids, session)
+
+
+def _evaluate_locations(item_ids, session):
+    # The same for each of the items' balances, keyed by (location_id, item_id)
+    low = {(location_id, item_id): (quantity, level) for location_id, item_id, quantity, level in session.execute(
+        select(StockBalance.location_id, StockBalance.item_id, StockBalance.quantity, Item.reorder_level)
+        .join(Item, Item.id == StockBalance.item_id)
+        .where(StockBalance.item_id.in_(item_ids), StockBalance.quantity < Item.reorder_level))}
+    alerted = {(location_id, item_id) for location_id, item_id in session.execute(
+        select(LocationLowStockAlert.location_id, LocationLowStockAlert.item_id)
+        .where(LocationLowStockAlert.item_id.in_(item_ids)))}
+    cleared = [key for key in alerted if key not in low]
+    if cleared:
+        session.execute(delete(LocationLowStockAlert).where(
+            tuple_(LocationLowStockAlert.location_id, LocationLowStockAlert.item_id).in_(cleared)))
+    raised = [{'location_id': location_id, 'item_id': item_id, 'quantity': q, 'reorder_level': level,
+               'since': datetime.utcnow()}
+              for (location_id, item_id), (q, level) in low.items() if (location_id, item_id) not in alerted]
+    if raised:
+        session.execute(insert(LocationLowStockAlert), raised)
+    still = [{'location_id': location_id, 'item_id': item_id, 'quantity': q, 'reorder_level': level}
+             for (location_id, item_id), (q, level) in low.items() if (location_id, item_id) in alerted]
+    if still:
+        session.execute(update(LocationLowStockAlert), still)
+
+
+def rebuild():
+    """Recompute the whole low-stock set with one scan of the items table, and of the balances for each location"""
+    items, balances = Item.__table__, StockBalance.__table__
+    now = datetime.utcnow()
+    db.session.execute(delete(LowStockAlert))
+    db.session.execute(LowStockAlert.__table__.insert().from_select(
+        ['item_id', 'quantity', 'reorder_level', 'since'],
+        select(items.c.id, items.c.quantity, items.c.reorder_level, literal(now))
+        .where(items.c.quantity < items.c.reorder_level)
+    ))
+    db.session.execute(delete(LocationLowStockAlert))
+    db.session.execute(LocationLowStockAlert.__table__.insert().from_select(
+        ['location_id', 'item_id', 'quantity', 'reorder_level', 'since'],
+        select(balances.c.location_id, balances.c.item_id, balances.c.quantity, items.c.reorder_level, literal(now))
+        .join(items, items.c.id == balances.c.item_id)
+        .where(balances.c.quantity < items.c.reorder_level)
+    ))
+    db.session.commit()
+
+
+def low_stock(limit=None, location_id=None):
+    """Low-stock items, emptiest first relative to their reorder level.
+
+    With location_id, the items whose balance at that location is below
+    their reorder level, as LocationLowStockAlert rows with the same
+    fields as LowStockAlert.
+    """
+    model = LowStockAlert if location_id is None else LocationLowStockAlert
+    query = (model.query
+             .options(joinedload(model.item).load_only(Item.code, Item.name))
+             .order_by(model.quantity - model.reorder_level, model.item_id))
+    if location_id is not None:
+        query = query.filter(model.location_id == location_id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def low_stock_count(location_id=None):
+    if location_id is not None:
+        return db.session.scalar(select(func.count()).select_from(LocationLowStockAlert)
+                                 .where(LocationLowStockAlert.location_id == location_id))
+    return db.session.scalar(select(func.count()).select_from(LowStockAlert))
+
+
+# --- EXPIRY ---
+
+def expiring_batches(days=30, limit=None, location_id=None):
+    """Lots with units left whose expiry date falls within the next days, soonest first.
+
+    A range scan on the expiry_date index, or with location_id on the lot
+    balances' expiry index, for the units of each lot held there.
+    """
+    today = date.today()
+    if location_id is None:
+        lot, remaining = IncomingItem, IncomingItem.remaining
+    else:
+        lot, remaining = LotBalance, LotBalance.remaining
+    query = (
+        db.session.query(IncomingItem.id, IncomingItem.batch_number, lot.expiry_date,
+                         IncomingItem.quantity, remaining, Item.id, Item.code, Item.name, Item.quantity)
+        .join(Item, Item.id == IncomingItem.item_id)
+        .filter(lot.expiry_date >= today,
+                lot.expiry_date <= today + timedelta(days=days),
+                remaining > 0)
+        .order_by(lot.expiry_date, IncomingItem.id)
+    )
+    if location_id is not None:
+        query = (query.join(LotBalance, LotBalance.incoming_id == IncomingItem.id)
+                 .filter(LotBalance.location_id == location_id))
+    if limit:
+        query = query.limit(limit)
+    return [{
+        'incoming_id': incoming_id,
+        'batch_number': batch,
+        'expiry_date': expiry.isoformat(),
+        'days_left': (expiry - today).days,
+        'received_quantity': received,
+        'remaining': remaining,
+        'item_id': item_id,
+        'code': code,
+        'name': name,
+        'item_quantity': on_hand,
+    } for incoming_id, batch, expiry, received, remaining, item_id, code, name, on_hand in query]
+
+
+def init_app(app):
+    """Keep the low-stock set current on every commit (the migration that creates it builds it)"""
+    app.config.setdefault('ALERT_EXPIRY_DAYS', 30)
+    event.listen(db.session, 'after_flush', _after_flush)
+    event.listen(db.session, 'before_commit', _before_commit)
+    event.listen(db.session, 'after_rollback', _after_rollback)
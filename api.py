@@ -0,0 +1,416 @@
+import gzip
+import hashlib
+import json
+import time
+import zlib
+from datetime import date, datetime
+from functools import wraps
+from flask import Blueprint, Response, current_app, g, request, stream_with_context
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy import select
+from app import db
+from models import User, Item, Category, IncomingItem, OutgoingItem, ActivityLog, Location, StockTransfer
+from pagination import encode_cursor, decode_cursor
+from cache import cache, page_etag
+from feed import change_feed, FeedGone, ENTITIES as FEED_ENTITIES
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STREAM_BATCH = 1000
+# Smaller bodies are not worth the CPU of compressing
+GZIP_MIN_SIZE = 1024
+NDJSON = 'application/x-ndjson'
+
+
+class ApiError(Exception):
+    def __init__(self, status, field, message):
+        super().__init__(message)
+        self.status = status
+        self.field = field
+        self.message = message
+
+
+class Resource:
+    """A model exposed by the API.
+
+    Rows are read as plain column tuples, never ORM instances. exclude
+    lists the wide columns left out unless asked for with ?fields=;
+    entity names the cache version that tags responses, so a matching
+    If-None-Match is answered before any query runs.
+    """
+
+    def __init__(self, model, exclude=(), filters=(), entity=None):
+        self.model = model
+        self.columns = {column.key: column for column in model.__table__.columns}
+        self.default_fields = [name for name in self.columns if name not in exclude]
+        self.filters = filters
+        self.entity = entity
+
+    def fields(self, requested):
+        if not requested:
+            return self.default_fields
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.columns]
+        if unknown:
+            raise ApiError(400, 'fields', f'Unknown fields: {", ".join(unknown)}.')
+        # The id is always returned: it is the cursor and the key for bulk reads
+        return ['id'] + [name for name in names if name != 'id']
+
+    def select(self, fields, args):
+        statement = select(*(self.columns[name] for name in fields))
+        for name in self.filters:
+            if name in args:
+                statement = statement.where(self.columns[name] == _coerce(self.columns[name], name, args[name]))
+        return statement
+
+
+RESOURCES = {
+    'items': Resource(Item, exclude=('description',), filters=('category_id', 'code', 'supplier'), entity='items'),
+    'categories': Resource(Category, exclude=('description',), filters=('name',), entity='categories'),
+    'incoming-items': Resource(IncomingItem, exclude=('notes',), filters=('item_id', 'batch_number', 'location_id')),
+    'outgoing-items': Resource(OutgoingItem, exclude=('notes',), filters=('item_id', 'destination', 'location_id')),
+    'locations': Resource(Location, exclude=('description',), filters=('code',), entity='locations'),
+    'transfers': Resource(StockTransfer, exclude=('notes',), filters=('item_id', 'from_location_id', 'to_location_id')),
+    'activity-log': Resource(ActivityLog, exclude=('details',), filters=('action', 'table_name', 'record_id', 'user')),
+}
+
+
+def _coerce(column, name, value):
+    if column.type.python_type is int:
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(400, name, 'Must be an integer.')
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+def _rows(fields, result):
+    return [dict(zip(fields, row)) for row in result]
+
+
+# --- AUTHENTICATION ---
+# Tokens are signed, not stored: checking one is a signature and age check
+# with no session, user loader or database round trip. They cannot be
+# revoked one by one; they expire after API_TOKEN_MAX_AGE seconds, and
+# changing SESSION_SECRET invalidates them all.
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='api-token')
+
+
+def issue_token(user):
+    return _serializer().dumps({'id': user.id, 'username': user.username})
+
+
+def token_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            raise ApiError(401, 'token', 'Send an API token as "Authorization: Bearer <token>".')
+        try:
+            g.api_user = _serializer().loads(token.strip(), max_age=current_app.config['API_TOKEN_MAX_AGE'])
+        except SignatureExpired:
+            raise ApiError(401, 'token', 'Token expired.')
+        except BadSignature:
+            raise ApiError(401, 'token', 'Invalid token.')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@api.route('/tokens', methods=['POST'])
+def create_token():
+    """Exchange a username and password for an API token"""
+    payload = request.get_json(silent=True) or {}
+    user = User.query.filter_by(username=payload.get('username') or '').first()
+    if user is None or not user.check_password(payload.get('password') or ''):
+        raise ApiError(401, 'credentials', 'Invalid username or password.')
+    if user.needs_rehash():
+        user.set_password(payload['password'])
+        db.session.commit()
+    return _json({'token': issue_token(user), 'expires_in': current_app.config['API_TOKEN_MAX_AGE']}, status=201)
+
+
+# --- RESPONSES ---
+
+@api.errorhandler(ApiError)
+def _api_error(error):
+    response = _json({'errors': {error.field: [error.message]}}, status=error.status)
+    if error.status == 401:
+        response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+def _json(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def _accepts_gzip():
+    return 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+
+@api.after_request
+def _compress(response):
+    """Gzip buffered responses for clients that accept it; streams compress themselves"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or not _accepts_gzip()):
+        return response
+    body = response.get_data()
+    if len(body) >= GZIP_MIN_SIZE:
+        response.set_data(gzip.compress(body, 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _respond(payload, etag=None):
+    """A JSON response tagged with etag, or with a hash of its body for resources without a version"""
+    body = dumps(payload)
+    etag = etag or hashlib.sha1(body.encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _stream(fields, statement, etag=None):
+    """Stream rows as NDJSON from a server-side cursor, gzipped a batch at a time when accepted"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if _accepts_gzip() else None
+
+    def generate():
+        result = db.session.execute(statement.execution_options(yield_per=STREAM_BATCH))
+        for partition in result.partitions():
+            chunk = ''.join(dumps(dict(zip(fields, row))) + '\n' for row in partition).encode()
+            # A sync flush lets the client decode each batch as it arrives
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+
+    response = Response(stream_with_context(generate()), mimetype=NDJSON)
+    if compressor:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# --- ENDPOINTS ---
+
+def _resource(name):
+    if name not in RESOURCES:
+        raise ApiError(404, 'resource', f'Unknown resource {name!r}.')
+    return RESOURCES[name]
+
+
+def _version_etag(resource):
+    if resource.entity:
+        return page_etag('api', request.full_path, cache.version(resource.entity))
+    return None
+
+
+def _int_list(name, value):
+    try:
+        values = [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise ApiError(400, name, 'Expected comma-separated integers.')
+    if len(values) > MAX_LIMIT:
+        raise ApiError(400, name, f'At most {MAX_LIMIT} ids per request.')
+    return values
+
+
+def _limit(default):
+    limit = request.args.get('limit', default, type=int)
+    if limit is None or limit < 1:
+        raise ApiError(400, 'limit', 'Must be a positive integer.')
+    return min(limit, MAX_LIMIT)
+
+
+@api.route('/<resource>')
+@token_required
+def list_resource(resource):
+    """One page of a resource in id order, or with ?ids= the given rows.
+
+    ?fields= picks the columns, ?after= continues from a page's
+    next_cursor, the resource's filters match columns exactly, and
+    ?format=ndjson (or Accept: application/x-ndjson) streams every match.
+    """
+    spec = _resource(resource)
+    etag = _version_etag(spec)
+    if etag and request.if_none_match.contains_weak(etag):
+        return _respond(None, etag)
+    fields = spec.fields(request.args.get('fields'))
+    statement = spec.select(fields, request.args)
+    id_column = spec.columns['id']
+
+    if 'ids' in request.args:
+        ids = _int_list('ids', request.args['ids'])
+        found = {row[0]: row for row in db.session.execute(statement.where(id_column.in_(ids)))}
+        return _respond({'data': _rows(fields, (found[id] for id in ids if id in found)),
+                         'missing': [id for id in ids if id not in found]}, etag)
+
+    after = request.args.get('after')
+    if after:
+        cursor = decode_cursor(after)
+        if not cursor or len(cursor) != 1:
+            raise ApiError(400, 'after', 'Invalid cursor.')
+        statement = statement.where(id_column > cursor[0])
+    statement = statement.order_by(id_column)
+
+    if request.args.get('format') == 'ndjson' or \
+            request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+        if 'limit' in request.args:
+            statement = statement.limit(_limit(None))
+        return _stream(fields, statement, etag)
+
+    limit = _limit(DEFAULT_LIMIT)
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    next_cursor = encode_cursor([rows[limit - 1][0]]) if len(rows) > limit else None
+    return _respond({'data': _rows(fields, rows[:limit]), 'next_cursor': next_cursor}, etag)
+
+
+@api.route('/<resource>/<int:id>')
+@token_required
+def get_resource(resource, id):
+    spec = _resource(resource)
+    etag = _version_etag(spec)
+    if etag and request.if_none_match.contains_weak(etag):
+        return _respond(None, etag)
+    fields = spec.fields(request.args.get('fields'))
+    row = db.session.execute(spec.select(fields, {}).where(spec.columns['id'] == id)).first()
+    if row is None:
+        raise ApiError(404, 'id', 'Not found.')
+    return _respond({'data': dict(zip(fields, row))}, etag)
+
+
+# --- CHANGE FEED ---
+
+FEED_LIMIT = 500
+MAX_WAIT = 30
+KEEPALIVE = 15
+
+
+def _feed_params():
+    after = request.args.get('after') or request.headers.get('Last-Event-ID') or '0'
+    try:
+        after = int(after)
+    except ValueError:
+        raise ApiError(400, 'after', 'Must be a cursor returned as next_cursor.')
+    entities = [name for name in request.args.get('entities', '').split(',') if name]
+    unknown = set(entities) - set(FEED_ENTITIES.values())
+    if unknown:
+        raise ApiError(400, 'entities', f'Unknown entities: {", ".join(sorted(unknown))}.')
+    return after, entities
+
+
+def _feed_page(after, limit, entities):
+    """Changes after the cursor with each record's current fields; a record changed twice is listed once, at its latest change"""
+    try:
+        entries = change_feed.changes(after, limit, entities)
+    except FeedGone as e:
+        raise ApiError(410, 'after', str(e))
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity, entry.record_id), None)
+        latest[(entry.entity, entry.record_id)] = entry
+    current = {}
+    for entity in {entity for (entity, _), entry in latest.items() if entry.op == 'upsert'}:
+        spec = RESOURCES[entity]
+        ids = [id for (name, id), entry in latest.items() if name == entity and entry.op == 'upsert']
+        for row in db.session.execute(spec.select(spec.default_fields, {}).where(spec.columns['id'].in_(ids))):
+            current[(entity, row[0])] = dict(zip(spec.default_fields, row))
+    changes = [{
+        'cursor': entry.id,
+        'entity': entry.entity,
+        'id': entry.record_id,
+        'op': entry.op,
+        'changed_at': entry.changed_at,
+        # None for deletes, and for records deleted since (their tombstone follows)
+        'data': current.get(key) if entry.op == 'upsert' else None,
+    } for key, entry in latest.items()]
+    return changes, entries[-1].id if entries else after, len(entries) == limit
+
+
+@api.route('/changes/head')
+@token_required
+def change_head():
+    """The newest cursor: where a consumer that has just copied everything starts following"""
+    return _json({'cursor': change_feed.current_head()})
+
+
+@api.route('/changes')
+@token_required
+def change_list():
+    """Inserts, updates and deletes after ?after=, oldest first, optionally limited to ?entities=.
+
+    With ?wait=N (seconds, at most 30) an empty answer is held until a
+    change arrives or N seconds pass (long-poll). A 410 means the cursor
+    is older than the retained feed.
+    """
+    after, entities = _feed_params()
+    limit = _limit(FEED_LIMIT)
+    wait = min(max(request.args.get('wait', 0, type=float) or 0, 0), MAX_WAIT)
+    deadline = time.monotonic() + wait
+    seen = after
+    while True:
+        page, next_cursor, has_more = _feed_page(after, limit, entities)
+        remaining = deadline - time.monotonic()
+        if page or remaining <= 0:
+            break
+        # Hand the connection back to the pool while waiting
+        db.session.close()
+        seen = max(seen, change_feed.head)
+        change_feed.wait(seen, remaining)
+    return _json({'changes': page, 'next_cursor': next_cursor, 'has_more': has_more})
+
+
+@api.route('/changes/stream')
+@token_required
+def change_stream():
+    """The change feed as server-sent events, each with its cursor as the event id.
+
+    Browsers' EventSource resumes from Last-Event-ID by itself. The stream
+    ends after FEED_STREAM_SECONDS to free the worker; clients reconnect.
+    """
+    after, entities = _feed_params()
+    _feed_page(after, 1, entities)
+    duration = current_app.config['FEED_STREAM_SECONDS']
+
+    def generate():
+        cursor = seen = after
+        deadline = time.monotonic() + duration
+        yield 'retry: 1000\n\n'
+        while time.monotonic() < deadline:
+            page, cursor, has_more = _feed_page(cursor, FEED_LIMIT, entities)
+            for change in page:
+                yield f'id: {change["cursor"]}\nevent: change\ndata: {dumps(change)}\n\n'
+            if has_more:
+                continue
+            db.session.close()
+            seen = max(seen, cursor, change_feed.head)
+            if not change_feed.wait(seen, max(min(KEEPALIVE, deadline - time.monotonic()), 0)):
+                yield ': keepalive\n\n'
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def init_app(app):
+    app.config.setdefault('API_TOKEN_MAX_AGE', 30 * 24 * 3600)
+    app.config.setdefault('FEED_STREAM_SECONDS', 300)
+    app.register_blueprint(api)
@@ -2,43 +2,144 @@ import os
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from flask_migrate import Migrate, upgrade
+from config import engine_options, load_config, sqlite_pragmas
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
+migrate = Migrate(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
 
-# Create the app
+# Create the app; routes and extensions bind to this instance on import
 app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "telkom-inventory-secret-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///telkom_inventory.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
 
-# Initialize the app with the extension
-db.init_app(app)
-login_manager.init_app(app)
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return on_connect
+
+
+def create_app():
+    """Configure the app for the APP_ENV profile and set up its extensions.
 
+    Runs once per process; the WSGI server imports it in every worker after
+    forking, so each worker gets its own connection pool and background
+    threads. The app is a module-level object that importing this module
+    configures, so the profile must be chosen (APP_ENV) before that import;
+    a later call asking for another profile raises rather than returning
+    the app configured for the first one.
+    """
+    config = load_config()
+    if 'sqlalchemy' in app.extensions:
+        if app.config['APP_ENV'] != config.APP_ENV:
+            raise RuntimeError(f"The app is already configured for APP_ENV={app.config['APP_ENV']}; "
+                               f'set APP_ENV={config.APP_ENV} before app is first imported')
+        return app
+    app.config.from_object(config)
+    logging.basicConfig(level=app.config['LOG_LEVEL'])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
 
-with app.app_context():
-    # Import models to ensure tables are created
-    import models
-    db.create_all()
+    # Initialize the app with the extension
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+
+    with app.app_context():
+        import models
+        # WAL, busy timeout and cache sizes on every SQLite connection, before the first one opens
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _set_sqlite_pragmas(sqlite_pragmas(app.config)))
+        # The schema is owned by the migrations in migrations/ (flask db upgrade);
+        # development brings the database up to date here, production never
+        # touches the schema at startup
+        if app.config['DB_AUTO_MIGRATE']:
+            upgrade()
+    
+        # Install the full-text item search index and its sync triggers
+        from search import item_search
+        item_search.init_app(app)
+    
+        # Keep the materialised dashboard statistics in step with writes
+        import stats
+        stats.init_app(app)
+    
+        # Every quantity change is appended to the stock ledger in the same flush
+        import ledger
+        ledger.init_app(app)
+    
+        # Direct quantity edits are booked at the default location's balance
+        import locations
+        locations.init_app(app)
+    
+        # Lowering an item's quantity draws its lots down, first expiry first
+        import lots
+        lots.init_app(app)
+    
+        # Low-stock alerts are re-evaluated for the items each commit touched
+        import alerts
+        alerts.init_app(app)
+    
+        # Inserts, updates and deletes of synced records feed /api/v1/changes
+        from feed import change_feed
+        change_feed.init_app(app)
+    
+        # Activity log entries are written with the business commit, not after it
+        from activity import activity_writer
+        activity_writer.init_app(app)
     
-    # Import and register routes
-    import routes
\ No newline at end of file
+        # Old activity log rows are moved to monthly gzip archives
+        from archive import activity_archive
+        activity_archive.init_app(app)
+    
+        # Valuation, turnover and ABC reports run on a background thread pool
+        from reports import report_jobs
+        report_jobs.init_app(app)
+    
+        # Category and item reads are cached; writes invalidate them on commit
+        from cache import cache
+        cache.init_app(app)
+
+        # The logged-in user comes from a bounded cache, dropped when the user changes
+        from auth import user_cache
+        user_cache.init_app(app)
+
+        # Cached row fragments, streamed listing pages and fingerprinted static files
+        from rendering import fragment_cache
+        fragment_cache.init_app(app)
+        from assets import static_assets
+        static_assets.init_app(app)
+    
+        # Import and register routes and CLI commands
+        import routes
+        import commands
+    
+        # Versioned JSON API under /api/v1, authenticated by signed tokens
+        import api
+        api.init_app(app)
+    
+        # Per-request SQL statement counting
+        import queries
+        queries.init_app(app)
+    
+        # Request latency, sampled SQL and template timings, slow-query log and /metrics
+        from metrics import request_metrics
+        request_metrics.init_app(app)
+
+    return app
+
+
+create_app()
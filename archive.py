@@ -0,0 +1,125 @@
+import gzip
+import json
+import logging
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from app import db
+from models import ActivityLog
+from pagination import KeysetPage
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('id', 'timestamp', 'action', 'table_name', 'record_id', 'details', 'user')
+FILTERS = ('action', 'table_name', 'user', 'record_id')
+_FILENAME_RE = re.compile(r'^activity-(\d{4}-\d{2})\.jsonl\.gz$')
+
+
+class ActivityArchive:
+    """Monthly gzip JSONL archives of old activity log rows.
+
+    The retention job moves rows older than ACTIVITY_LOG_RETENTION_DAYS out
+    of activity_logs, oldest first, into one file per calendar month under
+    ACTIVITY_ARCHIVE_DIR. Each batch is appended as its own gzip member and
+    synced to disk before the rows are deleted, so a failed run can at worst
+    archive a batch twice, never lose it.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.retention_days = 90
+
+    def init_app(self, app):
+        app.config['ACTIVITY_ARCHIVE_DIR'] = (app.config.get('ACTIVITY_ARCHIVE_DIR')
+                                              or os.path.join(app.instance_path, 'activity_archive'))
+        self.directory = app.config['ACTIVITY_ARCHIVE_DIR']
+        self.retention_days = app.config.setdefault('ACTIVITY_LOG_RETENTION_DAYS', 90)
+        app.extensions['activity_archive'] = self
+
+    def path(self, month):
+        return os.path.join(self.directory, f'activity-{month}.jsonl.gz')
+
+    def months(self):
+        """Archived months as 'YYYY-MM', newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        found = (_FILENAME_RE.match(name) for name in os.listdir(self.directory))
+        return sorted((m.group(1) for m in found if m), reverse=True)
+
+    # --- RETENTION ---
+
+    def archive(self, before=None, batch_size=5000):
+        """Move activity rows older than before (default: the retention window) into the archives.
+
+        Returns a Counter of rows archived per month.
+        """
+        cutoff = before or datetime.utcnow() - timedelta(days=self.retention_days)
+        os.makedirs(self.directory, exist_ok=True)
+        table = ActivityLog.__table__
+        archived = Counter()
+        while True:
+            rows = db.session.execute(
+                select(table).where(table.c.timestamp < cutoff)
+                .order_by(table.c.timestamp, table.c.id).limit(batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(row['timestamp'].strftime('%Y-%m'), []).append(row)
+            for month, entries in by_month.items():
+                self._append(month, entries)
+                archived[month] += len(entries)
+            db.session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+            db.session.commit()
+        if archived:
+            logger.info('Archived activity log rows older than %s: %s', cutoff, dict(archived))
+        return archived
+
+    def _append(self, month, rows):
+        with open(self.path(month), 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as out:
+                for row in rows:
+                    entry = {c: row[c] for c in COLUMNS}
+                    entry['timestamp'] = row['timestamp'].isoformat()
+                    out.write(json.dumps(entry, separators=(',', ':')).encode() + b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+
+    # --- SEARCH ---
+
+    def _entries(self, month):
+        with gzip.open(self.path(month), 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+                yield entry
+
+    def search(self, month, filters=None, start=0, per_page=50):
+        """One page of a month's archived entries matching filters, oldest first.
+
+        Archives are only readable front to back, so the cursors are
+        positions among the matching entries rather than keys.
+        """
+        filters = filters or {}
+        if month not in self.months():
+            return KeysetPage([], per_page=per_page)
+        items, position, has_more = [], 0, False
+        for entry in self._entries(month):
+            if any(entry.get(k) != v for k, v in filters.items()):
+                continue
+            if position >= start + per_page:
+                has_more = True
+                break
+            if position >= start:
+                items.append(entry)
+            position += 1
+        return KeysetPage(items,
+                          next_cursor=str(start + per_page) if has_more else None,
+                          prev_cursor=str(max(start - per_page, 0)) if start > 0 else None,
+                          per_page=per_page)
+
+
+activity_archive = ActivityArchive()
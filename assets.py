@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are optional; gzip is always built
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Text assets are worth precompressing; images are already compressed
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+ONE_YEAR = 365 * 24 * 3600
+
+
+def fingerprint(path, digest):
+    """css/custom.css -> css/custom.<digest>.css"""
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{digest}{ext}'
+
+
+class StaticAssets:
+    """Content-hashed static URLs with immutable caching and precompressed variants.
+
+    url_for('static', filename='css/custom.css') yields css/custom.<hash>.css,
+    so a changed file gets a new URL and browsers may keep each version for
+    a year without revalidating. Text assets are also served gzip or Brotli
+    compressed from variants built once, at startup or with
+    flask build-assets, into ASSETS_DIR. Unhashed URLs keep working with
+    the default caching.
+    """
+
+    def __init__(self):
+        self.static_folder = None
+        self.directory = None
+        self.manifest = {}
+        self.originals = {}
+        self.variants = {}
+        self._send_static = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        app.config['ASSETS_DIR'] = app.config.get('ASSETS_DIR') or os.path.join(app.instance_path, 'assets')
+        self.directory = app.config['ASSETS_DIR']
+        app.extensions['static_assets'] = self
+        # Off in development, where assets are edited without restarting the server
+        if not app.config.setdefault('ASSETS_FINGERPRINT', not app.debug):
+            return
+        self.build()
+        self._send_static = app.view_functions['static']
+        app.view_functions['static'] = self.send
+        app.url_defaults(self._url_defaults)
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    # --- BUILD ---
+
+    def _files(self):
+        for root, _, names in os.walk(self.static_folder):
+            for name in names:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, self.static_folder).replace(os.sep, '/'), path
+
+    def build(self, force=False):
+        """Hash every static file and write its missing compressed variants; returns the sizes written"""
+        manifest, variants, written = {}, {}, []
+        for name, path in self._files():
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(name, hashlib.sha256(data).hexdigest()[:12])
+            manifest[name] = hashed
+            if name.endswith(COMPRESSIBLE):
+                for encoding, suffix, compress in self._encoders():
+                    target = os.path.join(self.directory, hashed + suffix)
+                    if force or not os.path.exists(target):
+                        compressed = compress(data)
+                        # A variant no smaller than the file is never worth sending
+                        if len(compressed) >= len(data):
+                            continue
+                        self._write(target, compressed)
+                        written.append((hashed + suffix, len(data), len(compressed)))
+                    variants.setdefault(hashed, []).append((encoding, hashed + suffix))
+        self.manifest = manifest
+        self.originals = {hashed: name for name, hashed in manifest.items()}
+        self.variants = variants
+        return written
+
+    @staticmethod
+    def _encoders():
+        # Best first: a client accepting both gets Brotli
+        encoders = [('gzip', '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+        return encoders
+
+    @staticmethod
+    def _write(target, data):
+        # Several workers may build at once; each replaces the file whole
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except OSError:
+            logger.exception('Could not write asset %s', target)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    # --- SERVING ---
+
+    def send(self, filename):
+        name = self.originals.get(filename)
+        if name is None:
+            return self._send_static(filename=filename)
+        response = None
+        if name.endswith(COMPRESSIBLE):
+            for encoding, variant in self.variants.get(filename, ()):
+                if encoding in request.accept_encodings:
+                    response = send_from_directory(self.directory, variant, max_age=ONE_YEAR,
+                                                   mimetype=mimetypes.guess_type(name)[0])
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            if response is None:
+                response = send_from_directory(self.static_folder, name, max_age=ONE_YEAR)
+            response.vary.add('Accept-Encoding')
+        else:
+            response = send_from_directory(self.static_folder, name, max_age=ONE_YEAR)
+        response.cache_control.immutable = True
+        return response
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,99 @@
+import threading
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from app import db, login_manager
+from cache import MemoryBackend
+from models import User
+
+PENDING_KEY = 'auth_users_changed'
+
+
+class SessionUser(UserMixin):
+    """The identity fields a logged-in request needs, detached from any session"""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    def __repr__(self):
+        return f'<SessionUser {self.username}>'
+
+
+class UserCache:
+    """Resolve the logged-in user from a bounded in-process cache instead of the database.
+
+    Flask-Login asks for the user on every @login_required request. Hits
+    are served from an LRU of identity snapshots; a miss reads one row.
+    Committing a change to a user (password, username, deletion) drops
+    that user's entry in this process at once; other worker processes
+    notice within AUTH_USER_CACHE_TTL seconds. AUTH_USER_CACHE_SIZE = 0
+    turns the cache off.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 60
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def init_app(self, app):
+        size = app.config.setdefault('AUTH_USER_CACHE_SIZE', 1024)
+        self.ttl = app.config.setdefault('AUTH_USER_CACHE_TTL', 60)
+        self.backend = MemoryBackend(size) if size else None
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+        login_manager.user_loader(self.load)
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        app.extensions['user_cache'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def load(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        if self.backend is not None:
+            user = self.backend.get(user_id)
+            if isinstance(user, SessionUser):
+                self._count('hits')
+                return user
+        self._count('misses')
+        row = db.session.execute(
+            select(User.id, User.username, User.email).where(User.id == user_id)).first()
+        user = SessionUser(*row) if row else None
+        # Unknown ids are not cached, so a user created later is found at once
+        if user is not None and self.backend is not None:
+            self.backend.set(user_id, user, self.ttl)
+        return user
+
+    def metrics(self):
+        with self._lock:
+            data = dict(self._metrics)
+        data['evictions'] = self.backend.evictions if self.backend is not None else 0
+        return data
+
+    # --- INVALIDATION ---
+
+    def _after_flush(self, session, flush_context):
+        changed = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+        if changed:
+            session.info.setdefault(PENDING_KEY, set()).update(changed)
+
+    def _after_commit(self, session):
+        changed = session.info.pop(PENDING_KEY, None)
+        if changed and self.backend is not None:
+            for user_id in changed:
+                self.backend.delete(user_id)
+                self._count('invalidations')
+
+    def _after_rollback(self, session):
+        session.info.pop(PENDING_KEY, None)
+
+
+user_cache = UserCache()
+
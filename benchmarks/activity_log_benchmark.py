@@ -0,0 +1,64 @@
+"""Measure activity-log write amplification for category creates.
+
+Compares the old pattern (business commit, then a second commit for the log
+entry) with the configured ACTIVITY_LOG_MODE. Run once per mode:
+
+    ACTIVITY_LOG_MODE=transaction python -m benchmarks.activity_log_benchmark
+    ACTIVITY_LOG_MODE=background python -m benchmarks.activity_log_benchmark
+"""
+import argparse
+import time
+from benchmarks.common import setup_database
+
+setup_database()
+
+from sqlalchemy import event  # noqa: E402
+from app import app, db  # noqa: E402
+from models import ActivityLog, Category  # noqa: E402
+from activity import activity_writer  # noqa: E402
+
+
+def run(label, count, write):
+    commits = [0]
+
+    def on_commit(conn):
+        commits[0] += 1
+
+    event.listen(db.engine, 'commit', on_commit)
+    started = time.perf_counter()
+    for i in range(count):
+        write(i)
+    elapsed = time.perf_counter() - started
+    activity_writer.flush()
+    event.remove(db.engine, 'commit', on_commit)
+    print(f'{label:<14} {count / elapsed:>10.0f} writes/s {commits[0] / count:>8.2f} commits/write')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        def legacy(i):
+            category = Category(name=f'legacy-{i}')
+            db.session.add(category)
+            db.session.commit()
+            db.session.add(ActivityLog(action='CREATE', table_name='categories', record_id=category.id))
+            db.session.commit()
+
+        def current(i):
+            category = Category(name=f'{activity_writer.mode}-{i}')
+            db.session.add(category)
+            db.session.flush()
+            activity_writer.record('CREATE', 'categories', category.id)
+            db.session.commit()
+
+        run('legacy', args.count, legacy)
+        run(activity_writer.mode, args.count, current)
+        activity_writer.close()
+        print(activity_writer.metrics())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Per-request cost of resolving the logged-in user, and of checking a password.
+
+Requests a small login-required JSON endpoint through the test client with
+the user cache off (a users query on every request, as before) and on, and
+reports the latency and the statements each request ran. Then times one
+password check for several PASSWORD_HASH_METHOD settings, the cost a login
+pays.
+
+Usage: python -m benchmarks.auth_benchmark [--items 2000] [--repeat 500]
+"""
+import argparse
+from benchmarks.common import seed_items, setup_database, timed
+
+setup_database()
+
+from sqlalchemy import event  # noqa: E402
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Item, User  # noqa: E402
+from auth import user_cache  # noqa: E402
+from cache import MemoryBackend  # noqa: E402
+
+HASH_METHODS = ['scrypt', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:100000']
+
+
+def count_statements(engine, fn):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--hash-repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        seed_items(db, args.items)
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        item_id = db.session.scalar(db.select(Item.id).limit(1))
+        engine = db.engine
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+    path = f'/items/{item_id}/stock'
+
+    def page():
+        assert client.get(path).status_code == 200
+
+    print(f'{path} over {args.repeat} requests')
+    print(f'{"user resolution":<18}{"median ms":>12}{"p95 ms":>10}{"queries":>9}{"users queries":>15}')
+    for label, backend in (('database', None), ('cache', MemoryBackend(1024))):
+        user_cache.backend = backend
+        page()
+        statements = count_statements(engine, page)
+        median, p95 = timed(page, args.repeat)
+        users = sum(1 for s in statements if 'FROM users' in s)
+        print(f'{label:<18}{median:>12.2f}{p95:>10.2f}{len(statements):>9}{users:>15}')
+
+    print(f'\npassword check over {args.hash_repeat} logins')
+    print(f'{"PASSWORD_HASH_METHOD":<24}{"median ms":>12}')
+    for method in HASH_METHODS:
+        stored = generate_password_hash('bench-password', method)
+        median, _ = timed(lambda: check_password_hash(stored, 'bench-password'), args.hash_repeat)
+        print(f'{method:<24}{median:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database unless DATABASE_URL is
+set, so they never touch the development database.
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def setup_database():
+    """Point the app at a scratch database before it is imported"""
+    if 'DATABASE_URL' not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(prefix='inventory-bench-'), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    return os.environ['DATABASE_URL']
+
+
+WORDS = ['kabel', 'fiber', 'optik', 'router', 'modem', 'switch', 'antena', 'konektor',
+         'splitter', 'patch', 'cord', 'adaptor', 'baterai', 'server', 'rak', 'tiang']
+
+
+def seed_items(db, count, categories=20, batch=10000, seed=42):
+    """Bulk insert count synthetic items spread over a number of categories"""
+    from models import Category, Item
+    rng = random.Random(seed)
+    db.session.execute(Category.__table__.insert(),
+                       [{'name': f'Category {c:03d}', 'description': None} for c in range(categories)])
+    category_ids = [c.id for c in Category.query.all()]
+    for start in range(0, count, batch):
+        rows = []
+        for i in range(start, min(start + batch, count)):
+            words = rng.sample(WORDS, 3)
+            rows.append({
+                'code': f'TLK-{i:07d}',
+                'name': ' '.join(words).title(),
+                'description': f'{words[0]} {rng.choice(WORDS)} untuk jaringan {rng.choice(WORDS)}',
+                'quantity': rng.randint(0, 500),
+                'unit_price': round(rng.uniform(1000, 5000000), 2),
+                'supplier': f'Supplier {rng.randint(1, 200)}',
+                'category_id': rng.choice(category_ids),
+            })
+        db.session.execute(Item.__table__.insert(), rows)
+    db.session.commit()
+
+
+def timed(fn, repeat=20):
+    """Run fn repeatedly and return (median_ms, p95_ms)"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
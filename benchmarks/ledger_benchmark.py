@@ -0,0 +1,105 @@
+"""Point-in-time stock: snapshot plus delta scan versus replaying every movement.
+
+Usage: python -m benchmarks.ledger_benchmark [--items 2000] [--movements 500000] [--snapshots 10]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from benchmarks.common import setup_database, seed_items, timed
+
+setup_database()
+
+from sqlalchemy import func, select, update  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Item, IncomingItem, OutgoingItem, StockSnapshot  # noqa: E402
+import ledger  # noqa: E402
+
+
+def seed_movements(items, movements, snapshots, days=365, batch=20000, seed=7):
+    """Spread movements over the last days, writing ledger entries and taking snapshots as time passes"""
+    rng = random.Random(seed)
+    item_ids = [i for i, in db.session.execute(select(Item.id))]
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / movements
+    snapshot_every = movements // max(snapshots, 1)
+    when = start
+    for offset in range(0, movements, batch):
+        incoming, outgoing, entries = [], [], []
+        for n in range(offset, min(offset + batch, movements)):
+            when += step
+            item_id, quantity = rng.choice(item_ids), rng.randint(1, 20)
+            if rng.random() < 0.55:
+                incoming.append({'item_id': item_id, 'quantity': quantity, 'unit_price': round(rng.uniform(1000, 50000), 2),
+                                 'received_by': 'bench', 'received_date': when})
+                entries.append(ledger.entry(item_id, quantity, 'incoming', 'incoming_items', None, when))
+            else:
+                outgoing.append({'item_id': item_id, 'quantity': quantity, 'destination': 'bench', 'purpose': 'bench',
+                                 'issued_by': 'bench', 'issued_date': when})
+                entries.append(ledger.entry(item_id, -quantity, 'outgoing', 'outgoing_items', None, when))
+            if snapshot_every and (n + 1) % snapshot_every == 0:
+                db.session.execute(IncomingItem.__table__.insert(), incoming)
+                db.session.execute(OutgoingItem.__table__.insert(), outgoing)
+                ledger.record(db.session.connection(), entries)
+                incoming, outgoing, entries = [], [], []
+                db.session.commit()
+                _snapshot_at(when)
+        if incoming:
+            db.session.execute(IncomingItem.__table__.insert(), incoming)
+        if outgoing:
+            db.session.execute(OutgoingItem.__table__.insert(), outgoing)
+        ledger.record(db.session.connection(), entries)
+        db.session.commit()
+
+
+def _snapshot_at(when):
+    # take_snapshots stamps the current time; backdate so as-of queries see the history
+    ledger.take_snapshots()
+    latest = db.session.scalar(select(func.max(StockSnapshot.ledger_id)))
+    db.session.query(StockSnapshot).filter(StockSnapshot.ledger_id == latest).update({'taken_at': when})
+    db.session.commit()
+
+
+def replay(item_id, at):
+    """The old way: sum every movement of the item up to at"""
+    received = db.session.scalar(select(func.coalesce(func.sum(IncomingItem.quantity), 0))
+                                 .where(IncomingItem.item_id == item_id, IncomingItem.received_date <= at))
+    issued = db.session.scalar(select(func.coalesce(func.sum(OutgoingItem.quantity), 0))
+                               .where(OutgoingItem.item_id == item_id, OutgoingItem.issued_date <= at))
+    return received - issued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--movements', type=int, default=500000)
+    parser.add_argument('--snapshots', type=int, default=10)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if Item.query.count() == 0:
+            seed_items(db, args.items)
+            ledger._open_balances()
+            seed_movements(args.items, args.movements, args.snapshots)
+            # Movements were inserted behind the items table's back; bring quantities in line
+            db.session.execute(update(Item), [{'id': i, 'quantity': q} for i, q in ledger.quantities_as_of().items()])
+            db.session.commit()
+        rng = random.Random(1)
+        item_ids = [i for i, in db.session.execute(select(Item.id))]
+        now = datetime.utcnow()
+        moments = [now - timedelta(days=rng.randint(1, 360)) for _ in range(20)]
+        samples = [(rng.choice(item_ids), at) for at in moments]
+
+        print(f'items={len(item_ids)} movements={args.movements} snapshots={args.snapshots}')
+        replay_ms = timed(lambda: [replay(i, at) for i, at in samples], repeat=5)
+        ledger_ms = timed(lambda: [ledger.quantity_as_of(i, at) for i, at in samples], repeat=5)
+        print(f'{"":<28}{"median ms":>12}{"p95 ms":>10}')
+        print(f'{"replay movements (20 q)":<28}{replay_ms[0]:>12.2f}{replay_ms[1]:>10.2f}')
+        print(f'{"snapshot + deltas (20 q)":<28}{ledger_ms[0]:>12.2f}{ledger_ms[1]:>10.2f}')
+        all_ms = timed(lambda: ledger.quantities_as_of(moments[0]), repeat=5)
+        print(f'{"all items as of a date":<28}{all_ms[0]:>12.2f}{all_ms[1]:>10.2f}')
+        check_ms = timed(ledger.check, repeat=3)
+        print(f'{"consistency check":<28}{check_ms[0]:>12.2f}{check_ms[1]:>10.2f}  drifted={len(ledger.check())}')
+
+
+if __name__ == '__main__':
+    main()
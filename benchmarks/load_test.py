@@ -0,0 +1,161 @@
+"""HTTP load test of the main pages against a running server.
+
+Each of --clients threads logs in with its own session and keep-alive
+connection, then requests the pages round-robin for --seconds. Reports
+throughput and latency percentiles per page and overall. The account is
+registered first if it cannot log in.
+
+Start the server separately, e.g. production-style:
+    APP_ENV=production gunicorn -c gunicorn.conf.py wsgi:app
+or the development server (one process, debug off):
+    FLASK_DEBUG=0 python main.py
+
+--seed-items fills the database named by DATABASE_URL with synthetic items
+first; point it at the server's database.
+
+Usage: python -m benchmarks.load_test [--url http://127.0.0.1:5000] [--clients 16] [--seconds 20]
+"""
+import argparse
+import http.client
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+PAGES = ['/', '/items', '/categories', '/incoming-items', '/outgoing-items', '/activity-log', '/alerts']
+CSRF = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class Client:
+    """One browser: a keep-alive connection and its cookies"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, form=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (1, 2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.connection.close()
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                if attempt == 2:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value
+        return response.status, response.getheader('Location'), data
+
+    def submit(self, path, form):
+        status, _, page = self.request('GET', path)
+        match = CSRF.search(page.decode('utf-8', 'replace'))
+        if match:
+            form = dict(form, csrf_token=match.group(1))
+        return self.request('POST', path, form)
+
+    def login(self, username, password):
+        _, location, _ = self.submit('/login', {'username': username, 'password': password})
+        return bool(location) and '/login' not in location
+
+
+def log_in(url, username, password):
+    client = Client(url)
+    if not client.login(username, password):
+        client.submit('/register', {'username': username, 'email': f'{username}@example.com',
+                                    'password': password, 'password2': password})
+        if not client.login(username, password):
+            raise SystemExit(f'Could not log in or register as {username!r}')
+    return client
+
+
+def run_client(client, deadline, offset, samples, errors, lock):
+    local, failed = defaultdict(list), defaultdict(int)
+    n = offset
+    while time.perf_counter() < deadline:
+        path = PAGES[n % len(PAGES)]
+        n += 1
+        started = time.perf_counter()
+        try:
+            status, _, _ = client.request('GET', path)
+        except (http.client.HTTPException, OSError):
+            status = None
+        if status == 200:
+            local[path].append((time.perf_counter() - started) * 1000)
+        else:
+            failed[path] += 1
+    with lock:
+        for path, values in local.items():
+            samples[path].extend(values)
+        for path, count in failed.items():
+            errors[path] += count
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def seed(count):
+    from benchmarks.common import seed_items
+    from app import app, db
+    with app.app_context():
+        seed_items(db, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent logged-in clients')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--username', default='loadtest')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--seed-items', type=int, default=0, help='Insert this many items into DATABASE_URL first')
+    args = parser.parse_args()
+
+    if args.seed_items:
+        seed(args.seed_items)
+    clients = [log_in(args.url, args.username, args.password) for _ in range(args.clients)]
+    # One untimed pass warms templates, caches and connection pools
+    for path in PAGES:
+        clients[0].request('GET', path)
+
+    samples, errors, lock = defaultdict(list), defaultdict(int), threading.Lock()
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    threads = [threading.Thread(target=run_client, args=(client, deadline, n, samples, errors, lock))
+               for n, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.url} clients={args.clients} seconds={elapsed:.1f}')
+    print(f'{"page":<18}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    everything = []
+    for path in PAGES:
+        values = sorted(samples[path])
+        everything.extend(values)
+        print(f'{path:<18}{len(values):>10}{len(values) / elapsed:>10.1f}'
+              f'{percentile(values, 0.5):>10.1f}{percentile(values, 0.99):>10.1f}{errors[path]:>8}')
+    everything.sort()
+    print(f'{"all":<18}{len(everything):>10}{len(everything) / elapsed:>10.1f}'
+          f'{percentile(everything, 0.5):>10.1f}{percentile(everything, 0.99):>10.1f}{sum(errors.values()):>8}')
+
+
+if __name__ == '__main__':
+    main()
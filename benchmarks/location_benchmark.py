@@ -0,0 +1,167 @@
+"""Latency of location-scoped pages and stock movements as locations are added.
+
+Seeds a shared catalog, then adds locations one at a time, each stocking
+--stocked items and carrying --movements receipts and issues of its own.
+At each location count in --sites it times the scoped listing, dashboard
+and alert pages of the first location through the test client, and a
+receipt, an issue and a transfer there. With the per-location indexes the
+scoped numbers should stay flat while the total data grows. The cache
+backend is off so every request reaches the database.
+
+Usage: python -m benchmarks.location_benchmark [--items 20000] [--sites 2,4,16] [--stocked 5000] [--movements 20000]
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from benchmarks.common import setup_database, seed_items
+
+setup_database()
+os.environ.setdefault('CACHE_BACKEND', 'null')
+
+from sqlalchemy import bindparam, func, select  # noqa: E402
+from app import app, db  # noqa: E402
+from models import IncomingItem, Item, Location, OutgoingItem, StockBalance, User  # noqa: E402
+from benchmarks.common import timed  # noqa: E402
+import alerts  # noqa: E402
+import locations  # noqa: E402
+import lots  # noqa: E402
+import stats  # noqa: E402
+import stock  # noqa: E402
+
+
+def routes(location_id):
+    return [
+        f'/?location={location_id}',
+        f'/alerts?location={location_id}',
+        f'/items?location={location_id}',
+        f'/items?location={location_id}&sort=quantity',
+        f'/items?location={location_id}&search=kabel',
+        f'/incoming-items?location={location_id}',
+        f'/incoming-items?location={location_id}&page=50',
+        f'/outgoing-items?location={location_id}',
+        f'/transfers?location={location_id}',
+        '/items',
+        '/incoming-items',
+    ]
+
+
+def add_site(number, item_ids, stocked, movements, rng, days=365, batch=20000):
+    """Add a location stocking a sample of the catalog, with a year of its own movements"""
+    if number == 1:
+        location_id = locations.default_id()
+    else:
+        location_id = db.session.execute(Location.__table__.insert().values(
+            code=f'SITE-{number:03d}', name=f'Gudang {number:03d}')).inserted_primary_key[0]
+    balances = {item_id: rng.randint(0, 400) for item_id in rng.sample(item_ids, stocked)}
+    db.session.execute(StockBalance.__table__.insert(), [
+        {'location_id': location_id, 'item_id': item_id, 'quantity': quantity}
+        for item_id, quantity in balances.items()])
+    db.session.execute(Item.__table__.update().where(Item.id == bindparam('item'))
+                       .values(quantity=Item.quantity + bindparam('delta')),
+                       [{'item': item_id, 'delta': quantity} for item_id, quantity in balances.items()])
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(movements, 1)
+    stocked_ids = list(balances)
+    for offset in range(0, movements, batch):
+        incoming, outgoing = [], []
+        for n in range(offset, min(offset + batch, movements)):
+            when = start + step * n
+            item_id, quantity = rng.choice(stocked_ids), rng.randint(1, 20)
+            if rng.random() < 0.55:
+                incoming.append({'item_id': item_id, 'location_id': location_id, 'quantity': quantity,
+                                 'unit_price': round(rng.uniform(1000, 50000), 2),
+                                 'received_by': 'bench', 'received_date': when})
+            else:
+                outgoing.append({'item_id': item_id, 'location_id': location_id, 'quantity': quantity,
+                                 'destination': 'bench', 'purpose': 'bench', 'issued_by': 'bench',
+                                 'issued_date': when})
+        if incoming:
+            db.session.execute(IncomingItem.__table__.insert(), incoming)
+        if outgoing:
+            db.session.execute(OutgoingItem.__table__.insert(), outgoing)
+    db.session.commit()
+    return location_id
+
+
+def time_routes(client, paths, repeat):
+    results = {}
+    for path in paths:
+        def get():
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        get()
+        results[path] = timed(get, repeat)
+    return results
+
+
+def time_movements(location_id, other_id, repeat, rng):
+    """Median ms of a receipt, an issue and a transfer at location_id, each its own transaction"""
+    item_ids = [i for i, in db.session.execute(
+        select(StockBalance.item_id).where(StockBalance.location_id == location_id,
+                                           StockBalance.quantity > repeat * 2))]
+    header = {'issued_by': 'bench', 'destination': 'bench', 'purpose': 'bench'}
+    work = {
+        'receive_stock': lambda: stock.run_in_transaction(
+            stock.receive_stock, rng.choice(item_ids), 5, location_id=location_id,
+            unit_price=1000, received_by='bench'),
+        'issue_stock': lambda: stock.run_in_transaction(
+            stock.issue_stock, rng.choice(item_ids), 1, location_id=location_id, **header),
+        'transfer_stock': lambda: stock.run_in_transaction(
+            stock.transfer_stock, rng.choice(item_ids), 1, location_id, other_id, transferred_by='bench'),
+    }
+    return {name: timed(fn, repeat) for name, fn in work.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--sites', default='2,4,16', help='location counts to measure at')
+    parser.add_argument('--stocked', type=int, default=5000, help='items stocked at each location')
+    parser.add_argument('--movements', type=int, default=20000, help='movements per location')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    # Transfers need a second location to go to
+    checkpoints = sorted({max(int(n), 2) for n in args.sites.split(',')})
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    rng = random.Random(11)
+    with app.app_context():
+        seed_items(db, args.items)
+        # Every unit lives at some location; add_site books them there
+        db.session.execute(Item.__table__.update().values(quantity=0))
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        item_ids = [i for i, in db.session.execute(select(Item.id))]
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+
+        site_ids, results, movements = [], {}, {}
+        for count in checkpoints:
+            started = time.perf_counter()
+            while len(site_ids) < count:
+                site_ids.append(add_site(len(site_ids) + 1, item_ids, min(args.stocked, args.items),
+                                         args.movements, rng))
+            stats.reconcile()
+            alerts.rebuild()
+            lots.rebuild()
+            print(f'{count} locations: {db.session.scalar(select(func.count()).select_from(StockBalance))} balances, '
+                  f'{db.session.scalar(select(func.count()).select_from(IncomingItem))} receipts '
+                  f'(seeded in {time.perf_counter() - started:.1f}s)')
+            results[count] = time_routes(client, routes(site_ids[0]), args.repeat)
+            movements[count] = time_movements(site_ids[0], site_ids[1], args.repeat, rng)
+        assert not locations.check(), 'balances drifted from item quantities'
+
+    header = ''.join(f'{f"{count} loc ms":>12}' for count in checkpoints)
+    print(f'\nmedian latency at the first location\n{"route":<44}{header}')
+    for path in routes(site_ids[0]):
+        print(f'{path:<44}' + ''.join(f'{results[count][path][0]:>12.2f}' for count in checkpoints))
+    for name in movements[checkpoints[0]]:
+        print(f'{name:<44}' + ''.join(f'{movements[count][name][0]:>12.2f}' for count in checkpoints))
+
+
+if __name__ == '__main__':
+    main()
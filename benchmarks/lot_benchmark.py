@@ -0,0 +1,96 @@
+"""FEFO allocation latency against the number of lots an item has.
+
+For each lot count an item gets that many open lots at the default
+location, with random expiry dates, plus --closed fully issued lots per
+open one, which the open-lots index skips. Allocation is timed with the paged heap allocator, with a
+read and sort of every open lot for comparison, and end to end as a
+rolled-back issue_stock call.
+
+Usage: python -m benchmarks.lot_benchmark [--lots 10,100,1000,10000] [--closed 4] [--issue 12]
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+from benchmarks.common import setup_database, timed
+
+setup_database()
+
+from sqlalchemy import select  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Category, Item, IncomingItem, LotBalance  # noqa: E402
+import locations  # noqa: E402
+import lots  # noqa: E402
+import stock  # noqa: E402
+
+
+def seed_lots(category_id, code, count, closed, rng):
+    """An item with count open lots of 1-10 units and closed * count issued ones"""
+    item = Item(code=code, name=f'Lot benchmark {count}', quantity=0, unit_price=1000, category_id=category_id)
+    db.session.add(item)
+    db.session.flush()
+    today, now = date.today(), datetime.utcnow()
+    rows = []
+    for n in range(count * (closed + 1)):
+        quantity = rng.randint(1, 10)
+        rows.append({'item_id': item.id, 'quantity': quantity, 'unit_price': 1000, 'received_by': 'bench',
+                     'batch_number': f'{code}-{n}', 'received_date': now - timedelta(minutes=n),
+                     'expiry_date': today + timedelta(days=rng.randint(1, 720)) if rng.random() < 0.9 else None,
+                     'remaining': quantity if n % (closed + 1) == 0 else 0})
+    ids = db.session.execute(IncomingItem.__table__.insert().returning(IncomingItem.id, sort_by_parameter_order=True), rows).scalars().all()
+    location_id = locations.default_id()
+    db.session.execute(LotBalance.__table__.insert(), [
+        {'incoming_id': id, 'location_id': location_id, 'item_id': item.id,
+         'expiry_date': row['expiry_date'], 'remaining': row['remaining']}
+        for id, row in zip(ids, rows) if row['remaining']])
+    item.quantity = sum(row['remaining'] for row in rows)
+    db.session.commit()
+    return item.id
+
+
+def sorted_allocate(item_id, quantity):
+    """The straightforward way: read and sort every open lot, then walk the order"""
+    rows = db.session.execute(
+        select(LotBalance.incoming_id.label('id'), LotBalance.expiry_date, LotBalance.remaining)
+        .where(LotBalance.item_id == item_id, LotBalance.remaining > 0)).all()
+    split = []
+    for row in sorted(rows, key=lambda r: lots.fefo_key(r.expiry_date, r.id)):
+        if not quantity:
+            break
+        units = min(quantity, row.remaining)
+        split.append((row.id, units))
+        quantity -= units
+    return split
+
+
+def rolled_back_issue(item_id, quantity):
+    stock.issue_stock(item_id, quantity, destination='bench', issued_by='bench')
+    db.session.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lots', default='10,100,1000,10000', help='Comma-separated open lot counts')
+    parser.add_argument('--closed', type=int, default=4, help='Fully issued lots per open lot')
+    parser.add_argument('--issue', type=int, default=12, help='Units per issue (spans a few lots)')
+    args = parser.parse_args()
+    counts = [int(c) for c in args.lots.split(',')]
+
+    with app.app_context():
+        rng = random.Random(11)
+        category = Category(name='Lot benchmark')
+        db.session.add(category)
+        db.session.commit()
+        items = {count: seed_lots(category.id, f'LOT-{count}', count, args.closed, rng) for count in counts}
+
+        location_id = locations.default_id()
+        print(f'backend={db.engine.dialect.name} closed lots per open lot={args.closed} units per issue={args.issue}')
+        print(f'{"open lots":>10}{"heap ms":>12}{"sort ms":>12}{"issue_stock ms":>16}')
+        for count, item_id in items.items():
+            heap_ms = timed(lambda: lots.LotAllocator(location_id).allocate(item_id, args.issue))
+            sort_ms = timed(lambda: sorted_allocate(item_id, args.issue))
+            issue_ms = timed(lambda: rolled_back_issue(item_id, args.issue))
+            print(f'{count:>10}{heap_ms[0]:>12.2f}{sort_ms[0]:>12.2f}{issue_ms[0]:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
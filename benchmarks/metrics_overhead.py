@@ -0,0 +1,70 @@
+"""Cost of the request instrumentation on a rendered page.
+
+Renders the items page through the test client with the statement and
+request listeners removed, then with METRICS_SAMPLE_RATE 0 (latency only),
+0.1 and 1, and reports the median and p95 per request for each.
+
+Usage: python -m benchmarks.metrics_overhead [--items 2000] [--repeat 300]
+"""
+import argparse
+from benchmarks.common import seed_items, setup_database, timed
+
+setup_database()
+
+from flask import request_finished, request_started, before_render_template, template_rendered  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+from metrics import request_metrics  # noqa: E402
+
+SIGNALS = ((request_started, '_request_started'), (request_finished, '_request_finished'),
+           (before_render_template, '_before_render'), (template_rendered, '_after_render'))
+STATEMENT_EVENTS = (('before_cursor_execute', '_before_execute'), ('after_cursor_execute', '_after_execute'))
+
+
+def set_instrumented(engine, on):
+    for name, method in STATEMENT_EVENTS:
+        (event.listen if on else event.remove)(engine, name, getattr(request_metrics, method))
+    for signal, method in SIGNALS:
+        if on:
+            signal.connect(getattr(request_metrics, method), app)
+        else:
+            signal.disconnect(getattr(request_metrics, method), app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=300)
+    parser.add_argument('--path', default='/items')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        seed_items(db, args.items)
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        engine = db.engine
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+
+    def page():
+        assert client.get(args.path).status_code == 200
+
+    print(f'{args.path} over {args.repeat} requests')
+    print(f'{"instrumentation":<22}{"median ms":>12}{"p95 ms":>10}')
+    set_instrumented(engine, False)
+    page()
+    median, p95 = timed(page, args.repeat)
+    print(f'{"off":<22}{median:>12.2f}{p95:>10.2f}')
+    set_instrumented(engine, True)
+    for rate in (0, 0.1, 1):
+        request_metrics.sample_rate = rate
+        median, p95 = timed(page, args.repeat)
+        print(f'{f"sample rate {rate}":<22}{median:>12.2f}{p95:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Time to first byte and transfer size of each page, and of the static assets.
+
+Seeds a large synthetic inventory, serves the app from a threaded
+Werkzeug server in this process and requests each page over a keep-alive
+connection, three ways: rendered whole with no fragment cache (as before),
+rendered whole with warm row fragments, and streamed with warm fragments.
+Sizes are the bytes sent and what a gzip-compressing proxy would send.
+Then reports each static asset's identity, gzip and Brotli sizes and its
+Cache-Control.
+
+Usage: python -m benchmarks.page_benchmark [--items 50000] [--movements 200000] [--repeat 20]
+"""
+import argparse
+import gzip
+import logging
+import os
+import statistics
+import threading
+import time
+from benchmarks.common import setup_database, seed_items
+
+setup_database()
+os.environ.setdefault('ASSETS_FINGERPRINT', '1')
+os.environ.setdefault('ASSETS_DIR', os.path.join(os.path.dirname(setup_database().split('///', 1)[-1]), 'assets'))
+
+from werkzeug.serving import make_server  # noqa: E402
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+from rendering import fragment_cache  # noqa: E402
+from assets import static_assets  # noqa: E402
+from cache import MemoryBackend  # noqa: E402
+from benchmarks.ledger_benchmark import seed_movements  # noqa: E402
+from benchmarks.load_test import Client  # noqa: E402
+import ledger  # noqa: E402
+import lots  # noqa: E402
+import stats  # noqa: E402
+
+PAGES = ['/', '/items', '/items?per_page=200', '/incoming-items', '/incoming-items?page=500',
+         '/outgoing-items', '/outgoing-items?page=500', '/categories', '/activity-log']
+MODES = [('whole, no fragments', False, False), ('whole, fragments', False, True),
+         ('streamed, fragments', True, True)]
+
+
+def fetch(client, path):
+    """(ttfb ms, total ms, body) of one GET on the client's connection"""
+    headers = {'Cookie': '; '.join(f'{k}={v}' for k, v in client.cookies.items())}
+    started = time.perf_counter()
+    client.connection.request('GET', path, headers=headers)
+    response = client.connection.getresponse()
+    first = response.read(1)
+    ttfb = time.perf_counter() - started
+    body = first + response.read()
+    assert response.status == 200, (path, response.status)
+    return ttfb * 1000, (time.perf_counter() - started) * 1000, body
+
+
+def measure(client, paths, repeat):
+    results = {}
+    for path in paths:
+        fetch(client, path)
+        runs = [fetch(client, path) for _ in range(repeat)]
+        body = runs[-1][2]
+        results[path] = (statistics.median(r[0] for r in runs), statistics.median(r[1] for r in runs),
+                         len(body), len(gzip.compress(body, 6)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--movements', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        started = time.perf_counter()
+        seed_items(db, args.items)
+        ledger._open_balances()
+        seed_movements(args.items, args.movements, snapshots=0)
+        stats.reconcile()
+        lots.rebuild()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        print(f'seeded {args.items} items and {args.movements} movements in {time.perf_counter() - started:.1f}s')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Client(f'http://127.0.0.1:{server.server_port}')
+    assert client.login('bench', 'bench-password')
+
+    size = app.config['FRAGMENT_CACHE_SIZE'] or 4096
+    results = {}
+    for label, streamed, fragments in MODES:
+        app.config['STREAM_TEMPLATES'] = streamed
+        fragment_cache.backend = MemoryBackend(size) if fragments else None
+        results[label] = measure(client, PAGES, args.repeat)
+
+    print(f'\nmedian time to first byte / to last byte over {args.repeat} requests (ms); sizes in KiB, raw / gzip')
+    print(f'{"page":<28}' + ''.join(f'{label:>30}' for label, _, _ in MODES) + f'{"size":>16}')
+    for path in PAGES:
+        cells = ''.join(f'{f"{results[m][path][0]:.1f} / {results[m][path][1]:.1f}":>30}' for m, _, _ in MODES)
+        raw, packed = results[MODES[-1][0]][path][2:]
+        print(f'{path:<28}{cells}{f"{raw / 1024:.1f} / {packed / 1024:.1f}":>16}')
+
+    print(f'\n{"asset":<36}{"identity":>10}{"gzip":>8}{"br":>8}  cache-control')
+    for name, hashed in sorted(static_assets.manifest.items()):
+        sizes = []
+        for encoding in ('identity', 'gzip', 'br'):
+            client.connection.request('GET', f'/static/{hashed}', headers={'Accept-Encoding': encoding})
+            response = client.connection.getresponse()
+            body = response.read()
+            served = response.getheader('Content-Encoding', 'identity')
+            sizes.append(str(len(body)) if served == encoding else '-')
+        print(f'{name:<36}{sizes[0]:>10}{sizes[1]:>8}{sizes[2]:>8}  {response.getheader("Cache-Control")}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Time the valuation, turnover and ABC reports over a large movement history.
+
+The reports aggregate inside the database; for comparison the old per-row
+approach (ORM objects and the total_value property) is timed on the issues
+of the reporting month, up to --orm-limit rows.
+
+Usage: python -m benchmarks.report_benchmark [--movements 1000000] [--items 5000]
+       python -m benchmarks.report_benchmark --movements 10000000 --orm-limit 0
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from benchmarks.common import setup_database, seed_items
+
+setup_database()
+
+from sqlalchemy.orm import joinedload  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Item, OutgoingItem  # noqa: E402
+from benchmarks.ledger_benchmark import seed_movements  # noqa: E402
+import ledger  # noqa: E402
+import reports  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movements', type=int, default=1000000)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--snapshots', type=int, default=12)
+    parser.add_argument('--orm-limit', type=int, default=200000, help='0 skips the per-row baseline')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if Item.query.count() == 0:
+            started = time.perf_counter()
+            seed_items(db, args.items)
+            ledger._open_balances()
+            seed_movements(args.items, args.movements, args.snapshots)
+            print(f'seeded {args.movements} movements in {time.perf_counter() - started:.1f}s')
+        month = datetime.utcnow().strftime('%Y-%m')
+        out = tempfile.mkdtemp(prefix='inventory-reports-')
+        print(f'backend={db.engine.dialect.name} items={Item.query.count()} movements={args.movements} month={month}')
+        print(f'{"report":<28}{"seconds":>10}{"rows":>10}')
+        for kind, params in (('valuation', {'month': month}),
+                             ('turnover', {'month': month}),
+                             ('abc', {'month': month, 'months': 12})):
+            started = time.perf_counter()
+            rows = reports.write_csv(kind, os.path.join(out, f'{kind}.csv'), **params)
+            print(f'{kind:<28}{time.perf_counter() - started:>10.2f}{rows:>10}')
+
+        if args.orm_limit:
+            start, end = reports.month_bounds(month)
+            started = time.perf_counter()
+            totals = {}
+            query = (OutgoingItem.query.options(joinedload(OutgoingItem.item))
+                     .filter(OutgoingItem.issued_date >= start, OutgoingItem.issued_date < end)
+                     .limit(args.orm_limit))
+            count = 0
+            for outgoing in query:
+                totals[outgoing.item_id] = totals.get(outgoing.item_id, 0) + outgoing.total_value
+                count += 1
+            print(f'{"per-row ORM (issues only)":<28}{time.perf_counter() - started:>10.2f}{count:>10}')
+
+
+if __name__ == '__main__':
+    main()
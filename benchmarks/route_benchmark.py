@@ -0,0 +1,149 @@
+"""Latency of every page and JSON route before and after the hot-path index pack.
+
+Seeds a large synthetic inventory (items, a year of movements with their
+ledger, activity log entries), then times each route through the test
+client without the indexes revision 0003 added and again with them. The
+cache backend is off so every request reaches the database.
+
+Usage: python -m benchmarks.route_benchmark [--items 50000] [--movements 500000] [--activity 500000]
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from benchmarks.common import setup_database, seed_items
+
+setup_database()
+os.environ.setdefault('CACHE_BACKEND', 'null')
+
+from sqlalchemy import func, select  # noqa: E402
+from app import app, db  # noqa: E402
+from models import ActivityLog, Category, Item, User  # noqa: E402
+from benchmarks.common import timed  # noqa: E402
+from benchmarks.ledger_benchmark import seed_movements  # noqa: E402
+import alerts  # noqa: E402
+import api  # noqa: E402
+import ledger  # noqa: E402
+import lots  # noqa: E402
+import stats  # noqa: E402
+
+# The hot-path index pack of revision 0003, dropped for the "before" run;
+# later revisions build on its schema, so it is not downgraded as a whole
+INDEX_PACK = ['ix_items_category_name', 'ix_incoming_items_received_date', 'ix_outgoing_items_item_issued']
+
+
+def index_pack():
+    return [index for table in db.metadata.tables.values() for index in table.indexes if index.name in INDEX_PACK]
+
+
+def seed_activity(count, batch=20000, seed=3):
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=365)
+    step = timedelta(days=365) / max(count, 1)
+    for offset in range(0, count, batch):
+        db.session.execute(ActivityLog.__table__.insert(), [{
+            'action': rng.choice(['CREATE', 'UPDATE', 'DELETE']),
+            'table_name': rng.choice(['items', 'categories', 'incoming_items', 'outgoing_items']),
+            'record_id': rng.randint(1, 50000),
+            'details': 'bench',
+            'user': f'user{rng.randint(1, 20)}',
+            'timestamp': start + step * n,
+        } for n in range(offset, min(offset + batch, count))])
+        db.session.commit()
+
+
+def routes(item_id, category_id):
+    month_ago = (datetime.utcnow() - timedelta(days=30)).date().isoformat()
+    return [
+        '/',
+        '/alerts',
+        '/items',
+        f'/items?category={category_id}',
+        '/items?sort=quantity',
+        '/items?sort=updated_at&order=desc',
+        '/items?search=kabel',
+        '/items/lookup?q=kab',
+        f'/items/{item_id}/stock',
+        f'/items/{item_id}/stock?as_of={month_ago}',
+        f'/items/{item_id}/lots',
+        '/categories',
+        '/incoming-items',
+        '/incoming-items?page=200',
+        '/outgoing-items',
+        '/outgoing-items?page=200',
+        '/activity-log',
+        '/activity-log?table_name=items',
+        '/reports',
+        '/api/v1/items?limit=100',
+        f'/api/v1/items?category_id={category_id}&limit=100',
+        '/api/v1/incoming-items?limit=100',
+        '/api/v1/outgoing-items?limit=100',
+    ]
+
+
+def time_routes(client, paths, headers, repeat):
+    results = {}
+    for path in paths:
+        request_headers = headers if path.startswith('/api/') else {}
+
+        def get():
+            response = client.get(path, headers=request_headers)
+            assert response.status_code == 200, (path, response.status_code)
+        get()
+        results[path] = timed(get, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--movements', type=int, default=500000)
+    parser.add_argument('--activity', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        started = time.perf_counter()
+        seed_items(db, args.items, categories=args.categories)
+        ledger._open_balances()
+        seed_movements(args.items, args.movements, snapshots=0)
+        seed_activity(args.activity)
+        stats.reconcile()
+        alerts.rebuild()
+        lots.rebuild()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        db.session.commit()
+        token = api.issue_token(user)
+        # The busiest category and an item with a long history
+        category_id = db.session.scalar(select(Item.category_id).group_by(Item.category_id)
+                                        .order_by(func.count().desc()).limit(1))
+        item_id = db.session.scalar(select(Item.id).order_by(Item.id).limit(1))
+        print(f'seeded {args.items} items, {args.movements} movements, {args.activity} activity entries '
+              f'in {time.perf_counter() - started:.1f}s (backend={db.engine.dialect.name})')
+        print(f'categories={Category.query.count()}')
+
+        paths = routes(item_id, category_id)
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench', 'password': 'bench-password'})
+        headers = {'Authorization': f'Bearer {token}'}
+
+        for index in index_pack():
+            index.drop(db.engine)
+        before = time_routes(client, paths, headers, args.repeat)
+        for index in index_pack():
+            index.create(db.engine)
+        after = time_routes(client, paths, headers, args.repeat)
+
+    print(f'{"route":<44}{"before ms":>11}{"after ms":>10}{"speedup":>9}')
+    for path in paths:
+        (b, _), (a, _) = before[path], after[path]
+        print(f'{path:<44}{b:>11.2f}{a:>10.2f}{b / a:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
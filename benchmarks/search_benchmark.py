@@ -0,0 +1,47 @@
+"""Compare full-text item search against the old triple LIKE '%term%' scan.
+
+Usage: python -m benchmarks.search_benchmark [--items 150000]
+"""
+import argparse
+from benchmarks.common import setup_database, seed_items, timed
+
+setup_database()
+
+from sqlalchemy import or_  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Item  # noqa: E402
+from search import item_search  # noqa: E402
+
+TERMS = ['kabel', 'fib', 'router optik', 'TLK-0001234', 'jaringan splitter']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=150000)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if Item.query.count() == 0:
+            seed_items(db, args.items)
+            item_search.rebuild()
+        print(f'backend={item_search.dialect} fts={item_search.available} items={Item.query.count()}')
+        print(f'{"term":<22}{"LIKE median/p95 ms":>22}{"FTS median/p95 ms":>22}')
+        for term in TERMS:
+            def like():
+                Item.query.filter(or_(
+                    Item.code.contains(term),
+                    Item.name.contains(term),
+                    Item.description.contains(term)
+                )).order_by(Item.name).limit(args.limit).all()
+
+            def fts():
+                query, rank = item_search.apply(Item.query, term)
+                query.order_by(rank, Item.id).limit(args.limit).all()
+
+            like_ms, fts_ms = timed(like), timed(fts)
+            print(f'{term:<22}{like_ms[0]:>12.2f}/{like_ms[1]:<9.2f}{fts_ms[0]:>12.2f}/{fts_ms[1]:<9.2f}')
+
+
+if __name__ == '__main__':
+    main()
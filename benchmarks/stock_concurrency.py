@@ -0,0 +1,113 @@
+"""Multi-threaded stress test for stock movements.
+
+Several threads issue and receive stock against a handful of hot items. At
+the end every item's quantity must equal its opening balance plus the
+receipts minus the issues that were recorded, and must never be negative.
+--legacy runs the old read-check-write pattern for comparison, which loses
+updates and oversells under the same load.
+
+Usage: python -m benchmarks.stock_concurrency [--threads 8] [--ops 500] [--legacy]
+"""
+import argparse
+import random
+import threading
+import time
+from benchmarks.common import setup_database
+
+setup_database()
+
+from sqlalchemy import func  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Category, Item, IncomingItem, OutgoingItem  # noqa: E402
+import stock  # noqa: E402
+
+
+def legacy_issue(item_id, quantity, **fields):
+    item = db.session.get(Item, item_id)
+    if item.quantity < quantity:
+        raise stock.InsufficientStock(item, quantity)
+    item.quantity -= quantity
+    db.session.add(OutgoingItem(item_id=item_id, quantity=quantity, **fields))
+
+
+def legacy_receive(item_id, quantity, **fields):
+    item = db.session.get(Item, item_id)
+    item.quantity += quantity
+    db.session.add(IncomingItem(item_id=item_id, quantity=quantity, **fields))
+
+
+def worker(item_ids, ops, legacy, results, seed):
+    rng = random.Random(seed)
+    issue = legacy_issue if legacy else stock.issue_stock
+    receive = legacy_receive if legacy else stock.receive_stock
+    counts = {'issued': 0, 'received': 0, 'refused': 0, 'failed': 0}
+    with app.app_context():
+        for _ in range(ops):
+            item_id = rng.choice(item_ids)
+            quantity = rng.randint(1, 5)
+            try:
+                if rng.random() < 0.6:
+                    stock.run_in_transaction(issue, item_id, quantity, destination='bench')
+                    counts['issued'] += 1
+                else:
+                    stock.run_in_transaction(receive, item_id, quantity, unit_price=1.0)
+                    counts['received'] += 1
+            except stock.InsufficientStock:
+                counts['refused'] += 1
+            except Exception:
+                counts['failed'] += 1
+            finally:
+                db.session.remove()
+    results.append(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=500, help='movements per thread')
+    parser.add_argument('--items', type=int, default=4)
+    parser.add_argument('--opening', type=int, default=50)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    with app.app_context():
+        category = Category(name=f'bench-{time.time()}')
+        db.session.add(category)
+        db.session.flush()
+        items = [Item(code=f'HOT-{time.time()}-{i}', name=f'Hot item {i}', quantity=args.opening,
+                      unit_price=1.0, category_id=category.id) for i in range(args.items)]
+        db.session.add_all(items)
+        db.session.commit()
+        item_ids = [i.id for i in items]
+
+    results, threads = [], []
+    started = time.perf_counter()
+    for n in range(args.threads):
+        thread = threading.Thread(target=worker, args=(item_ids, args.ops, args.legacy, results, n))
+        threads.append(thread)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    totals = {k: sum(r[k] for r in results) for k in results[0]}
+    with app.app_context():
+        drift = 0
+        for item_id in item_ids:
+            quantity = db.session.get(Item, item_id).quantity
+            received = db.session.query(func.coalesce(func.sum(IncomingItem.quantity), 0)).filter_by(item_id=item_id).scalar()
+            issued = db.session.query(func.coalesce(func.sum(OutgoingItem.quantity), 0)).filter_by(item_id=item_id).scalar()
+            expected = args.opening + received - issued
+            if quantity != expected or quantity < 0:
+                drift += 1
+                print(f'  item {item_id}: quantity={quantity} expected={expected}')
+
+    movements = totals['issued'] + totals['received']
+    print(f"{'legacy' if args.legacy else 'atomic'}: {args.threads} threads, {movements} movements "
+          f'in {elapsed:.2f}s ({movements / elapsed:.0f}/s); refused={totals["refused"]} failed={totals["failed"]}')
+    print('OK: no lost updates or oversells' if drift == 0 else f'FAIL: {drift} items drifted')
+    return 0 if drift == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
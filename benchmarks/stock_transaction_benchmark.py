@@ -0,0 +1,57 @@
+"""Compare multi-line stock transactions with one transaction per line.
+
+Each work order issues --lines distinct items. The single-line path runs one
+retried transaction (UPDATE + INSERT + commit) per line; the multi-line path
+applies the whole order in one transaction with bulk inserts.
+
+Usage: python -m benchmarks.stock_transaction_benchmark [--orders 50] [--lines 40]
+"""
+import argparse
+import random
+import time
+from benchmarks.common import setup_database, seed_items
+
+setup_database()
+
+from app import app, db  # noqa: E402
+from models import Item  # noqa: E402
+import stock  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--lines', type=int, default=40)
+    parser.add_argument('--items', type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if Item.query.count() == 0:
+            seed_items(db, args.items)
+            db.session.execute(db.update(Item).values(quantity=1000000))
+            db.session.commit()
+        item_ids = [row.id for row in db.session.query(Item.id)]
+        rng = random.Random(7)
+        orders = [[{'item_id': i, 'quantity': rng.randint(1, 5)} for i in rng.sample(item_ids, args.lines)]
+                  for _ in range(args.orders)]
+        header = {'destination': 'Benchmark site', 'issued_by': 'bench'}
+
+        started = time.perf_counter()
+        for order in orders:
+            for line in order:
+                stock.run_in_transaction(stock.issue_stock, line['item_id'], line['quantity'], **header)
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for order in orders:
+            stock.run_in_transaction(stock.issue_lines, order, **header)
+        multi = time.perf_counter() - started
+
+    total = args.orders * args.lines
+    print(f'{args.orders} orders x {args.lines} lines')
+    print(f'single-line: {total / single:>8.0f} lines/s  {single / args.orders * 1000:>8.1f} ms/order')
+    print(f'multi-line:  {total / multi:>8.0f} lines/s  {multi / args.orders * 1000:>8.1f} ms/order')
+
+
+if __name__ == '__main__':
+    main()
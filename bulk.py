@@ -0,0 +1,381 @@
+import csv
+import io
+from collections import Counter
+from datetime import date, datetime
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from werkzeug.datastructures import MultiDict
+from app import db
+from models import Item, Category, IncomingItem, OutgoingItem, Location, StockBalance, DEFAULT_REORDER_LEVEL
+from forms import ItemForm, IncomingItemForm
+import stats
+import ledger
+import alerts
+import locations
+import lots
+from activity import activity_writer
+from cache import cache
+from feed import change_feed
+
+try:
+    import openpyxl
+except ImportError:  # XLSX support is optional
+    openpyxl = None
+
+CHUNK_SIZE = 1000
+
+# location is where a changed quantity was counted; rows without one book it at the default location
+ITEM_COLUMNS = ['code', 'name', 'description', 'quantity', 'reorder_level', 'unit_price', 'supplier', 'category',
+                'location']
+# location is a location code; rows without one are received at the default location
+INCOMING_COLUMNS = ['item_code', 'quantity', 'unit_price', 'supplier', 'batch_number',
+                    'expiry_date', 'notes', 'received_by', 'location']
+
+
+class BulkError(Exception):
+    """Raised when an import or export cannot run at all (as opposed to bad rows)"""
+
+
+class ImportReport:
+    """Outcome of an import: counts plus the per-row errors of rejected rows"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.batches = 0
+        self.errors = []
+
+    def reject(self, row_number, errors):
+        self.errors.append({'row': row_number, 'errors': errors})
+
+    @property
+    def rejected(self):
+        return len(self.errors)
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'errors': sorted(self.errors, key=lambda e: e['row']),
+        }
+
+
+# --- ROW VALIDATION ---
+# One form instance is built per import and re-processed for every row. Category
+# ids are checked with session.get, which the identity map answers after the
+# first row of each category.
+
+class ItemRowForm(ItemForm):
+    """ItemForm rules minus the location picker; import rows name the location by code"""
+    location_id = None
+
+
+class IncomingRowForm(IncomingItemForm):
+    """IncomingItemForm rules minus the item and location pickers; import rows name both by code"""
+    item_id = None
+    location_id = None
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+# --- READERS ---
+
+def read_rows(stream, filename):
+    """Yield dict rows from a CSV or XLSX file object without loading it whole"""
+    if filename.lower().endswith('.xlsx'):
+        if openpyxl is None:
+            raise BulkError('XLSX support requires the openpyxl package.')
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [_cell(h).lower() for h in next(rows, [])]
+            for values in rows:
+                if any(v is not None for v in values):
+                    yield dict(zip(header, (_cell(v) for v in values)))
+        finally:
+            workbook.close()
+        return
+    if isinstance(stream, io.TextIOBase):
+        text = stream
+    else:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    if reader.fieldnames:
+        reader.fieldnames = [f.strip().lower() for f in reader.fieldnames]
+    for row in reader:
+        yield {k: _cell(v) for k, v in row.items() if k}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for number, row in enumerate(rows, start=2):  # row 1 is the header
+        chunk.append((number, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- IMPORTS ---
+
+def _log_batch(table_name, user, details):
+    activity_writer.record('IMPORT', table_name, 0, details, user=user)
+
+
+def import_items(rows, user='System', chunk_size=CHUNK_SIZE):
+    """Validate item rows and upsert them by code, one transaction per chunk"""
+    report = ImportReport('items')
+    categories = {name.lower(): id for id, name in db.session.query(Category.id, Category.name)}
+    form = ItemRowForm(formdata=None, meta={'csrf': False})
+    location_ids = locations.ids_by_code()
+    default_location = locations.default_id()
+
+    for chunk in _chunks(rows, chunk_size):
+        valid, counted_at = {}, {}
+        for number, row in chunk:
+            report.rows += 1
+            category = row.get('category', '')
+            row = dict(row, category_id=row.get('category_id') or str(categories.get(category.lower(), '')))
+            form.process(MultiDict(row))
+            errors = {} if form.validate() else dict(form.errors)
+            location = (row.get('location') or '').strip()
+            if location and location.lower() not in location_ids:
+                errors['location'] = [f'Unknown location code {location}.']
+            if errors:
+                report.reject(number, errors)
+                continue
+            counted_at[form.code.data] = (number, location_ids[location.lower()] if location else default_location)
+            # Later rows for the same code win, as they would posted one at a time
+            valid[form.code.data] = {
+                'code': form.code.data,
+                'name': form.name.data,
+                'description': form.description.data,
+                'quantity': form.quantity.data,
+                'unit_price': form.unit_price.data,
+                'supplier': form.supplier.data,
+                'category_id': form.category_id.data,
+            }
+            # A file without the column leaves existing reorder levels alone
+            if form.reorder_level.data is not None and row.get('reorder_level') not in (None, ''):
+                valid[form.code.data]['reorder_level'] = form.reorder_level.data
+        if not valid:
+            continue
+
+        existing = {code: (id, quantity) for code, id, quantity in db.session.execute(
+            select(Item.code, Item.id, Item.quantity).where(Item.code.in_(list(valid)))
+        )}
+        # A lowered quantity is taken from the location it was counted at, which must hold the units
+        lowered = {code: (existing[code][0], counted_at[code][1]) for code, values in valid.items()
+                   if code in existing and values['quantity'] < existing[code][1]}
+        if lowered:
+            on_hand = {(item_id, location_id): quantity for item_id, location_id, quantity in db.session.execute(
+                select(StockBalance.item_id, StockBalance.location_id, StockBalance.quantity)
+                .where(tuple_(StockBalance.item_id, StockBalance.location_id).in_(list(lowered.values()))))}
+            for code, pair in lowered.items():
+                short, available = existing[code][1] - valid[code]['quantity'], on_hand.get(pair, 0)
+                if short > available:
+                    report.reject(counted_at[code][0], {'quantity': [
+                        f'Lowering the quantity by {short} needs that many units at the location; it has {available}.']})
+                    del valid[code]
+            if not valid:
+                continue
+        now = datetime.utcnow()
+        inserts = [dict({'reorder_level': DEFAULT_REORDER_LEVEL}, **values, created_at=now, updated_at=now)
+                   for code, values in valid.items() if code not in existing]
+        updates = [dict(values, id=existing[code][0], updated_at=now)
+                   for code, values in valid.items() if code in existing]
+        entries = [ledger.entry(existing[code][0], values['quantity'] - existing[code][1], 'import', 'items',
+                                existing[code][0], now)
+                   for code, values in valid.items() if code in existing]
+        new_ids = []
+        if inserts:
+            new_ids = db.session.scalars(
+                insert(Item).returning(Item.id, sort_by_parameter_order=True), inserts).all()
+            entries += [ledger.entry(id, values['quantity'], 'import', 'items', id, now)
+                        for id, values in zip(new_ids, inserts)]
+        if updates:
+            db.session.execute(update(Item), updates)
+        stats.apply_deltas(db.session.connection(), counters={'items': len(inserts)})
+        ledger.record(db.session.connection(), entries)
+        # Imported quantities are counts, not movements, so each change lands where the row says it was counted
+        location_of = {existing[code][0]: counted_at[code][1] for code in valid if code in existing}
+        location_of.update((id, counted_at[values['code']][1]) for id, values in zip(new_ids, inserts))
+        locations.apply(db.session.connection(), {(e['item_id'], location_of[e['item_id']]): e['delta'] for e in entries})
+        lots.trim([(values['id'], location_of[values['id']]) for values in updates])
+        cache.mark(db.session, Item, Category)
+        alerts.mark(db.session, new_ids + [values['id'] for values in updates])
+        change_feed.mark(db.session, 'items', new_ids + [values['id'] for values in updates])
+        _log_batch('items', user, f'Imported {len(inserts)} new and {len(updates)} updated items')
+        db.session.commit()
+        report.created += len(inserts)
+        report.updated += len(updates)
+        report.batches += 1
+    return report
+
+
+def import_incoming(rows, user='System', chunk_size=CHUNK_SIZE):
+    """Validate incoming stock rows, record them and add their quantities to stock"""
+    report = ImportReport('incoming_items')
+    form = IncomingRowForm(formdata=None, meta={'csrf': False})
+    location_ids = locations.ids_by_code()
+    default_location = locations.default_id()
+
+    for chunk in _chunks(rows, chunk_size):
+        parsed = []
+        for number, row in chunk:
+            report.rows += 1
+            form.process(MultiDict(dict(row, received_by=row.get('received_by') or user)))
+            errors = {} if form.validate() else dict(form.errors)
+            if not row.get('item_code'):
+                errors['item_code'] = ['This field is required.']
+            location = (row.get('location') or '').strip()
+            if location and location.lower() not in location_ids:
+                errors['location'] = [f'Unknown location code {location}.']
+            if errors:
+                report.reject(number, errors)
+                continue
+            parsed.append((number, row['item_code'], {
+                'quantity': form.quantity.data,
+                'unit_price': form.unit_price.data,
+                'supplier': form.supplier.data,
+                'batch_number': form.batch_number.data,
+                'expiry_date': form.expiry_date.data,
+                'notes': form.notes.data,
+                'received_by': form.received_by.data,
+                'location_id': location_ids[location.lower()] if location else default_location,
+            }))
+        if not parsed:
+            continue
+
+        item_ids = dict(db.session.execute(
+            select(Item.code, Item.id).where(Item.code.in_({code for _, code, _ in parsed}))
+        ).all())
+        now = datetime.utcnow()
+        inserts, received, balances, daily = [], Counter(), Counter(), Counter()
+        for number, code, values in parsed:
+            if code not in item_ids:
+                report.reject(number, {'item_code': [f'Unknown item code {code}.']})
+                continue
+            inserts.append(dict(values, item_id=item_ids[code], received_date=now))
+            received[item_ids[code]] += values['quantity']
+            balances[(item_ids[code], values['location_id'])] += values['quantity']
+            daily[(now.date(), 'incoming')] += 1
+            daily[(now.date(), stats.scoped('incoming', values['location_id']))] += 1
+        if not inserts:
+            continue
+
+        incoming_ids = db.session.scalars(
+            insert(IncomingItem).returning(IncomingItem.id, sort_by_parameter_order=True), inserts).all()
+        db.session.execute(
+            update(Item.__table__)
+            .where(Item.__table__.c.id == bindparam('item_id'))
+            .values(quantity=Item.__table__.c.quantity + bindparam('received'), updated_at=now),
+            [{'item_id': id, 'received': qty} for id, qty in received.items()]
+        )
+        locations.apply(db.session.connection(), balances)
+        lots.place(db.session.connection(), [
+            {'incoming_id': id, 'location_id': row['location_id'], 'item_id': row['item_id'],
+             'expiry_date': row['expiry_date'], 'remaining': row['quantity']}
+            for row, id in zip(inserts, incoming_ids)])
+        stats.apply_deltas(db.session.connection(), daily=daily)
+        ledger.record(db.session.connection(), [
+            ledger.entry(row['item_id'], row['quantity'], 'incoming', 'incoming_items', id, now)
+            for row, id in zip(inserts, incoming_ids)])
+        cache.mark(db.session, Item)
+        alerts.mark(db.session, received)
+        change_feed.mark(db.session, 'items', received)
+        change_feed.mark(db.session, 'incoming-items', incoming_ids)
+        _log_batch('incoming_items', user,
+                   f'Imported {len(inserts)} incoming records across {len(received)} items')
+        db.session.commit()
+        report.created += len(inserts)
+        report.batches += 1
+    return report
+
+
+IMPORTERS = {'items': import_items, 'incoming': import_incoming}
+
+
+# --- EXPORTS ---
+
+EXPORTS = {
+    'items': (
+        ['code', 'name', 'description', 'quantity', 'reorder_level', 'unit_price', 'supplier', 'category'],
+        lambda: select(Item.code, Item.name, Item.description, Item.quantity, Item.reorder_level, Item.unit_price,
+                       Item.supplier, Category.name)
+        .join(Category, Item.category_id == Category.id).order_by(Item.id),
+    ),
+    'incoming': (
+        ['received_date', 'item_code', 'quantity', 'unit_price', 'supplier', 'batch_number',
+         'expiry_date', 'notes', 'received_by', 'location'],
+        lambda: select(IncomingItem.received_date, Item.code, IncomingItem.quantity, IncomingItem.unit_price,
+                       IncomingItem.supplier, IncomingItem.batch_number, IncomingItem.expiry_date,
+                       IncomingItem.notes, IncomingItem.received_by, Location.code)
+        .join(Item, IncomingItem.item_id == Item.id)
+        .outerjoin(Location, IncomingItem.location_id == Location.id).order_by(IncomingItem.id),
+    ),
+    'outgoing': (
+        ['issued_date', 'item_code', 'quantity', 'destination', 'purpose', 'request_number',
+         'notes', 'issued_by', 'location'],
+        lambda: select(OutgoingItem.issued_date, Item.code, OutgoingItem.quantity, OutgoingItem.destination,
+                       OutgoingItem.purpose, OutgoingItem.request_number, OutgoingItem.notes,
+                       OutgoingItem.issued_by, Location.code)
+        .join(Item, OutgoingItem.item_id == Item.id)
+        .outerjoin(Location, OutgoingItem.location_id == Location.id).order_by(OutgoingItem.id),
+    ),
+}
+
+
+def export_rows(kind, batch_size=CHUNK_SIZE):
+    """Yield the header and then plain row tuples, fetched from a server-side cursor in batches"""
+    if kind not in EXPORTS:
+        raise BulkError(f'Unknown export {kind!r}.')
+    header, statement = EXPORTS[kind]
+    yield header
+    result = db.session.execute(statement().execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        for row in partition:
+            yield tuple(row)
+
+
+def iter_csv(kind, batch_size=CHUNK_SIZE):
+    """Yield CSV text a batch of rows at a time, for streaming responses"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in enumerate(export_rows(kind, batch_size)):
+        writer.writerow(row)
+        if number % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_xlsx(kind, path, batch_size=CHUNK_SIZE):
+    """Write an export to an XLSX file using openpyxl's write-only mode"""
+    if openpyxl is None:
+        raise BulkError('XLSX support requires the openpyxl package.')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(kind)
+    count = -1
+    for count, row in enumerate(export_rows(kind, batch_size)):
+        sheet.append(list(row))
+    workbook.save(path)
+    return max(count, 0)
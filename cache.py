@@ -0,0 +1,317 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import make_response, request, session as flask_session
+from sqlalchemy import event
+from app import db
+from models import Category, Item, Location
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """Thread-safe in-process LRU with per-entry TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileBackend:
+    """Pickle-per-key cache in a local directory, shared by every worker on the host.
+
+    Writes go through a temp file and os.replace, so readers never see a
+    partial entry. The oldest files are pruned once max_entries is exceeded.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        if expires_at is not None and expires_at < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return _MISSING
+        return value
+
+    def set(self, key, value, ttl=None):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time() + ttl if ttl else None, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            logger.exception('Could not write cache entry %s', key)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.cache'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+        excess = len(entries) - self.max_entries
+        if excess > 0:
+            for _, path in sorted(entries)[:excess]:
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    pass
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.cache'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+
+class NullBackend:
+    evictions = 0
+
+    def get(self, key):
+        return _MISSING
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def clear(self):
+        pass
+
+
+class Cache:
+    """Entity-versioned cache.
+
+    Every cached value belongs to one or more entities ('categories',
+    'items'). Each entity has a version, the time of its last change, which
+    is stored in the backend so all workers sharing it agree. The version is
+    part of every key, so invalidating an entity is a single version bump
+    and stale entries simply stop being addressed until they age out.
+    Versions double as Last-Modified times for conditional responses.
+    """
+
+    # Which entities a change to each model invalidates
+    ENTITIES = {Category: ('categories',), Item: ('items',), Location: ('locations',)}
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.default_ttl = 300
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0}
+
+    def init_app(self, app):
+        kind = app.config.setdefault('CACHE_BACKEND', 'memory')
+        max_entries = app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+        self.default_ttl = app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+        if kind == 'memory':
+            self.backend = MemoryBackend(max_entries)
+        elif kind == 'file':
+            app.config['CACHE_DIR'] = app.config.get('CACHE_DIR') or os.path.join(app.instance_path, 'cache')
+            self.backend = FileBackend(app.config['CACHE_DIR'], max_entries)
+        elif kind == 'null':
+            self.backend = NullBackend()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {kind!r}')
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'do_orm_execute', self._on_orm_execute)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        app.extensions['cache'] = self
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    # --- VERSIONS ---
+
+    def version(self, entity):
+        value = self.backend.get(f'version:{entity}')
+        if value is _MISSING:
+            # Unknown (cold cache or evicted): start a fresh version so nothing stale is served
+            value = time.time()
+            self.backend.set(f'version:{entity}', value)
+        return value
+
+    def invalidate(self, *entities):
+        now = time.time()
+        for entity in entities:
+            self.backend.set(f'version:{entity}', now)
+        self._count('invalidations', len(entities))
+
+    def last_modified(self, *entities):
+        return datetime.fromtimestamp(max(self.version(e) for e in entities), timezone.utc)
+
+    # --- VALUES ---
+
+    def _key(self, entities, name):
+        versions = ','.join(f'{e}@{self.version(e)!r}' for e in entities)
+        return f'{name}|{versions}'
+
+    def get_or_set(self, entities, name, producer, ttl=None):
+        """Return the cached value of name under entities, computing it with producer on a miss"""
+        if isinstance(entities, str):
+            entities = (entities,)
+        key = self._key(entities, name)
+        value = self.backend.get(key)
+        if value is not _MISSING:
+            self._count('hits')
+            return value
+        self._count('misses')
+        value = producer()
+        self.backend.set(key, value, ttl or self.default_ttl)
+        self._count('sets')
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    def metrics(self):
+        with self._lock:
+            data = dict(self._metrics)
+        data['evictions'] = self.backend.evictions
+        lookups = data['hits'] + data['misses']
+        data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
+
+    # --- WRITE-DRIVEN INVALIDATION ---
+    # Changed entities are collected while the transaction runs and only
+    # invalidated once it commits, so a rollback leaves the cache untouched.
+
+    def mark(self, session, *models):
+        """Invalidate the entities of models when session next commits.
+
+        Flushed ORM objects and ORM-enabled UPDATE/DELETE/INSERT statements
+        are tracked automatically; Core statements against a Table must call
+        this themselves.
+        """
+        for model in models:
+            entities = self.ENTITIES.get(model)
+            if entities:
+                session.info.setdefault('cache_dirty', set()).update(entities)
+
+    def _after_flush(self, session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            self.mark(session, type(obj))
+            # Adding, removing or moving an item changes category item counts
+            if isinstance(obj, Item) and (obj in session.new or obj in session.deleted
+                                          or db.inspect(obj).attrs.category_id.history.has_changes()):
+                self.mark(session, Category)
+
+    def _on_orm_execute(self, state):
+        if state.is_update or state.is_delete or state.is_insert:
+            for mapper in state.all_mappers:
+                self.mark(state.session, mapper.class_)
+
+    def _after_commit(self, session):
+        entities = session.info.pop('cache_dirty', None)
+        if entities:
+            self.invalidate(*entities)
+
+    def _after_rollback(self, session):
+        session.info.pop('cache_dirty', None)
+
+
+cache = Cache()
+
+
+# --- CONDITIONAL RESPONSES ---
+
+def page_etag(*parts):
+    """Weak validator for a rendered page: the entity versions plus the viewer"""
+    raw = '|'.join(str(p) for p in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def not_modified(etag, last_modified):
+    """Return a 304 response when the request's validators still match, else None.
+
+    Pages with pending flash messages are always rendered, since the
+    message is part of the body the browser has not seen yet.
+    """
+    if flask_session.get('_flashes'):
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_validators(make_response('', 304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    """Attach ETag/Last-Modified and make browsers revalidate on every use"""
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,202 @@
+import time
+from datetime import datetime, timedelta
+import click
+from app import app, db
+from search import item_search
+import stats
+import bulk
+import ledger
+import alerts
+import lots
+import locations
+import reports
+from archive import activity_archive
+from assets import static_assets
+from feed import change_feed
+from models import User, Location
+import api
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Rebuild the full-text item search index"""
+    if not item_search.available:
+        raise click.ClickException(f'No full-text index on the {item_search.dialect} backend; '
+                                   'it is created by flask db upgrade where the backend supports one.')
+    started = time.perf_counter()
+    item_search.rebuild()
+    click.echo(f'Search index rebuilt in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('reconcile-dashboard-stats')
+def reconcile_dashboard_stats():
+    """Rebuild the dashboard summary store from the base tables"""
+    started = time.perf_counter()
+    stats.reconcile()
+    summary = stats.dashboard_summary()
+    click.echo(f'Dashboard stats rebuilt in {time.perf_counter() - started:.2f}s: '
+               + ', '.join(f'{k}={v}' for k, v in summary.items()))
+
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock():
+    """Snapshot the quantity of every item changed since the last snapshot"""
+    started = time.perf_counter()
+    written = ledger.take_snapshots()
+    click.echo(f'{written} item snapshots written in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('check-stock-ledger')
+@click.option('--fix', is_flag=True, help='Append correction entries for every drifted item')
+def check_stock_ledger(fix):
+    """Recompute every item's quantity from the stock ledger and report drift"""
+    started = time.perf_counter()
+    drifted = ledger.check(fix=fix)
+    for d in drifted:
+        click.echo(f"  {d['code']} (#{d['item_id']}): items={d['quantity']} ledger={d['ledger']} drift={d['drift']:+d}", err=True)
+    click.echo(f'{len(drifted)} items drifted{" (corrected)" if fix and drifted else ""}, '
+               f'checked in {time.perf_counter() - started:.2f}s')
+    if drifted and not fix:
+        raise SystemExit(1)
+
+
+@app.cli.command('rebuild-stock-alerts')
+def rebuild_stock_alerts():
+    """Recompute the low-stock alert sets from every item's quantity, and every balance, against its reorder level"""
+    started = time.perf_counter()
+    alerts.rebuild()
+    click.echo(f'{alerts.low_stock_count()} low-stock items found in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('rebuild-lots')
+def rebuild_lots():
+    """Reset lot balances from each location's stock, assuming its newest receipts are on hand"""
+    started = time.perf_counter()
+    changed = lots.rebuild()
+    click.echo(f'{changed} lot balances corrected in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('create-location')
+@click.argument('code')
+@click.argument('name')
+@click.option('--description', default=None)
+def create_location(code, name, description):
+    """Add a stock location that movements, transfers and listings can name"""
+    if Location.query.filter_by(code=code).first() is not None:
+        raise click.ClickException(f'Location {code} already exists.')
+    location = Location(code=code, name=name, description=description)
+    db.session.add(location)
+    db.session.commit()
+    click.echo(f'Created location {location.code} (#{location.id})')
+
+
+@app.cli.command('check-stock-locations')
+@click.option('--fix', is_flag=True, help='Book every drift at the default location')
+def check_stock_locations(fix):
+    """Compare every item's quantity with the sum of its location balances and report drift"""
+    started = time.perf_counter()
+    drifted = locations.check(fix=fix)
+    for d in drifted:
+        click.echo(f"  {d['code']} (#{d['item_id']}): items={d['quantity']} balances={d['balances']} drift={d['drift']:+d}", err=True)
+    click.echo(f'{len(drifted)} items drifted{" (corrected)" if fix and drifted else ""}, '
+               f'checked in {time.perf_counter() - started:.2f}s')
+    if drifted and not fix:
+        raise SystemExit(1)
+
+@app.cli.command('create-api-token')
+@click.argument('username')
+def create_api_token(username):
+    """Print an API token for a user, valid for API_TOKEN_MAX_AGE seconds"""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}.')
+    click.echo(api.issue_token(user))
+
+
+@app.cli.command('run-report')
+@click.argument('kind', type=click.Choice(sorted(reports.REPORTS)))
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--month', required=True, help='Reporting month, YYYY-MM')
+@click.option('--months', type=int, default=12, show_default=True, help='Period length for the ABC report')
+def run_report(kind, path, month, months):
+    """Write a valuation, turnover or ABC report to a CSV file"""
+    params = {'month': month}
+    if kind == 'abc':
+        params['months'] = months
+    started = time.perf_counter()
+    try:
+        rows = reports.write_csv(kind, path, **params)
+    except reports.ReportError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{rows} rows written to {path} in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('import-data')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(sorted(bulk.IMPORTERS)), default='items', show_default=True)
+@click.option('--chunk-size', type=int, default=bulk.CHUNK_SIZE, show_default=True)
+@click.option('--user', default='System', show_default=True, help='Name recorded in the activity log')
+def import_data(path, kind, chunk_size, user):
+    """Bulk import items or incoming stock from a CSV/XLSX file"""
+    started = time.perf_counter()
+    with open(path, 'rb') as stream:
+        try:
+            report = bulk.IMPORTERS[kind](bulk.read_rows(stream, path), user=user, chunk_size=chunk_size)
+        except bulk.BulkError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'{report.rows} rows in {time.perf_counter() - started:.2f}s: {report.created} created, '
+               f'{report.updated} updated, {report.rejected} rejected, {report.batches} batches')
+    for error in report.errors:
+        messages = '; '.join(f"{field}: {' '.join(msgs)}" for field, msgs in error['errors'].items())
+        click.echo(f"  row {error['row']}: {messages}", err=True)
+
+
+@app.cli.command('export-data')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--kind', type=click.Choice(sorted(bulk.EXPORTS)), default='items', show_default=True)
+def export_data(path, kind):
+    """Export items or stock movements to a CSV or XLSX file"""
+    started = time.perf_counter()
+    try:
+        if path.lower().endswith('.xlsx'):
+            bulk.write_xlsx(kind, path)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as out:
+                for chunk in bulk.iter_csv(kind):
+                    out.write(chunk)
+    except bulk.BulkError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Exported {kind} to {path} in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('archive-activity-log')
+@click.option('--days', type=int, default=None, help='Keep this many days in the live log (default: ACTIVITY_LOG_RETENTION_DAYS)')
+@click.option('--batch-size', type=int, default=5000, show_default=True)
+def archive_activity_log(days, batch_size):
+    """Move old activity log rows into compressed monthly archives"""
+    started = time.perf_counter()
+    before = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    archived = activity_archive.archive(before=before, batch_size=batch_size)
+    click.echo(f'Archived {sum(archived.values())} rows in {time.perf_counter() - started:.2f}s'
+               + ''.join(f'\n  {month}: {count}' for month, count in sorted(archived.items())))
+
+
+@app.cli.command('prune-change-feed')
+@click.option('--days', type=int, default=None, help='Keep this many days of changes (default: FEED_RETENTION_DAYS)')
+def prune_change_feed(days):
+    """Delete old change feed entries; consumers behind the cutoff must resync"""
+    started = time.perf_counter()
+    deleted = change_feed.prune(days)
+    click.echo(f'Pruned {deleted} change feed entries in {time.perf_counter() - started:.2f}s')
+
+
+@app.cli.command('build-assets')
+@click.option('--force', is_flag=True, help='Rewrite compressed variants that already exist.')
+def build_assets(force):
+    """Fingerprint static files and precompress them into ASSETS_DIR"""
+    started = time.perf_counter()
+    written = static_assets.build(force=force)
+    for name, size, compressed in written:
+        click.echo(f'  {name}: {size} -> {compressed} bytes')
+    click.echo(f'{len(static_assets.manifest)} assets, {len(written)} variants written '
+               f'in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,163 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """Settings shared by every profile; each can be overridden from the environment"""
+
+    DEBUG = False
+    LOG_LEVEL = 'INFO'
+    SECRET_KEY = os.environ.get('SESSION_SECRET', 'telkom-inventory-secret-key')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///telkom_inventory.db')
+    ACTIVITY_LOG_MODE = os.environ.get('ACTIVITY_LOG_MODE', 'transaction')
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+
+    # --- CONNECTION POOL ---
+    # Per worker process: a worker holds at most DB_POOL_SIZE + DB_MAX_OVERFLOW
+    # connections, so size the pool to its threads, not to the whole server.
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 300)
+    # A SELECT 1 per checkout guards against connections dropped by a database
+    # server; a SQLite file has no server to drop them, so it is off there.
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', None)
+    # Run pending migrations when the app starts (one process only; production
+    # runs flask db upgrade once before starting the workers instead)
+    DB_AUTO_MIGRATE = _env_bool('DB_AUTO_MIGRATE', False)
+
+    # --- SQLITE ---
+    # WAL lets readers carry on while one writer commits; NORMAL sync is
+    # crash-safe under WAL and skips an fsync per commit.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = _env_int('SQLITE_BUSY_TIMEOUT', 5000)
+    # Negative cache_size is in KiB: 16 MiB of page cache per connection
+    SQLITE_CACHE_SIZE = _env_int('SQLITE_CACHE_SIZE', -16000)
+    SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+
+    # --- STORAGE ---
+    # Directories the app writes at runtime; None puts each under the
+    # instance folder (instance/cache, instance/assets, ...)
+    CACHE_DIR = os.environ.get('CACHE_DIR') or None
+    ASSETS_DIR = os.environ.get('ASSETS_DIR') or None
+    REPORT_DIR = os.environ.get('REPORT_DIR') or None
+    ACTIVITY_ARCHIVE_DIR = os.environ.get('ACTIVITY_ARCHIVE_DIR') or None
+    # Report jobs run at once per worker process; 0 runs them inline
+    REPORT_WORKERS = _env_int('REPORT_WORKERS', 2)
+    # A job still queued or running this long after it was last touched was
+    # lost with the worker that ran it (gunicorn recycles workers)
+    REPORT_JOB_TIMEOUT = _env_int('REPORT_JOB_TIMEOUT', 3600)
+    ACTIVITY_LOG_RETENTION_DAYS = _env_int('ACTIVITY_LOG_RETENTION_DAYS', 90)
+
+    # --- API AND CHANGE FEED ---
+    API_TOKEN_MAX_AGE = _env_int('API_TOKEN_MAX_AGE', 30 * 24 * 3600)
+    FEED_POLL_INTERVAL = _env_float('FEED_POLL_INTERVAL', 0.5)
+    FEED_RETENTION_DAYS = _env_int('FEED_RETENTION_DAYS', 30)
+    FEED_STREAM_SECONDS = _env_int('FEED_STREAM_SECONDS', 300)
+
+    # --- INSTRUMENTATION ---
+    # Every request's latency is recorded; this fraction also records its SQL
+    # and template timings. Slow statements are logged whatever the sample.
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+    SLOW_QUERY_MS = _env_int('SLOW_QUERY_MS', 250)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+    # --- AUTHENTICATION ---
+    # Logged-in users are resolved from a per-process cache; 0 turns it off.
+    # Other workers see a user change within AUTH_USER_CACHE_TTL seconds.
+    AUTH_USER_CACHE_SIZE = _env_int('AUTH_USER_CACHE_SIZE', 1024)
+    AUTH_USER_CACHE_TTL = _env_int('AUTH_USER_CACHE_TTL', 60)
+    # Any Werkzeug method with its cost, e.g. 'scrypt:16384:8:1' or
+    # 'pbkdf2:sha256:600000'; stored hashes are upgraded at the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+    # --- RENDERING ---
+    # Listing pages are sent while they render, header first. Table rows are
+    # cached as rendered HTML, keyed on the data they show.
+    STREAM_TEMPLATES = _env_bool('STREAM_TEMPLATES', True)
+    FRAGMENT_CACHE_SIZE = _env_int('FRAGMENT_CACHE_SIZE', 4096)
+    # Static URLs carry a content hash and are cached by browsers for a year
+    ASSETS_FINGERPRINT = _env_bool('ASSETS_FINGERPRINT', True)
+
+    # --- LOCATIONS ---
+    # Code of the location that movements without one, and direct quantity
+    # edits, are booked at; the migration creates it
+    DEFAULT_LOCATION = os.environ.get('DEFAULT_LOCATION', 'MAIN')
+    # How far ahead the dashboard looks for expiring batches
+    ALERT_EXPIRY_DAYS = _env_int('ALERT_EXPIRY_DAYS', 30)
+
+
+class DevelopmentConfig(Config):
+    APP_ENV = 'development'
+    DEBUG = _env_bool('FLASK_DEBUG', True)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    ASSETS_FINGERPRINT = _env_bool('ASSETS_FINGERPRINT', False)
+    DB_AUTO_MIGRATE = _env_bool('DB_AUTO_MIGRATE', True)
+
+
+class ProductionConfig(Config):
+    APP_ENV = 'production'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    # Every worker process has its own memory, so the per-process cache would
+    # miss invalidations made by the others; the file backend is shared.
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
+
+
+def load_config(name=None):
+    """The settings class for a profile name, APP_ENV by default"""
+    name = name or os.environ.get('APP_ENV', 'development')
+    if name not in CONFIGS:
+        raise ValueError(f'APP_ENV must be one of {sorted(CONFIGS)}, not {name!r}')
+    return CONFIGS[name]
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the pool settings of a loaded config"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    sqlite = uri.startswith('sqlite')
+    pre_ping = config['DB_POOL_PRE_PING']
+    options = {
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': not sqlite if pre_ping is None else pre_ping,
+    }
+    # An in-memory SQLite database lives in a single shared connection
+    if not (sqlite and (':memory:' in uri or uri.rstrip('/') == 'sqlite:')):
+        options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                       pool_timeout=config['DB_POOL_TIMEOUT'])
+    return options
+
+
+def sqlite_pragmas(config):
+    """The PRAGMA statements run on every new SQLite connection"""
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        'PRAGMA temp_store=MEMORY',
+    ]
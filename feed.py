@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, select, text
+from app import db
+from models import Item, Category, IncomingItem, OutgoingItem, Location, StockTransfer, ChangeFeedEntry
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'feed_changes'
+HEAD_KEY = 'feed_head'
+# Synced models under the names the API serves them as
+ENTITIES = {Item: 'items', Category: 'categories', IncomingItem: 'incoming-items', OutgoingItem: 'outgoing-items',
+            Location: 'locations', StockTransfer: 'transfers'}
+# Any constant will do; it only has to be the same for every writer
+PG_LOCK_KEY = 7_301_017
+
+
+class FeedGone(Exception):
+    """The cursor is older than the retained feed; the consumer has to resync in full"""
+
+
+class ChangeFeed:
+    """Record every insert, update and delete of the synced models, in commit order.
+
+    Writers mark changed records on the session (the ORM flush does this by
+    itself; bulk statements call mark()). Just before COMMIT the marks are
+    coalesced to one entry per record and inserted with an autoincrement
+    id, which is the consumer's cursor. On PostgreSQL the insert runs under
+    a transaction-level advisory lock, so ids are handed out in commit order
+    and a consumer can never skip past a row that commits late; SQLite
+    serialises writers anyway.
+
+    Waiting consumers (long-poll, SSE) block on a condition rather than the
+    database. Local commits wake them at once; commits from other processes
+    are noticed by one watcher thread per process that reads the feed head
+    every FEED_POLL_INTERVAL seconds while anyone is waiting.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 0.5
+        self.retention_days = 30
+        self.head = 0
+        self.waiters = 0
+        self._condition = threading.Condition()
+        self._watcher = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.setdefault('FEED_POLL_INTERVAL', 0.5)
+        self.retention_days = app.config.setdefault('FEED_RETENTION_DAYS', 30)
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'before_commit', self._before_commit)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        app.extensions['change_feed'] = self
+
+    # --- RECORDING ---
+
+    def mark(self, session, entity, ids, op='upsert'):
+        """Record a change of each of ids when session commits"""
+        pending = session.info.setdefault(PENDING_KEY, {})
+        for id in ids:
+            pending[(entity, id)] = op
+
+    def _after_flush(self, session, flush_context):
+        for obj in session.new:
+            if type(obj) in ENTITIES:
+                self.mark(session, ENTITIES[type(obj)], [obj.id])
+        for obj in session.dirty:
+            if type(obj) in ENTITIES and session.is_modified(obj, include_collections=False):
+                self.mark(session, ENTITIES[type(obj)], [obj.id])
+        for obj in session.deleted:
+            if type(obj) in ENTITIES:
+                self.mark(session, ENTITIES[type(obj)], [obj.id], 'delete')
+
+    def _before_commit(self, session):
+        session.flush()
+        pending = session.info.pop(PENDING_KEY, None)
+        if not pending:
+            return
+        connection = session.connection()
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PG_LOCK_KEY})
+        now = datetime.utcnow()
+        ids = session.scalars(
+            insert(ChangeFeedEntry).returning(ChangeFeedEntry.id),
+            [{'entity': entity, 'record_id': id, 'op': op, 'changed_at': now}
+             for (entity, id), op in pending.items()]
+        ).all()
+        session.info[HEAD_KEY] = max(ids)
+
+    def _after_commit(self, session):
+        head = session.info.pop(HEAD_KEY, None)
+        if head:
+            self._advance(head)
+
+    def _after_rollback(self, session):
+        session.info.pop(PENDING_KEY, None)
+        session.info.pop(HEAD_KEY, None)
+
+    # --- READING ---
+
+    def current_head(self):
+        return db.session.scalar(select(func.max(ChangeFeedEntry.id))) or 0
+
+    def changes(self, after=0, limit=500, entities=None):
+        """Up to limit entries after the cursor, oldest first.
+
+        Raises FeedGone when entries after the cursor have been pruned.
+        """
+        statement = select(ChangeFeedEntry).where(ChangeFeedEntry.id > after)
+        if entities:
+            statement = statement.where(ChangeFeedEntry.entity.in_(entities))
+        entries = db.session.scalars(statement.order_by(ChangeFeedEntry.id).limit(limit)).all()
+        if after and (not entries or entries[0].id > after + 1):
+            oldest = db.session.scalar(select(func.min(ChangeFeedEntry.id)))
+            if oldest is not None and oldest > after + 1:
+                raise FeedGone(f'Changes after {after} are no longer kept; resync from the current head.')
+        return entries
+
+    # --- WAITING ---
+
+    def _advance(self, head):
+        with self._condition:
+            if head > self.head:
+                self.head = head
+                self._condition.notify_all()
+
+    def wait(self, after, timeout):
+        """Block until the feed moves past after or timeout passes; True if it moved"""
+        with self._condition:
+            self.waiters += 1
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name='change-feed-watcher', daemon=True)
+                self._watcher.start()
+            try:
+                return self._condition.wait_for(lambda: self.head > after, timeout)
+            finally:
+                self.waiters -= 1
+
+    def _watch(self):
+        # One cheap indexed MAX(id) per interval, however many consumers wait
+        while True:
+            with self._condition:
+                if not self.waiters:
+                    self._watcher = None
+                    return
+            try:
+                with self.app.app_context():
+                    head = self.current_head()
+                    db.session.remove()
+                self._advance(head)
+            except Exception:
+                logger.exception('Change feed watcher could not read the feed head')
+            time.sleep(self.poll_interval)
+
+    # --- RETENTION ---
+
+    def prune(self, days=None):
+        """Delete entries older than days (default FEED_RETENTION_DAYS); returns how many"""
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days if days is None else days)
+        # Always keep the newest entry, so the head survives and stale cursors are detected
+        head = self.current_head()
+        result = db.session.execute(delete(ChangeFeedEntry).where(
+            ChangeFeedEntry.changed_at < cutoff, ChangeFeedEntry.id < head))
+        db.session.commit()
+        return result.rowcount
+
+
+change_feed = ChangeFeed()
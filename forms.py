@@ -1,7 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, IntegerField, FloatField, SelectField, DateField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, NumberRange, Optional
-from models import User, Category, Item
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, IntegerField, FloatField, SelectField, DateField, Form, FieldList, FormField
+from wtforms.validators import DataRequired, Email, InputRequired, EqualTo, ValidationError, Length, NumberRange, Optional, Regexp
+from app import db
+from models import User, Category, Item, Location, DEFAULT_REORDER_LEVEL
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -32,22 +34,44 @@ class CategoryForm(FlaskForm):
     description = TextAreaField('Description', validators=[Optional(), Length(max=500)])
     submit = SubmitField('Save Category')
 
+class ModelIdField(IntegerField):
+    """Id of a model row, validated with one primary-key lookup instead of a choices list.
+
+    Pass condition to also reject rows that exist but are not selectable.
+    The validated row is kept on the field as obj.
+    """
+
+    def __init__(self, label=None, validators=None, model=None, condition=None, **kwargs):
+        super(ModelIdField, self).__init__(label, validators, **kwargs)
+        self.model = model
+        self.condition = condition
+        self.obj = None
+
+    def pre_validate(self, form):
+        self.obj = None
+        if self.data is None:
+            return
+        obj = db.session.get(self.model, self.data)
+        if obj is None or (self.condition is not None and not self.condition(obj)):
+            raise ValidationError(self.gettext('Not a valid choice.'))
+        self.obj = obj
+
 class ItemForm(FlaskForm):
     code = StringField('Item Code', validators=[DataRequired(), Length(min=2, max=50)])
     name = StringField('Item Name', validators=[DataRequired(), Length(min=2, max=200)])
     description = TextAreaField('Description', validators=[Optional(), Length(max=500)])
-    quantity = IntegerField('Quantity', validators=[DataRequired(), NumberRange(min=0)])
+    # InputRequired, not DataRequired: 0 is a valid count (an out-of-stock item)
+    quantity = IntegerField('Quantity', validators=[InputRequired(), NumberRange(min=0)])
+    reorder_level = IntegerField('Reorder Level', default=DEFAULT_REORDER_LEVEL, validators=[Optional(), NumberRange(min=0)])
     unit_price = FloatField('Unit Price', validators=[DataRequired(), NumberRange(min=0.01)])
     supplier = StringField('Supplier', validators=[Optional(), Length(max=200)])
-    category_id = SelectField('Category', validators=[DataRequired()], coerce=int)
+    category_id = ModelIdField('Category', validators=[DataRequired()], model=Category)
+    # Where an edited quantity was counted; empty books the change at the default location
+    location_id = ModelIdField('Counted At', validators=[Optional()], model=Location)
     submit = SubmitField('Save Item')
-    
-    def __init__(self, *args, **kwargs):
-        super(ItemForm, self).__init__(*args, **kwargs)
-        self.category_id.choices = [(c.id, c.name) for c in Category.query.order_by(Category.name).all()]
 
 class IncomingItemForm(FlaskForm):
-    item_id = SelectField('Item', validators=[DataRequired()], coerce=int)
+    item_id = ModelIdField('Item', validators=[DataRequired()], model=Item)
     quantity = IntegerField('Quantity Received', validators=[DataRequired(), NumberRange(min=1)])
     unit_price = FloatField('Unit Price', validators=[DataRequired(), NumberRange(min=0.01)])
     supplier = StringField('Supplier', validators=[Optional(), Length(max=200)])
@@ -55,22 +79,82 @@ class IncomingItemForm(FlaskForm):
     expiry_date = DateField('Expiry Date', validators=[Optional()])
     notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
     received_by = StringField('Received By', validators=[DataRequired(), Length(max=100)])
+    # Empty books the movement at the default location
+    location_id = ModelIdField('Location', validators=[Optional()], model=Location)
     submit = SubmitField('Record Incoming Items')
-    
-    def __init__(self, *args, **kwargs):
-        super(IncomingItemForm, self).__init__(*args, **kwargs)
-        self.item_id.choices = [(i.id, f"{i.code} - {i.name}") for i in Item.query.order_by(Item.name).all()]
 
 class OutgoingItemForm(FlaskForm):
-    item_id = SelectField('Item', validators=[DataRequired()], coerce=int)
+    item_id = ModelIdField('Item', validators=[DataRequired()], model=Item, condition=lambda item: item.quantity > 0)
     quantity = IntegerField('Quantity Issued', validators=[DataRequired(), NumberRange(min=1)])
     destination = StringField('Destination', validators=[DataRequired(), Length(min=2, max=200)])
     purpose = StringField('Purpose', validators=[Optional(), Length(max=200)])
     request_number = StringField('Request Number', validators=[Optional(), Length(max=100)])
     notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
     issued_by = StringField('Issued By', validators=[DataRequired(), Length(max=100)])
+    location_id = ModelIdField('Location', validators=[Optional()], model=Location)
     submit = SubmitField('Record Outgoing Items')
-    
-    def __init__(self, *args, **kwargs):
-        super(OutgoingItemForm, self).__init__(*args, **kwargs)
-        self.item_id.choices = [(i.id, f"{i.code} - {i.name} (Stock: {i.quantity})") for i in Item.query.filter(Item.quantity > 0).order_by(Item.name).all()]
\ No newline at end of file
+
+# Multi-line transactions: one header per submission plus a FieldList of lines.
+# Line item ids are checked against the database in one query by stock.py.
+MAX_TRANSACTION_LINES = 500
+
+class IncomingLineForm(Form):
+    item_id = IntegerField('Item', validators=[DataRequired()])
+    quantity = IntegerField('Quantity Received', validators=[DataRequired(), NumberRange(min=1)])
+    unit_price = FloatField('Unit Price', validators=[DataRequired(), NumberRange(min=0.01)])
+    batch_number = StringField('Batch Number', validators=[Optional(), Length(max=100)])
+    expiry_date = DateField('Expiry Date', validators=[Optional()])
+
+class OutgoingLineForm(Form):
+    item_id = IntegerField('Item', validators=[DataRequired()])
+    quantity = IntegerField('Quantity Issued', validators=[DataRequired(), NumberRange(min=1)])
+
+class IncomingTransactionForm(FlaskForm):
+    lines = FieldList(FormField(IncomingLineForm), min_entries=1, max_entries=MAX_TRANSACTION_LINES)
+    supplier = StringField('Supplier', validators=[Optional(), Length(max=200)])
+    notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
+    received_by = StringField('Received By', validators=[DataRequired(), Length(max=100)])
+    location_id = ModelIdField('Location', validators=[Optional()], model=Location)
+    submit = SubmitField('Record Incoming Items')
+
+class OutgoingTransactionForm(FlaskForm):
+    lines = FieldList(FormField(OutgoingLineForm), min_entries=1, max_entries=MAX_TRANSACTION_LINES)
+    destination = StringField('Destination', validators=[DataRequired(), Length(min=2, max=200)])
+    purpose = StringField('Purpose', validators=[Optional(), Length(max=200)])
+    request_number = StringField('Request Number', validators=[Optional(), Length(max=100)])
+    notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
+    issued_by = StringField('Issued By', validators=[DataRequired(), Length(max=100)])
+    location_id = ModelIdField('Location', validators=[Optional()], model=Location)
+    submit = SubmitField('Record Outgoing Items')
+
+class TransferForm(FlaskForm):
+    item_id = ModelIdField('Item', validators=[DataRequired()], model=Item, condition=lambda item: item.quantity > 0)
+    quantity = IntegerField('Quantity', validators=[DataRequired(), NumberRange(min=1)])
+    from_location_id = ModelIdField('From Location', validators=[DataRequired()], model=Location)
+    to_location_id = ModelIdField('To Location', validators=[DataRequired()], model=Location)
+    notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
+    transferred_by = StringField('Transferred By', validators=[DataRequired(), Length(max=100)])
+    submit = SubmitField('Record Transfer')
+
+    def validate_to_location_id(self, to_location_id):
+        if to_location_id.data == self.from_location_id.data:
+            raise ValidationError('Choose a different location to transfer to.')
+
+class LocationForm(FlaskForm):
+    code = StringField('Location Code', validators=[DataRequired(), Length(min=2, max=50)])
+    name = StringField('Location Name', validators=[DataRequired(), Length(min=2, max=200)])
+    description = TextAreaField('Description', validators=[Optional(), Length(max=500)])
+    submit = SubmitField('Save Location')
+
+class ImportForm(FlaskForm):
+    kind = SelectField('Import', choices=[('items', 'Items'), ('incoming', 'Incoming Items')])
+    file = FileField('File', validators=[FileRequired(), FileAllowed(['csv', 'xlsx'], 'CSV or XLSX files only.')])
+    submit = SubmitField('Import')
+
+class ReportForm(FlaskForm):
+    kind = SelectField('Report', choices=[('valuation', 'Stock Valuation (FIFO / Weighted Average)'),
+                                          ('turnover', 'Stock Turnover'),
+                                          ('abc', 'ABC Classification')])
+    month = StringField('Month', validators=[DataRequired(), Regexp(r'^\d{4}-(0[1-9]|1[0-2])$', message='Use YYYY-MM.')])
+    months = IntegerField('Months (ABC)', default=12, validators=[Optional(), NumberRange(min=1, max=36)])
+    submit = SubmitField('Run Report')
@@ -0,0 +1,28 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py wsgi:app
+
+Every value can be overridden from the environment. Workers are separate
+processes, each with its own connection pool (DB_POOL_SIZE), cache and
+background threads; threads within a worker serve requests concurrently,
+including the long-lived /api/v1/changes long-polls and SSE streams, which
+hold one thread each while open.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# The gthread worker heartbeats from its main thread, so long streams do not trip this
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks cannot build up; jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+# Load the app in each worker after the fork: connection pools and the
+# activity, report and change feed threads must not be shared with the master
+preload_app = False
+accesslog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+raw_env = ['APP_ENV=production']
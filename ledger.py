@@ -0,0 +1,214 @@
+import logging
+from datetime import date, datetime, time
+from sqlalchemy import event, func, literal, select, text, union_all
+from app import db
+from models import Item, IncomingItem, OutgoingItem, StockLedgerEntry, StockSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Movement rows whose insertion changes stock, with the sign of the change
+MOVEMENTS = {IncomingItem: (1, 'incoming'), OutgoingItem: (-1, 'outgoing')}
+# Advisory lock held shared by every transaction appending to the ledger and
+# taken exclusively by take_snapshots (PostgreSQL only; SQLite serialises writers)
+PG_LOCK_KEY = 7_301_012
+
+
+def entry(item_id, delta, reason, ref_table=None, ref_id=None, when=None):
+    return {'item_id': item_id, 'delta': delta, 'reason': reason,
+            'ref_table': ref_table, 'ref_id': ref_id, 'created_at': when or datetime.utcnow()}
+
+
+def record(connection, entries):
+    """Append ledger entries (dicts from entry()) on connection.
+
+    The ORM path calls this from after_flush; bulk writes that bypass the
+    session call it directly inside their own transaction.
+    """
+    entries = [e for e in entries if e['delta']]
+    if entries:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock_shared(:key)'), {'key': PG_LOCK_KEY})
+        connection.execute(StockLedgerEntry.__table__.insert(), entries)
+
+
+def _collect(session):
+    entries = []
+    for obj in session.new:
+        model = type(obj)
+        if model is Item:
+            entries.append(entry(obj.id, obj.quantity or 0, 'initial', 'items', obj.id))
+        elif model in MOVEMENTS:
+            sign, reason = MOVEMENTS[model]
+            entries.append(entry(obj.item_id, sign * obj.quantity, reason, model.__tablename__, obj.id))
+    for obj in session.dirty:
+        if type(obj) is Item:
+            history = db.inspect(obj).attrs.quantity.history
+            if history.added and history.deleted:
+                entries.append(entry(obj.id, (history.added[0] or 0) - (history.deleted[0] or 0),
+                                     'adjustment', 'items', obj.id))
+    for obj in session.deleted:
+        if type(obj) is Item:
+            entries.append(entry(obj.id, -(obj.quantity or 0), 'deleted', 'items', obj.id))
+    return entries
+
+
+def _after_flush(session, flush_context):
+    entries = _collect(session)
+    if entries:
+        record(session.connection(), entries)
+
+
+# --- SNAPSHOTS ---
+
+def take_snapshots():
+    """Snapshot the quantity of every item with ledger entries since the last snapshot.
+
+    One INSERT ... SELECT adds each changed item's latest snapshot to the sum
+    of its new entries; all snapshots of a run share the ledger id they
+    cover up to. Returns the number of snapshots written.
+
+    Ledger ids are not handed out in commit order, so on PostgreSQL the
+    watermark is read under the exclusive ledger lock: every transaction
+    that drew an id below it has committed, and none can draw another
+    until the watermark's own short transaction ends.
+    """
+    previous = db.session.scalar(select(func.max(StockSnapshot.ledger_id))) or 0
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PG_LOCK_KEY})
+    watermark = db.session.scalar(select(func.max(StockLedgerEntry.id))) or 0
+    db.session.commit()
+    if watermark <= previous:
+        return 0
+    ledger, snapshots = StockLedgerEntry.__table__, StockSnapshot.__table__
+    last_quantity = (
+        select(snapshots.c.quantity)
+        .where(snapshots.c.item_id == ledger.c.item_id)
+        .order_by(snapshots.c.ledger_id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    changed = (
+        select(ledger.c.item_id,
+               literal(watermark),
+               func.coalesce(last_quantity, 0) + func.sum(ledger.c.delta),
+               literal(datetime.utcnow()))
+        .where(ledger.c.id > previous, ledger.c.id <= watermark)
+        .group_by(ledger.c.item_id)
+    )
+    result = db.session.execute(snapshots.insert().from_select(
+        ['item_id', 'ledger_id', 'quantity', 'taken_at'], changed))
+    db.session.commit()
+    return result.rowcount
+
+
+# --- POINT-IN-TIME QUERIES ---
+
+def _as_of(at):
+    # A date means the end of that day
+    if isinstance(at, datetime):
+        return at
+    if isinstance(at, date):
+        return datetime.combine(at, time.max)
+    return at or datetime.utcnow()
+
+
+def quantity_as_of(item_id, at=None):
+    """An item's quantity at a moment: its last snapshot before then plus the entries after it.
+
+    The entries are read only up to the item's next snapshot, so a lookup
+    far in the past scans one snapshot interval rather than all later history.
+    """
+    at = _as_of(at)
+    snapshot = db.session.execute(
+        select(StockSnapshot.ledger_id, StockSnapshot.quantity)
+        .where(StockSnapshot.item_id == item_id, StockSnapshot.taken_at <= at)
+        .order_by(StockSnapshot.ledger_id.desc())
+        .limit(1)
+    ).first()
+    since, quantity = snapshot if snapshot else (0, 0)
+    until = db.session.scalar(
+        select(StockSnapshot.ledger_id)
+        .where(StockSnapshot.item_id == item_id, StockSnapshot.taken_at > at)
+        .order_by(StockSnapshot.ledger_id)
+        .limit(1)
+    )
+    entries = [StockLedgerEntry.item_id == item_id, StockLedgerEntry.id > since, StockLedgerEntry.created_at <= at]
+    if until is not None:
+        entries.append(StockLedgerEntry.id <= until)
+    delta = db.session.scalar(select(func.coalesce(func.sum(StockLedgerEntry.delta), 0)).where(*entries))
+    return quantity + delta
+
+
+def balances(at=None):
+    """A select of (item_id, quantity) at a moment for every item with ledger history.
+
+    Each item's latest snapshot before the moment and its later entries are
+    summed in one grouped query, so reports can join it like a table.
+    """
+    at = _as_of(at)
+    latest = (
+        select(StockSnapshot.item_id, func.max(StockSnapshot.ledger_id).label('ledger_id'))
+        .where(StockSnapshot.taken_at <= at)
+        .group_by(StockSnapshot.item_id)
+        .subquery()
+    )
+    base = (
+        select(StockSnapshot.item_id, StockSnapshot.ledger_id, StockSnapshot.quantity)
+        .join(latest, (latest.c.item_id == StockSnapshot.item_id) & (latest.c.ledger_id == StockSnapshot.ledger_id))
+        .subquery()
+    )
+    deltas = (
+        select(StockLedgerEntry.item_id, StockLedgerEntry.delta.label('quantity'))
+        .outerjoin(base, base.c.item_id == StockLedgerEntry.item_id)
+        .where(StockLedgerEntry.id > func.coalesce(base.c.ledger_id, 0),
+               StockLedgerEntry.created_at <= at)
+    )
+    parts = union_all(select(base.c.item_id, base.c.quantity), deltas).subquery()
+    return (
+        select(parts.c.item_id.label('item_id'), func.sum(parts.c.quantity).label('quantity'))
+        .group_by(parts.c.item_id)
+    )
+
+
+def quantities_as_of(at=None):
+    """{item_id: quantity} at a moment for every item with ledger history"""
+    return dict(db.session.execute(balances(at)).all())
+
+
+# --- CONSISTENCY ---
+
+def check(fix=False):
+    """Compare every item's quantity with its ledger balance and return the drifted items.
+
+    With fix, a 'correction' entry is appended for each drift so the ledger
+    agrees with the items table again; the drift itself stays on record.
+    """
+    ledger_balances = quantities_as_of(datetime.utcnow())
+    drifted = []
+    for item_id, code, quantity in db.session.execute(select(Item.id, Item.code, Item.quantity)):
+        balance = ledger_balances.get(item_id, 0)
+        if balance != quantity:
+            drifted.append({'item_id': item_id, 'code': code, 'quantity': quantity,
+                            'ledger': balance, 'drift': quantity - balance})
+    if fix and drifted:
+        record(db.session.connection(), [entry(d['item_id'], d['drift'], 'correction', 'items', d['item_id'])
+                                         for d in drifted])
+        db.session.commit()
+        logger.warning('Corrected stock ledger drift on %d items', len(drifted))
+    return drifted
+
+
+def _open_balances():
+    """Start the ledger with each item's current quantity, after writes that bypassed it"""
+    items = Item.__table__
+    db.session.execute(StockLedgerEntry.__table__.insert().from_select(
+        ['item_id', 'delta', 'reason', 'ref_table', 'ref_id', 'created_at'],
+        select(items.c.id, items.c.quantity, literal('opening'), literal('items'), items.c.id,
+               literal(datetime.utcnow())).where(items.c.quantity != 0)
+    ))
+    db.session.commit()
+
+
+def init_app(app):
+    """Append to the ledger on every flush (the migration that creates it opens the balances)"""
+    event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,204 @@
+import logging
+from collections import Counter
+from flask import current_app
+from sqlalchemy import delete, event, func, select, tuple_, update
+from sqlalchemy.orm import load_only
+from app import db
+from cache import cache
+from models import DashboardStat, Item, Location, StockBalance, StockTransfer
+import alerts
+import stats
+
+logger = logging.getLogger(__name__)
+
+
+class NegativeBalance(ValueError):
+    """A direct quantity change would take the default location's balance below zero"""
+
+
+# --- LOCATIONS ---
+# The location list is small and read on every scoped page, so it is
+# cached under its own entity and invalidated whenever a location changes.
+
+def default_id():
+    """Id of the DEFAULT_LOCATION, where movements without a location are booked"""
+    code = current_app.config['DEFAULT_LOCATION']
+
+    def producer():
+        location_id = db.session.scalar(select(Location.id).where(Location.code == code))
+        if location_id is None:
+            raise LookupError(f'Default location {code!r} does not exist; run flask db upgrade')
+        return location_id
+    return cache.get_or_set('locations', f'location-default:{code}', producer)
+
+
+def options():
+    """Location id, code and name dicts for filter and form dropdowns, in code order"""
+    return cache.get_or_set('locations', 'location-options', lambda: [
+        {'id': id, 'code': code, 'name': name}
+        for id, code, name in db.session.execute(select(Location.id, Location.code, Location.name)
+                                                 .order_by(Location.code))])
+
+
+def ids_by_code():
+    """{lower-case code: id} of every location, for imports that name locations by code"""
+    return cache.get_or_set('locations', 'location-codes', lambda: {
+        code.lower(): id for id, code in db.session.execute(select(Location.id, Location.code))})
+
+
+def resolve(location_id):
+    """The location id a movement is booked at: the given one or the default"""
+    return location_id or default_id()
+
+
+# --- BALANCES ---
+# Every balance write goes through apply or take, which keep each
+# location's count of stocked items ('stocked@<location id>' in the
+# dashboard counters) and mark the items for the per-location low-stock
+# alerts as they go.
+
+def apply(connection, deltas):
+    """Add {(item_id, location_id): delta} to the balances on connection, creating missing rows.
+
+    The ORM path calls this from after_flush; movement and bulk writes call
+    it directly inside their own transaction.
+    """
+    for (item_id, location_id), delta in sorted(deltas.items()):
+        if delta:
+            stats._upsert(connection, StockBalance.__table__, {'location_id': location_id, 'item_id': item_id},
+                          'quantity', delta)
+    _settle(connection, deltas)
+
+
+def take(item_id, location_id, quantity):
+    """Take quantity units of an item from a location's balance; False if fewer are there.
+
+    Like stock._adjust, the check and the write are one conditional UPDATE.
+    """
+    result = db.session.execute(
+        update(StockBalance.__table__)
+        .where(StockBalance.location_id == location_id, StockBalance.item_id == item_id,
+               StockBalance.quantity >= quantity)
+        .values(quantity=StockBalance.quantity - quantity))
+    if result.rowcount != 1:
+        return False
+    _settle(db.session.connection(), {(item_id, location_id): -quantity})
+    return True
+
+
+def _settle(connection, deltas):
+    # The balances just moved by deltas are locked by this transaction, so
+    # their current quantities less the deltas are what they were before
+    pairs = [pair for pair, delta in deltas.items() if delta]
+    if not pairs:
+        return
+    after = {(item_id, location_id): quantity for item_id, location_id, quantity in connection.execute(
+        select(StockBalance.item_id, StockBalance.location_id, StockBalance.quantity)
+        .where(tuple_(StockBalance.item_id, StockBalance.location_id).in_(pairs)))}
+    stocked = Counter()
+    for pair in pairs:
+        quantity = after.get(pair, 0)
+        stocked[stats.scoped('stocked', pair[1])] += (quantity > 0) - (quantity - deltas[pair] > 0)
+    stats.apply_deltas(connection, counters=stocked)
+    alerts.mark(db.session, {item_id for item_id, _ in pairs})
+
+
+def available(item_id, location_id):
+    return db.session.scalar(select(StockBalance.quantity).where(
+        StockBalance.location_id == location_id, StockBalance.item_id == item_id)) or 0
+
+
+def _collect(session):
+    # Quantities written straight to an item (new items, direct writes,
+    # deletion) are not movements at any location; they are booked at the
+    # default one. Edits through the UI go through stock.adjust_stock instead.
+    deltas, deleted = Counter(), []
+    for obj in session.new:
+        if type(obj) is Item and obj.quantity:
+            deltas[obj.id] += obj.quantity
+    for obj in session.dirty:
+        if type(obj) is Item:
+            history = db.inspect(obj).attrs.quantity.history
+            if history.added and history.deleted:
+                deltas[obj.id] += (history.added[0] or 0) - (history.deleted[0] or 0)
+    for obj in session.deleted:
+        if type(obj) is Item:
+            deleted.append(obj.id)
+    return deltas, deleted
+
+
+def _after_flush(session, flush_context):
+    deltas, deleted = _collect(session)
+    connection = session.connection()
+    if deltas:
+        location_id = default_id()
+        # A lowered quantity must be there to take, as for any other movement
+        for item_id, delta in sorted(deltas.items()):
+            if delta < 0 and not take(item_id, location_id, -delta):
+                raise NegativeBalance(f'Item {item_id} has fewer than {-delta} units at the default location; '
+                                      'lower it with a stocktake at the location holding them.')
+        apply(connection, {(item_id, location_id): delta for item_id, delta in deltas.items() if delta > 0})
+    if deleted:
+        emptied = Counter()
+        for location_id, count in connection.execute(
+                select(StockBalance.location_id, func.count())
+                .where(StockBalance.item_id.in_(deleted), StockBalance.quantity > 0)
+                .group_by(StockBalance.location_id)):
+            emptied[stats.scoped('stocked', location_id)] -= count
+        stats.apply_deltas(connection, counters=emptied)
+        # What ON DELETE CASCADE does where foreign keys are enforced
+        connection.execute(delete(StockBalance.__table__).where(StockBalance.item_id.in_(deleted)))
+        connection.execute(delete(StockTransfer.__table__).where(StockTransfer.item_id.in_(deleted)))
+
+
+# --- SCOPED QUERIES ---
+
+def stocked_count(location_id):
+    """Items with stock on hand at a location, from its running count"""
+    return db.session.scalar(select(DashboardStat.value)
+                             .where(DashboardStat.key == stats.scoped('stocked', location_id))) or 0
+
+
+def summary():
+    """Every location with the number of items it stocks and its units on hand, in code order"""
+    totals = (select(StockBalance.location_id, func.count().label('stocked'),
+                     func.sum(StockBalance.quantity).label('units'))
+              .where(StockBalance.quantity > 0)
+              .group_by(StockBalance.location_id)
+              .subquery())
+    rows = db.session.execute(
+        select(Location, func.coalesce(totals.c.stocked, 0), func.coalesce(totals.c.units, 0))
+        .options(load_only(Location.code, Location.name))
+        .outerjoin(totals, totals.c.location_id == Location.id)
+        .order_by(Location.code))
+    return [{'location': location, 'stocked': stocked, 'units': units} for location, stocked, units in rows]
+
+
+# --- CONSISTENCY ---
+
+def check(fix=False):
+    """Compare every item's quantity with the sum of its balances and return the drifted items.
+
+    With fix, each drift is booked at the default location, so the balances
+    add up to the items table again.
+    """
+    totals = dict(db.session.execute(select(StockBalance.item_id, func.sum(StockBalance.quantity))
+                                     .group_by(StockBalance.item_id)).all())
+    drifted = []
+    for item_id, code, quantity in db.session.execute(select(Item.id, Item.code, Item.quantity)):
+        balance = totals.get(item_id) or 0
+        if balance != quantity:
+            drifted.append({'item_id': item_id, 'code': code, 'quantity': quantity,
+                            'balances': balance, 'drift': quantity - balance})
+    if fix and drifted:
+        location_id = default_id()
+        apply(db.session.connection(), {(d['item_id'], location_id): d['drift'] for d in drifted})
+        db.session.commit()
+        logger.warning('Corrected location balance drift on %d items', len(drifted))
+    return drifted
+
+
+def init_app(app):
+    """Keep the default location's balances in step with direct quantity edits"""
+    app.config.setdefault('DEFAULT_LOCATION', 'MAIN')
+    event.listen(db.session, 'after_flush', _after_flush)
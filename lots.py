@@ -0,0 +1,300 @@
+import heapq
+from collections import Counter, defaultdict
+from datetime import date
+from sqlalchemy import and_, bindparam, case, delete, event, func, insert, select, tuple_, update
+from app import db
+from models import Item, IncomingItem, LotBalance, OutgoingAllocation, StockBalance
+from feed import change_feed
+import locations
+import stats
+
+BATCH_SIZE = 5000
+# Open lots read per round trip while allocating
+LOT_PAGE = 64
+
+
+def fefo_key(expiry_date, lot_id):
+    # Dated lots by expiry, then lots without one; in order of receipt within each
+    return (expiry_date is None, expiry_date or date.min, lot_id)
+
+
+# --- ALLOCATION ---
+
+class LotAllocator:
+    """First-expired-first-out allocation of units to the lots at one location, for one transaction.
+
+    An item's open lots at the location are read in FEFO order through the
+    lot balances' open index, a page at a time, into a heap: an issue
+    touching k lots reads about k rows however many lots the item has, and
+    later lines for the same item carry on from the same heap. Units beyond
+    the open lots are stock never received as a lot there (opening
+    balances, manual corrections); they are issued last, with no lot.
+    """
+
+    def __init__(self, location_id):
+        self.location_id = location_id
+        self.heaps = {}
+        self.cursors = {}
+        self.taken = Counter()
+        self.lots = {}
+
+    def _next_page(self, item_id):
+        # Dated lots first, then undated ones, each seeking past the last lot read
+        undated, last = self.cursors.get(item_id, (False, None))
+        query = select(LotBalance.incoming_id, LotBalance.expiry_date, LotBalance.remaining).where(
+            LotBalance.item_id == item_id, LotBalance.location_id == self.location_id, LotBalance.remaining > 0)
+        if undated:
+            query = query.where(LotBalance.expiry_date.is_(None), LotBalance.incoming_id > (last or 0))
+            query = query.order_by(LotBalance.incoming_id)
+        else:
+            query = query.where(LotBalance.expiry_date.is_not(None))
+            if last:
+                query = query.where(tuple_(LotBalance.expiry_date, LotBalance.incoming_id) > tuple_(*last))
+            query = query.order_by(LotBalance.expiry_date, LotBalance.incoming_id)
+        rows = db.session.execute(query.limit(LOT_PAGE)).all()
+        if rows:
+            last_row = rows[-1]
+            self.cursors[item_id] = (undated, last_row.incoming_id if undated
+                                     else (last_row.expiry_date, last_row.incoming_id))
+        elif not undated:
+            self.cursors[item_id] = (True, None)
+            return self._next_page(item_id)
+        return rows
+
+    def allocate(self, item_id, quantity):
+        """Split quantity over the item's lots at the location; returns [(incoming_id or None, units)]"""
+        heap = self.heaps.setdefault(item_id, [])
+        split = []
+        while quantity:
+            if not heap:
+                for id, expiry, remaining in self._next_page(item_id):
+                    heapq.heappush(heap, [fefo_key(expiry, id), id, remaining])
+                    self.lots[id] = (item_id, expiry)
+                if not heap:
+                    break
+            lot = heap[0]
+            units = min(quantity, lot[2])
+            split.append((lot[1], units))
+            self.taken[lot[1]] += units
+            quantity -= units
+            # The key is unchanged by a partial draw, so the lot stays on top
+            lot[2] -= units
+            if not lot[2]:
+                heapq.heappop(heap)
+        if quantity:
+            split.append((None, quantity))
+        return split
+
+    def _draw(self):
+        # The location's share of each lot allocated so far
+        taken = [{'lot_id': id, 'taken': units} for id, units in sorted(self.taken.items())]
+        balances = LotBalance.__table__
+        db.session.execute(
+            update(balances)
+            .where(balances.c.incoming_id == bindparam('lot_id'), balances.c.location_id == self.location_id)
+            .values(remaining=balances.c.remaining - bindparam('taken')),
+            taken
+        )
+        return taken
+
+    def save(self, outgoing_ids, splits):
+        """Draw down the lots allocated so far and record each outgoing row's split"""
+        if self.taken:
+            taken = self._draw()
+            incoming = IncomingItem.__table__
+            db.session.execute(
+                update(incoming).where(incoming.c.id == bindparam('lot_id'))
+                .values(remaining=incoming.c.remaining - bindparam('taken')),
+                taken
+            )
+            change_feed.mark(db.session, 'incoming-items', self.taken)
+            self.taken.clear()
+        rows = [{'outgoing_id': outgoing_id, 'incoming_id': lot_id, 'quantity': units}
+                for outgoing_id, split in zip(outgoing_ids, splits) for lot_id, units in split]
+        if rows:
+            db.session.execute(insert(OutgoingAllocation), rows)
+
+    def move(self, to_location_id):
+        """Carry the lots allocated so far over to another location; their totals are unchanged"""
+        if not self.taken:
+            return
+        self._draw()
+        connection = db.session.connection()
+        for id, units in sorted(self.taken.items()):
+            item_id, expiry = self.lots[id]
+            stats._upsert(connection, LotBalance.__table__, {'incoming_id': id, 'location_id': to_location_id},
+                          'remaining', units, {'item_id': item_id, 'expiry_date': expiry})
+        self.taken.clear()
+
+
+def place(connection, lots):
+    """Put new receipts' lots at their locations: dicts of incoming_id, location_id, item_id, expiry_date, remaining.
+
+    The ORM path calls this from after_flush; bulk receipts call it
+    directly inside their own transaction.
+    """
+    rows = [lot for lot in lots if lot['remaining']]
+    if rows:
+        connection.execute(insert(LotBalance.__table__), rows)
+
+
+def move(item_id, quantity, from_location_id, to_location_id):
+    """Move quantity units of an item's lots between locations, first expiry first; returns the split"""
+    allocator = LotAllocator(from_location_id)
+    split = allocator.allocate(item_id, quantity)
+    allocator.move(to_location_id)
+    return split
+
+
+# --- DIRECT QUANTITY CHANGES ---
+
+def trim(pairs):
+    """Draw down an item's lots at a location where they hold more than the location has on hand.
+
+    Edits and imports overwrite the quantity rather than issue stock, so
+    the difference is taken from the lots there in FEFO order, as an issue
+    would take it; the lots never hold more than is on hand. pairs are
+    (item_id, location_id). Returns the lots drawn on.
+    """
+    pairs = sorted(set(pairs))
+    if not pairs:
+        return 0
+    on_hand = func.coalesce(func.max(StockBalance.quantity), 0)
+    excess = db.session.execute(
+        select(LotBalance.item_id, LotBalance.location_id, func.sum(LotBalance.remaining) - on_hand)
+        .outerjoin(StockBalance, and_(StockBalance.item_id == LotBalance.item_id,
+                                      StockBalance.location_id == LotBalance.location_id))
+        .where(tuple_(LotBalance.item_id, LotBalance.location_id).in_(pairs), LotBalance.remaining > 0)
+        .group_by(LotBalance.item_id, LotBalance.location_id)
+        .having(func.sum(LotBalance.remaining) > on_hand)
+    ).all()
+    by_location = defaultdict(list)
+    for item_id, location_id, units in excess:
+        by_location[location_id].append((item_id, units))
+    drawn = 0
+    for location_id, lines in sorted(by_location.items()):
+        allocator = LotAllocator(location_id)
+        for item_id, units in lines:
+            allocator.allocate(item_id, units)
+        drawn += len(allocator.taken)
+        allocator.save([], [])
+    return drawn
+
+
+def _after_flush(session, flush_context):
+    received, removed, lowered = [], [], []
+    for obj in session.new:
+        if type(obj) is IncomingItem:
+            received.append(obj)
+    for obj in session.deleted:
+        if type(obj) is IncomingItem:
+            removed.append(obj.id)
+    for obj in session.dirty:
+        if type(obj) is Item:
+            history = db.inspect(obj).attrs.quantity.history
+            if history.added and history.deleted and (history.added[0] or 0) < (history.deleted[0] or 0):
+                lowered.append(obj.id)
+    connection = session.connection()
+    if received:
+        place(connection, [{'incoming_id': lot.id, 'location_id': lot.location_id or locations.default_id(),
+                           'item_id': lot.item_id, 'expiry_date': lot.expiry_date,
+                           'remaining': lot.quantity if lot.remaining is None else lot.remaining}
+                          for lot in received])
+    if removed:
+        connection.execute(delete(LotBalance.__table__).where(LotBalance.incoming_id.in_(removed)))
+    if lowered:
+        # Direct edits are booked at the default location (locations.py)
+        location_id = locations.default_id()
+        trim([(item_id, location_id) for item_id in lowered])
+
+
+# --- BALANCES ---
+
+def open_lots(item_id, location_id=None):
+    """An item's lots with stock left, in the order they will be issued; at one location with location_id"""
+    if location_id is None:
+        query = (select(IncomingItem.id, IncomingItem.batch_number, IncomingItem.expiry_date,
+                        IncomingItem.received_date, IncomingItem.remaining)
+                 .where(IncomingItem.item_id == item_id, IncomingItem.remaining > 0))
+    else:
+        query = (select(IncomingItem.id, IncomingItem.batch_number, IncomingItem.expiry_date,
+                        IncomingItem.received_date, LotBalance.remaining)
+                 .join(LotBalance, LotBalance.incoming_id == IncomingItem.id)
+                 .where(LotBalance.item_id == item_id, LotBalance.location_id == location_id,
+                        LotBalance.remaining > 0))
+    rows = db.session.execute(query).all()
+    return sorted(rows, key=lambda r: fefo_key(r.expiry_date, r.id))
+
+
+def balances(item_id, location_id=None):
+    """An item's quantity on hand broken down by lot, plus the units not traced to any lot.
+
+    With location_id, the quantity and lots at that location.
+    """
+    quantity = db.session.scalar(select(Item.quantity).where(Item.id == item_id))
+    if quantity is None:
+        return None
+    if location_id is not None:
+        quantity = locations.available(item_id, location_id)
+    lots = [{
+        'incoming_id': lot.id,
+        'batch_number': lot.batch_number,
+        'expiry_date': lot.expiry_date.isoformat() if lot.expiry_date else None,
+        'received_date': lot.received_date.isoformat() if lot.received_date else None,
+        'remaining': lot.remaining,
+    } for lot in open_lots(item_id, location_id)]
+    return {'item_id': item_id, 'location_id': location_id, 'quantity': quantity, 'lots': lots,
+            'untraced': quantity - sum(lot['remaining'] for lot in lots)}
+
+
+def rebuild():
+    """Reset every lot's balances from the stock on hand at each location.
+
+    Which lots earlier issues drew on is unknown, so the stock on hand at
+    a location is taken to be the newest receipts there, as the FIFO
+    valuation does; lots moved by transfers go back to where they were
+    received. The lot balances are rewritten and only lots whose total
+    changes are updated; returns how many.
+    """
+    incoming, on_hand = IncomingItem.__table__, StockBalance.__table__
+    received = func.sum(incoming.c.quantity).over(
+        partition_by=(incoming.c.item_id, incoming.c.location_id),
+        order_by=(incoming.c.received_date.desc(), incoming.c.id.desc()))
+    layers = (
+        select(incoming.c.id, incoming.c.item_id, incoming.c.location_id, incoming.c.expiry_date,
+               incoming.c.quantity, incoming.c.remaining, received.label('received'),
+               func.coalesce(on_hand.c.quantity, 0).label('on_hand'))
+        .outerjoin(on_hand, and_(on_hand.c.item_id == incoming.c.item_id,
+                                 on_hand.c.location_id == incoming.c.location_id))
+        .subquery('layers')
+    )
+    newer = layers.c.received - layers.c.quantity
+    left = case((layers.c.received <= layers.c.on_hand, layers.c.quantity),
+                (newer < layers.c.on_hand, layers.c.on_hand - newer),
+                else_=0)
+    result = db.session.execute(
+        select(layers.c.id, layers.c.location_id, layers.c.item_id, layers.c.expiry_date,
+               layers.c.remaining, left).where((left > 0) | (left != layers.c.remaining)),
+        execution_options={'yield_per': BATCH_SIZE})
+    opened, changed = [], []
+    for partition in result.partitions():
+        for id, location_id, item_id, expiry, remaining, units in partition:
+            if units and location_id is not None:
+                opened.append({'incoming_id': id, 'location_id': location_id, 'item_id': item_id,
+                               'expiry_date': expiry, 'remaining': units})
+            if units != remaining:
+                changed.append({'lot_id': id, 'left': units})
+    db.session.execute(delete(LotBalance.__table__))
+    for start in range(0, len(opened), BATCH_SIZE):
+        db.session.execute(insert(LotBalance.__table__), opened[start:start + BATCH_SIZE])
+    statement = update(incoming).where(incoming.c.id == bindparam('lot_id')).values(remaining=bindparam('left'))
+    for start in range(0, len(changed), BATCH_SIZE):
+        db.session.execute(statement, changed[start:start + BATCH_SIZE])
+    change_feed.mark(db.session, 'incoming-items', [row['lot_id'] for row in changed])
+    db.session.commit()
+    return len(changed)
+
+
+def init_app(app):
+    """Open lot balances for receipts and keep them within the stock on hand when quantities are edited"""
+    event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,247 @@
+import hmac
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, abort, g, has_request_context, request, request_finished, request_started
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from app import db
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Distinct statements remembered for EXPLAIN rate limiting
+EXPLAINED_MAX = 512
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Bucketed observations per label set, rendered in the Prometheus text format"""
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        # Callers hold the registry lock; one slot per bucket plus +Inf, then the sum
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = ('le', bound if bound == '+Inf' else repr(float(bound)))
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+class RequestMetrics:
+    """Per-request latency, SQL and template timings, a slow-query log and /metrics.
+
+    Every request's total latency is recorded. A METRICS_SAMPLE_RATE fraction
+    of requests also accumulate their SQL statement count, SQL time and
+    template render time, and send them back in a Server-Timing header when
+    METRICS_SERVER_TIMING is on (not on streamed pages, whose queries run
+    after the headers; those are recorded when the body has been sent). Every statement is timed, sampled or not,
+    so a statement slower than SLOW_QUERY_MS is always logged; its query
+    plan is logged with it, at most once per SLOW_QUERY_EXPLAIN_INTERVAL
+    seconds for the same SQL.
+
+    Figures are kept per process: under several workers each scrape of
+    /metrics reports the worker that served it.
+    """
+
+    def __init__(self):
+        self.sample_rate = 1.0
+        self.slow_query_seconds = 0.25
+        self.explain_interval = 300
+        self.server_timing = False
+        self.token = None
+        self._lock = threading.Lock()
+        self._explained = {}
+        self.slow_queries = 0
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Time from request start to the end of the response body',
+            DURATION_BUCKETS, ('endpoint', 'method'))
+        self.sql_queries = Histogram(
+            'http_request_sql_queries', 'SQL statements per sampled request', QUERY_BUCKETS, ('endpoint',))
+        self.sql_duration = Histogram(
+            'http_request_sql_duration_seconds', 'SQL time per sampled request', DURATION_BUCKETS, ('endpoint',))
+        self.template_duration = Histogram(
+            'http_request_template_duration_seconds', 'Template render time per sampled request',
+            DURATION_BUCKETS, ('endpoint',))
+        self.responses = {}
+
+    def init_app(self, app):
+        self.sample_rate = app.config.setdefault('METRICS_SAMPLE_RATE', 1.0)
+        self.slow_query_seconds = app.config.setdefault('SLOW_QUERY_MS', 250) / 1000
+        self.explain_interval = app.config.setdefault('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+        self.server_timing = app.config.setdefault('METRICS_SERVER_TIMING', app.debug or app.testing)
+        self.token = app.config.setdefault('METRICS_TOKEN', None)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_execute)
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['request_metrics'] = self
+
+    # --- REQUESTS ---
+
+    def _request_started(self, sender, **extra):
+        g.metrics_started = time.perf_counter()
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.metrics_sample = {'sql_count': 0, 'sql_time': 0.0, 'template_time': 0.0}
+
+    def _request_finished(self, sender, response, **extra):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        endpoint, method = request.endpoint or 'unmatched', request.method
+        status = f'{response.status_code // 100}xx'
+        if response.is_streamed:
+            # A streamed body is generated after this, still inside the request
+            # context, so its statements and template time keep adding to the
+            # sample; the request is recorded once the response is closed
+            sample = g.get('metrics_sample')
+            response.call_on_close(lambda: self._record(started, endpoint, method, status, sample))
+        else:
+            sample = g.pop('metrics_sample', None)
+            self._record(started, endpoint, method, status, sample)
+        if sample and self.server_timing and not response.is_streamed:
+            # A streamed page's queries and template are still to run; only /metrics sees them
+            response.headers['Server-Timing'] = ', '.join([
+                f'sql;dur={sample["sql_time"] * 1000:.1f};desc="{sample["sql_count"]} queries"',
+                f'tpl;dur={sample["template_time"] * 1000:.1f}',
+                f'total;dur={(time.perf_counter() - started) * 1000:.1f}',
+            ])
+
+    def _record(self, started, endpoint, method, status, sample):
+        total = time.perf_counter() - started
+        with self._lock:
+            self.request_duration.observe(total, endpoint, method)
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if sample:
+                self.sql_queries.observe(sample['sql_count'], endpoint)
+                self.sql_duration.observe(sample['sql_time'], endpoint)
+                self.template_duration.observe(sample['template_time'], endpoint)
+
+    def _before_render(self, sender, template, context, **extra):
+        if 'metrics_sample' in g:
+            g.metrics_render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is not None and 'metrics_sample' in g:
+            g.metrics_sample['template_time'] += time.perf_counter() - started
+
+    # --- STATEMENTS ---
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        if has_request_context() and 'metrics_sample' in g:
+            g.metrics_sample['sql_count'] += 1
+            g.metrics_sample['sql_time'] += elapsed
+        if elapsed >= self.slow_query_seconds:
+            self._slow_query(conn, cursor, statement, parameters, executemany, elapsed)
+
+    def _slow_query(self, conn, cursor, statement, parameters, executemany, elapsed):
+        with self._lock:
+            self.slow_queries += 1
+        plan = self._explain(conn, cursor, statement, parameters) if not executemany else None
+        where = f' in {request.endpoint}' if has_request_context() else ''
+        if plan:
+            logger.warning('Slow query (%.0f ms)%s: %s\nPlan:\n%s', elapsed * 1000, where, statement, plan)
+        else:
+            logger.warning('Slow query (%.0f ms)%s: %s', elapsed * 1000, where, statement)
+
+    def _explain(self, conn, cursor, statement, parameters):
+        """The plan of a slow SELECT, unless the same SQL was explained recently"""
+        prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+        if not prefix or statement.split(None, 1)[0].upper() not in ('SELECT', 'WITH'):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(statement, -self.explain_interval) < self.explain_interval:
+                return None
+            if len(self._explained) >= EXPLAINED_MAX:
+                self._explained.clear()
+            self._explained[statement] = now
+        # A raw cursor on the same connection, so the EXPLAIN is not timed or explained itself
+        explain = cursor.connection.cursor()
+        try:
+            explain.execute(prefix + statement, parameters)
+            # The plan text is the last column on both SQLite and PostgreSQL
+            return '\n'.join(str(row[-1]) for row in explain.fetchall())
+        except Exception:
+            logger.debug('Could not explain slow query', exc_info=True)
+            return None
+        finally:
+            explain.close()
+
+    # --- EXPOSITION ---
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        # Imported here: both modules are set up after this one
+        from activity import activity_writer
+        from auth import user_cache
+        from cache import cache
+        from rendering import fragment_cache
+        with self._lock:
+            lines = []
+            for histogram in (self.request_duration, self.sql_queries, self.sql_duration, self.template_duration):
+                lines.extend(histogram.render())
+            lines += ['# HELP http_responses_total Responses by status class', '# TYPE http_responses_total counter']
+            lines += [f'http_responses_total{{status="{status}"}} {count}'
+                      for status, count in sorted(self.responses.items())]
+            lines += ['# HELP sql_slow_queries_total Statements slower than SLOW_QUERY_MS',
+                      '# TYPE sql_slow_queries_total counter', f'sql_slow_queries_total {self.slow_queries}']
+        for prefix, values in (('activity_log', activity_writer.metrics()), ('cache', cache.metrics()),
+                               ('auth_user_cache', user_cache.metrics()),
+                               ('fragment_cache', fragment_cache.metrics())):
+            for name, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+        pool = db.engine.pool
+        if hasattr(pool, 'checkedout'):
+            lines += ['# TYPE db_pool_checked_out gauge', f'db_pool_checked_out {pool.checkedout()}']
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        if self.token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+                abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,119 @@
+"""Baseline schema: users, categories, items and their movements, activity log
+
+Databases created by db.create_all() before migrations existed already have
+these tables; they are left as they are, so upgrading such a database needs
+no stamping.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _missing(table):
+    return not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _missing('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=64), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password_hash', sa.String(length=256), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_users_username', 'users', ['username'], unique=True)
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    if _missing('categories'):
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('name'),
+        )
+    if _missing('activity_logs'):
+        op.create_table(
+            'activity_logs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('action', sa.String(length=100), nullable=False),
+            sa.Column('table_name', sa.String(length=50), nullable=False),
+            sa.Column('record_id', sa.Integer(), nullable=False),
+            sa.Column('details', sa.Text(), nullable=True),
+            sa.Column('user', sa.String(length=100), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if _missing('items'):
+        op.create_table(
+            'items',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('code', sa.String(length=50), nullable=False),
+            sa.Column('name', sa.String(length=200), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('unit_price', sa.Float(), nullable=False),
+            sa.Column('supplier', sa.String(length=200), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.Column('category_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['category_id'], ['categories.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('code'),
+        )
+    if _missing('incoming_items'):
+        op.create_table(
+            'incoming_items',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('unit_price', sa.Float(), nullable=False),
+            sa.Column('supplier', sa.String(length=200), nullable=True),
+            sa.Column('batch_number', sa.String(length=100), nullable=True),
+            sa.Column('expiry_date', sa.Date(), nullable=True),
+            sa.Column('received_date', sa.DateTime(), nullable=True),
+            sa.Column('notes', sa.Text(), nullable=True),
+            sa.Column('received_by', sa.String(length=100), nullable=True),
+            sa.ForeignKeyConstraint(['item_id'], ['items.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if _missing('outgoing_items'):
+        op.create_table(
+            'outgoing_items',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('destination', sa.String(length=200), nullable=False),
+            sa.Column('purpose', sa.String(length=200), nullable=True),
+            sa.Column('request_number', sa.String(length=100), nullable=True),
+            sa.Column('issued_date', sa.DateTime(), nullable=True),
+            sa.Column('notes', sa.Text(), nullable=True),
+            sa.Column('issued_by', sa.String(length=100), nullable=True),
+            sa.ForeignKeyConstraint(['item_id'], ['items.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+
+def downgrade():
+    op.drop_table('outgoing_items')
+    op.drop_table('incoming_items')
+    op.drop_table('items')
+    op.drop_table('activity_logs')
+    op.drop_table('categories')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_index('ix_users_username', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,326 @@
+"""Schema added while db.create_all() still ran at startup
+
+Reorder levels and lot balances, lot allocations, the stock ledger and
+snapshots, dashboard summary tables, report jobs, low-stock alerts, the
+change feed, the listing and activity-log indexes and the full-text item
+search index. Each object is created only if it is missing, so databases
+that create_all() already brought part of the way are completed, not
+rejected. Tables created here are seeded from the existing rows, as the
+startup hooks used to do.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+import logging
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+FTS_TABLE = 'items_fts'
+
+SQLITE_SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        code, name, description,
+        content='items', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2 tokenchars '-_.'"
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON items BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, code, name, description)
+        VALUES (new.id, new.code, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, code, name, description)
+        VALUES ('delete', old.id, old.code, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF code, name, description ON items BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, code, name, description)
+        VALUES ('delete', old.id, old.code, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, code, name, description)
+        VALUES (new.id, new.code, new.name, new.description);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_items_search_tsv ON items USING gin "
+    "(to_tsvector('simple', coalesce(code, '') || ' ' || coalesce(name, '') || ' ' || coalesce(description, '')))",
+    "CREATE INDEX IF NOT EXISTS ix_items_name_trgm ON items USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_items_code_trgm ON items USING gin (code gin_trgm_ops)",
+]
+
+# Just the columns the seeding below reads and writes
+items = sa.table('items', sa.column('id', sa.Integer), sa.column('quantity', sa.Integer),
+                 sa.column('reorder_level', sa.Integer))
+categories = sa.table('categories', sa.column('id', sa.Integer))
+incoming = sa.table('incoming_items', sa.column('id', sa.Integer), sa.column('item_id', sa.Integer),
+                    sa.column('quantity', sa.Integer), sa.column('remaining', sa.Integer),
+                    sa.column('received_date', sa.DateTime))
+outgoing = sa.table('outgoing_items', sa.column('id', sa.Integer), sa.column('issued_date', sa.DateTime))
+ledger = sa.table('stock_ledger', sa.column('item_id', sa.Integer), sa.column('delta', sa.Integer),
+                  sa.column('reason', sa.String), sa.column('ref_table', sa.String),
+                  sa.column('ref_id', sa.Integer), sa.column('created_at', sa.DateTime))
+low_stock = sa.table('low_stock_alerts', sa.column('item_id', sa.Integer), sa.column('quantity', sa.Integer),
+                     sa.column('reorder_level', sa.Integer), sa.column('since', sa.DateTime))
+dashboard_stats = sa.table('dashboard_stats', sa.column('key', sa.String), sa.column('value', sa.Integer))
+daily_stats = sa.table('dashboard_daily_stats', sa.column('day', sa.Date), sa.column('metric', sa.String),
+                       sa.column('count', sa.Integer))
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _create_indexes(table, indexes):
+    existing = _indexes(table)
+    for name, columns, kwargs in indexes:
+        if name not in existing:
+            op.create_index(name, table, columns, **kwargs)
+
+
+def upgrade():
+    tables = _tables()
+    created = set()
+
+    # --- COLUMNS ---
+    if 'reorder_level' not in _columns('items'):
+        op.add_column('items', sa.Column('reorder_level', sa.Integer(), nullable=False, server_default='10'))
+    if 'remaining' not in _columns('incoming_items'):
+        op.add_column('incoming_items', sa.Column('remaining', sa.Integer(), nullable=False, server_default='0'))
+        _seed_lot_balances()
+
+    # --- INDEXES ON THE BASELINE TABLES ---
+    _create_indexes('items', [
+        ('ix_items_name_id', ['name', 'id'], {}),
+        ('ix_items_quantity_id', ['quantity', 'id'], {}),
+        ('ix_items_updated_at_id', ['updated_at', 'id'], {}),
+    ])
+    _create_indexes('incoming_items', [
+        ('ix_incoming_items_item_received', ['item_id', 'received_date', 'id'], {}),
+        ('ix_incoming_items_expiry_date', ['expiry_date'], {}),
+        ('ix_incoming_items_open_lots', ['item_id', 'expiry_date'],
+         {'sqlite_where': sa.text('remaining > 0'), 'postgresql_where': sa.text('remaining > 0')}),
+    ])
+    _create_indexes('outgoing_items', [
+        ('ix_outgoing_items_issued_item', ['issued_date', 'item_id'], {}),
+    ])
+    _create_indexes('activity_logs', [
+        ('ix_activity_logs_timestamp_id', ['timestamp', 'id'], {}),
+        ('ix_activity_logs_table_record', ['table_name', 'record_id', 'timestamp', 'id'], {}),
+        ('ix_activity_logs_action_timestamp', ['action', 'timestamp', 'id'], {}),
+        ('ix_activity_logs_user_timestamp', ['user', 'timestamp', 'id'], {}),
+    ])
+
+    # --- NEW TABLES ---
+    if 'outgoing_allocations' not in tables:
+        op.create_table(
+            'outgoing_allocations',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('outgoing_id', sa.Integer(), nullable=False),
+            sa.Column('incoming_id', sa.Integer(), nullable=True),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['incoming_id'], ['incoming_items.id']),
+            sa.ForeignKeyConstraint(['outgoing_id'], ['outgoing_items.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_outgoing_allocations_outgoing_id', 'outgoing_allocations', ['outgoing_id'])
+        op.create_index('ix_outgoing_allocations_incoming_id', 'outgoing_allocations', ['incoming_id'])
+    if 'dashboard_stats' not in tables:
+        op.create_table(
+            'dashboard_stats',
+            sa.Column('key', sa.String(length=50), nullable=False),
+            sa.Column('value', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('key'),
+        )
+        created.add('dashboard_stats')
+    if 'dashboard_daily_stats' not in tables:
+        op.create_table(
+            'dashboard_daily_stats',
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('metric', sa.String(length=50), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('day', 'metric'),
+        )
+    if 'stock_ledger' not in tables:
+        op.create_table(
+            'stock_ledger',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('delta', sa.Integer(), nullable=False),
+            sa.Column('reason', sa.String(length=20), nullable=False),
+            sa.Column('ref_table', sa.String(length=50), nullable=True),
+            sa.Column('ref_id', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_stock_ledger_item_id', 'stock_ledger', ['item_id', 'id'])
+        created.add('stock_ledger')
+    if 'stock_snapshots' not in tables:
+        op.create_table(
+            'stock_snapshots',
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('ledger_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('taken_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('item_id', 'ledger_id'),
+        )
+        op.create_index('ix_stock_snapshots_item_taken', 'stock_snapshots', ['item_id', 'taken_at'])
+    if 'report_jobs' not in tables:
+        op.create_table(
+            'report_jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('kind', sa.String(length=50), nullable=False),
+            sa.Column('params', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('rows', sa.Integer(), nullable=True),
+            sa.Column('path', sa.String(length=500), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('requested_by', sa.String(length=100), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'low_stock_alerts' not in tables:
+        op.create_table(
+            'low_stock_alerts',
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('reorder_level', sa.Integer(), nullable=False),
+            sa.Column('since', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('item_id'),
+        )
+        created.add('low_stock_alerts')
+    if 'change_feed' not in tables:
+        op.create_table(
+            'change_feed',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('entity', sa.String(length=50), nullable=False),
+            sa.Column('record_id', sa.Integer(), nullable=False),
+            sa.Column('op', sa.String(length=10), nullable=False),
+            sa.Column('changed_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_change_feed_entity_id', 'change_feed', ['entity', 'id'])
+        op.create_index('ix_change_feed_changed_at', 'change_feed', ['changed_at'])
+
+    # --- SEEDING ---
+    now = datetime.utcnow()
+    if 'stock_ledger' in created:
+        # Opening balances, so point-in-time quantities add up from here on
+        op.execute(ledger.insert().from_select(
+            ['item_id', 'delta', 'reason', 'ref_table', 'ref_id', 'created_at'],
+            sa.select(items.c.id, items.c.quantity, sa.literal('opening'), sa.literal('items'), items.c.id,
+                      sa.literal(now, sa.DateTime)).where(items.c.quantity != 0)))
+    if 'low_stock_alerts' in created:
+        op.execute(low_stock.insert().from_select(
+            ['item_id', 'quantity', 'reorder_level', 'since'],
+            sa.select(items.c.id, items.c.quantity, items.c.reorder_level, sa.literal(now, sa.DateTime))
+            .where(items.c.quantity < items.c.reorder_level)))
+    if 'dashboard_stats' in created:
+        _seed_dashboard_stats()
+
+    _install_search()
+
+
+def _seed_lot_balances():
+    """Take each item's stock on hand to be its newest receipts, as the FIFO valuation does"""
+    received = sa.func.sum(incoming.c.quantity).over(
+        partition_by=incoming.c.item_id, order_by=(incoming.c.received_date.desc(), incoming.c.id.desc()))
+    layers = (sa.select(incoming.c.id, incoming.c.quantity, received.label('received'),
+                        items.c.quantity.label('on_hand'))
+              .join(items, items.c.id == incoming.c.item_id).subquery('layers'))
+    newer = layers.c.received - layers.c.quantity
+    left = sa.case((layers.c.received <= layers.c.on_hand, layers.c.quantity),
+                   (newer < layers.c.on_hand, layers.c.on_hand - newer), else_=0)
+    bind = op.get_bind()
+    rows = [{'lot_id': id, 'left': units}
+            for id, units in bind.execute(sa.select(layers.c.id, left).where(left > 0))]
+    if rows:
+        bind.execute(incoming.update().where(incoming.c.id == sa.bindparam('lot_id'))
+                     .values(remaining=sa.bindparam('left')), rows)
+
+
+def _seed_dashboard_stats():
+    bind = op.get_bind()
+    totals = [{'key': key, 'value': bind.scalar(sa.select(sa.func.count()).select_from(table))}
+              for key, table in (('items', items), ('categories', categories))]
+    bind.execute(dashboard_stats.insert(), totals)
+    for metric, column in (('incoming', incoming.c.received_date), ('outgoing', outgoing.c.issued_date)):
+        day = sa.func.date(column)
+        rows = [{'day': d if not isinstance(d, str) else datetime.strptime(d, '%Y-%m-%d').date(),
+                 'metric': metric, 'count': count}
+                for d, count in bind.execute(sa.select(day, sa.func.count()).group_by(day)) if d is not None]
+        if rows:
+            bind.execute(daily_stats.insert(), rows)
+
+
+def _install_search():
+    """The full-text index, where the backend has one; search falls back to LIKE otherwise"""
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        if bind.scalar(sa.text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")):
+            exists = bind.scalar(sa.text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': FTS_TABLE})
+            for statement in SQLITE_SEARCH_DDL[:-1] if exists else SQLITE_SEARCH_DDL:
+                op.execute(statement)
+    elif bind.dialect.name == 'postgresql':
+        # pg_trgm may not be installable with this role; keep the migration going without it
+        try:
+            with bind.begin_nested():
+                for statement in POSTGRES_SEARCH_DDL:
+                    op.execute(statement)
+        except sa.exc.DBAPIError as e:
+            logger.warning('Full-text search index not installed, search will use LIKE: %s', e.orig)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+        op.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif bind.dialect.name == 'postgresql':
+        for index in ('ix_items_search_tsv', 'ix_items_name_trgm', 'ix_items_code_trgm'):
+            op.execute(f'DROP INDEX IF EXISTS {index}')
+    op.drop_table('change_feed')
+    op.drop_table('low_stock_alerts')
+    op.drop_table('report_jobs')
+    op.drop_table('stock_snapshots')
+    op.drop_table('stock_ledger')
+    op.drop_table('dashboard_daily_stats')
+    op.drop_table('dashboard_stats')
+    op.drop_table('outgoing_allocations')
+    for table, names in (
+        ('activity_logs', ['ix_activity_logs_user_timestamp', 'ix_activity_logs_action_timestamp',
+                           'ix_activity_logs_table_record', 'ix_activity_logs_timestamp_id']),
+        ('outgoing_items', ['ix_outgoing_items_issued_item']),
+        ('incoming_items', ['ix_incoming_items_open_lots', 'ix_incoming_items_expiry_date',
+                            'ix_incoming_items_item_received']),
+        ('items', ['ix_items_updated_at_id', 'ix_items_quantity_id', 'ix_items_name_id']),
+    ):
+        for name in names:
+            op.drop_index(name, table_name=table)
+    with op.batch_alter_table('incoming_items') as batch_op:
+        batch_op.drop_column('remaining')
+    with op.batch_alter_table('items') as batch_op:
+        batch_op.drop_column('reorder_level')
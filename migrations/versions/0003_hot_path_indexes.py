@@ -0,0 +1,37 @@
+"""Indexes for the hot listing paths in routes.py
+
+- items (category_id, name, id): /items filtered by category in name order,
+  the per-category item counts on /categories and the has-items check
+  before a category is deleted
+- incoming_items (received_date, id): /incoming-items, newest first
+- outgoing_items (item_id, issued_date): the item_id foreign key; an item's
+  issues are looked up whenever the item is deleted
+
+The other hot filters already lead an index: activity_logs.timestamp,
+items.name, incoming_items.item_id and outgoing_items.issued_date.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_items_category_name', 'items', ['category_id', 'name', 'id'])
+    op.create_index('ix_incoming_items_received_date', 'incoming_items', ['received_date', 'id'])
+    op.create_index('ix_outgoing_items_item_issued', 'outgoing_items', ['item_id', 'issued_date'])
+
+
+def downgrade():
+    op.drop_index('ix_outgoing_items_item_issued', table_name='outgoing_items')
+    op.drop_index('ix_incoming_items_received_date', table_name='incoming_items')
+    op.drop_index('ix_items_category_name', table_name='items')
@@ -0,0 +1,137 @@
+"""Stock locations, per-location balances and transfers
+
+- locations, seeded with the default location (DEFAULT_LOCATION, 'MAIN')
+- stock_balances, one row per (location, item), seeded by putting every
+  item's current quantity at the default location
+- stock_transfers between locations
+- incoming_items.location_id and outgoing_items.location_id, with every
+  existing movement assigned to the default location, and the indexes
+  that serve the listings scoped to a location
+- per-location daily dashboard counters ('incoming@<location id>'),
+  copied from the global ones for the default location
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+DEFAULT_CODE = 'MAIN'
+
+# Just the columns the seeding below reads and writes
+locations = sa.table('locations', sa.column('id', sa.Integer), sa.column('code', sa.String),
+                     sa.column('name', sa.String), sa.column('created_at', sa.DateTime))
+items = sa.table('items', sa.column('id', sa.Integer), sa.column('quantity', sa.Integer))
+balances = sa.table('stock_balances', sa.column('location_id', sa.Integer), sa.column('item_id', sa.Integer),
+                    sa.column('quantity', sa.Integer))
+incoming = sa.table('incoming_items', sa.column('location_id', sa.Integer))
+outgoing = sa.table('outgoing_items', sa.column('location_id', sa.Integer))
+daily_stats = sa.table('dashboard_daily_stats', sa.column('day', sa.Date), sa.column('metric', sa.String),
+                       sa.column('count', sa.Integer))
+
+
+def _add_location_column(table):
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite can add a column with an inline reference, just not the
+        # separate constraint Alembic would emit; this avoids a batch copy
+        op.execute(f'ALTER TABLE {table} ADD COLUMN location_id INTEGER REFERENCES locations (id)')
+    else:
+        op.add_column(table, sa.Column('location_id', sa.Integer(), nullable=True))
+        op.create_foreign_key(f'fk_{table}_location_id', table, 'locations', ['location_id'], ['id'])
+
+
+def upgrade():
+    # --- TABLES ---
+    op.create_table(
+        'locations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('code', sa.String(length=50), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code'),
+    )
+    op.create_table(
+        'stock_balances',
+        sa.Column('location_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id']),
+        sa.PrimaryKeyConstraint('location_id', 'item_id'),
+    )
+    op.create_index('ix_stock_balances_item_location', 'stock_balances', ['item_id', 'location_id'])
+    op.create_index('ix_stock_balances_location_quantity', 'stock_balances', ['location_id', 'quantity', 'item_id'])
+    op.create_table(
+        'stock_transfers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('from_location_id', sa.Integer(), nullable=False),
+        sa.Column('to_location_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('transferred_date', sa.DateTime(), nullable=True),
+        sa.Column('notes', sa.Text(), nullable=True),
+        sa.Column('transferred_by', sa.String(length=100), nullable=True),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['from_location_id'], ['locations.id']),
+        sa.ForeignKeyConstraint(['to_location_id'], ['locations.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_stock_transfers_from_date', 'stock_transfers', ['from_location_id', 'transferred_date', 'id'])
+    op.create_index('ix_stock_transfers_to_date', 'stock_transfers', ['to_location_id', 'transferred_date', 'id'])
+    op.create_index('ix_stock_transfers_item_id', 'stock_transfers', ['item_id'])
+
+    # --- MOVEMENT LOCATIONS ---
+    _add_location_column('incoming_items')
+    _add_location_column('outgoing_items')
+
+    # --- SEED ---
+    bind = op.get_bind()
+    bind.execute(locations.insert().values(code=DEFAULT_CODE, name='Main Warehouse', created_at=datetime.utcnow()))
+    default_id = bind.scalar(sa.select(locations.c.id).where(locations.c.code == DEFAULT_CODE))
+    bind.execute(incoming.update().values(location_id=default_id))
+    bind.execute(outgoing.update().values(location_id=default_id))
+    bind.execute(balances.insert().from_select(
+        ['location_id', 'item_id', 'quantity'],
+        sa.select(sa.literal(default_id), items.c.id, items.c.quantity).where(items.c.quantity != 0)))
+    for metric in ('incoming', 'outgoing'):
+        bind.execute(daily_stats.insert().from_select(
+            ['day', 'metric', 'count'],
+            sa.select(daily_stats.c.day, sa.literal(f'{metric}@{default_id}'), daily_stats.c.count)
+            .where(daily_stats.c.metric == metric)))
+
+    # Indexes last, so the backfill above does not maintain them row by row
+    op.create_index('ix_incoming_items_location_received', 'incoming_items', ['location_id', 'received_date', 'id'])
+    op.create_index('ix_incoming_items_location_expiry', 'incoming_items', ['location_id', 'expiry_date'])
+    op.create_index('ix_outgoing_items_location_issued', 'outgoing_items', ['location_id', 'issued_date', 'id'])
+
+
+def downgrade():
+    bind = op.get_bind()
+    bind.execute(daily_stats.delete().where(daily_stats.c.metric.like('%@%')))
+    op.drop_index('ix_outgoing_items_location_issued', table_name='outgoing_items')
+    op.drop_index('ix_incoming_items_location_expiry', table_name='incoming_items')
+    op.drop_index('ix_incoming_items_location_received', table_name='incoming_items')
+    with op.batch_alter_table('outgoing_items') as batch:
+        batch.drop_column('location_id')
+    with op.batch_alter_table('incoming_items') as batch:
+        batch.drop_column('location_id')
+    op.drop_index('ix_stock_transfers_item_id', table_name='stock_transfers')
+    op.drop_index('ix_stock_transfers_to_date', table_name='stock_transfers')
+    op.drop_index('ix_stock_transfers_from_date', table_name='stock_transfers')
+    op.drop_table('stock_transfers')
+    op.drop_index('ix_stock_balances_location_quantity', table_name='stock_balances')
+    op.drop_index('ix_stock_balances_item_location', table_name='stock_balances')
+    op.drop_table('stock_balances')
+    op.drop_table('locations')
@@ -0,0 +1,98 @@
+"""Lot balances per location
+
+- lot_balances, one row per (lot, location) with units left, so FEFO
+  allocation, transfers and the expiring-batches alert work per location;
+  seeded by putting each open lot at the location it was received at,
+  trimmed (newest receipts kept) to what that location holds
+- ix_incoming_items_location_expiry is replaced by the lot balances'
+  own expiry index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from collections import defaultdict
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+OPEN = sa.text('remaining > 0')
+
+# Just the columns the seeding below reads and writes
+incoming = sa.table('incoming_items', sa.column('id', sa.Integer), sa.column('item_id', sa.Integer),
+                    sa.column('location_id', sa.Integer), sa.column('expiry_date', sa.Date),
+                    sa.column('received_date', sa.DateTime), sa.column('remaining', sa.Integer))
+balances = sa.table('stock_balances', sa.column('location_id', sa.Integer), sa.column('item_id', sa.Integer),
+                    sa.column('quantity', sa.Integer))
+lot_balances = sa.table('lot_balances', sa.column('incoming_id', sa.Integer), sa.column('location_id', sa.Integer),
+                        sa.column('item_id', sa.Integer), sa.column('expiry_date', sa.Date),
+                        sa.column('remaining', sa.Integer))
+
+
+def upgrade():
+    op.create_table(
+        'lot_balances',
+        sa.Column('incoming_id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('expiry_date', sa.Date(), nullable=True),
+        sa.Column('remaining', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['incoming_id'], ['incoming_items.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id']),
+        sa.PrimaryKeyConstraint('incoming_id', 'location_id'),
+    )
+    _seed_lot_balances()
+    op.create_index('ix_lot_balances_open', 'lot_balances', ['item_id', 'location_id', 'expiry_date', 'incoming_id'],
+                    sqlite_where=OPEN, postgresql_where=OPEN)
+    op.create_index('ix_lot_balances_location_expiry', 'lot_balances', ['location_id', 'expiry_date'],
+                    sqlite_where=OPEN, postgresql_where=OPEN)
+    op.drop_index('ix_incoming_items_location_expiry', table_name='incoming_items')
+
+
+def _seed_lot_balances():
+    """Each open lot at its receiving location, newest first up to what the location holds.
+
+    Until now lots were drawn item-wide, so a location may show lots that
+    were really issued elsewhere; those units are taken off the lot.
+    """
+    bind = op.get_bind()
+    on_hand = {(item_id, location_id): quantity for location_id, item_id, quantity in bind.execute(
+        sa.select(balances.c.location_id, balances.c.item_id, balances.c.quantity))}
+    lots = defaultdict(list)
+    for row in bind.execute(
+            sa.select(incoming.c.id, incoming.c.item_id, incoming.c.location_id, incoming.c.expiry_date,
+                      incoming.c.remaining)
+            .where(incoming.c.remaining > 0)
+            .order_by(incoming.c.received_date.desc(), incoming.c.id.desc())):
+        lots[(row.item_id, row.location_id)].append(row)
+    rows, trimmed = [], []
+    for key, open_lots in lots.items():
+        left = max(on_hand.get(key, 0), 0) if key[1] is not None else 0
+        for lot in open_lots:
+            units = min(lot.remaining, left)
+            left -= units
+            if units:
+                rows.append({'incoming_id': lot.id, 'location_id': lot.location_id, 'item_id': lot.item_id,
+                             'expiry_date': lot.expiry_date, 'remaining': units})
+            if units != lot.remaining:
+                trimmed.append({'lot_id': lot.id, 'left': units})
+    if rows:
+        bind.execute(lot_balances.insert(), rows)
+    if trimmed:
+        bind.execute(incoming.update().where(incoming.c.id == sa.bindparam('lot_id'))
+                     .values(remaining=sa.bindparam('left')), trimmed)
+
+
+def downgrade():
+    op.create_index('ix_incoming_items_location_expiry', 'incoming_items', ['location_id', 'expiry_date'])
+    op.drop_index('ix_lot_balances_location_expiry', table_name='lot_balances')
+    op.drop_index('ix_lot_balances_open', table_name='lot_balances')
+    op.drop_table('lot_balances')
@@ -0,0 +1,64 @@
+"""Per-location low-stock alerts and stocked-item counters
+
+- location_low_stock_alerts, one row per (location, item) whose balance
+  is below the item's reorder level, seeded from the current balances
+- 'stocked@<location id>' dashboard counters, the number of items with
+  stock on hand at each location
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# Just the columns the seeding below reads and writes
+items = sa.table('items', sa.column('id', sa.Integer), sa.column('reorder_level', sa.Integer))
+balances = sa.table('stock_balances', sa.column('location_id', sa.Integer), sa.column('item_id', sa.Integer),
+                    sa.column('quantity', sa.Integer))
+location_alerts = sa.table('location_low_stock_alerts', sa.column('location_id', sa.Integer),
+                           sa.column('item_id', sa.Integer), sa.column('quantity', sa.Integer),
+                           sa.column('reorder_level', sa.Integer), sa.column('since', sa.DateTime))
+dashboard_stats = sa.table('dashboard_stats', sa.column('key', sa.String), sa.column('value', sa.Integer))
+
+
+def upgrade():
+    op.create_table(
+        'location_low_stock_alerts',
+        sa.Column('location_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('reorder_level', sa.Integer(), nullable=False),
+        sa.Column('since', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['items.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['location_id'], ['locations.id']),
+        sa.PrimaryKeyConstraint('location_id', 'item_id'),
+    )
+
+    # --- SEED ---
+    bind = op.get_bind()
+    bind.execute(location_alerts.insert().from_select(
+        ['location_id', 'item_id', 'quantity', 'reorder_level', 'since'],
+        sa.select(balances.c.location_id, balances.c.item_id, balances.c.quantity, items.c.reorder_level,
+                  sa.literal(datetime.utcnow()))
+        .join(items, items.c.id == balances.c.item_id)
+        .where(balances.c.quantity < items.c.reorder_level)))
+    stocked = bind.execute(sa.select(balances.c.location_id, sa.func.count())
+                           .where(balances.c.quantity > 0).group_by(balances.c.location_id)).all()
+    if stocked:
+        bind.execute(dashboard_stats.insert(), [{'key': f'stocked@{location_id}', 'value': count}
+                                                for location_id, count in stocked])
+
+
+def downgrade():
+    op.get_bind().execute(dashboard_stats.delete().where(dashboard_stats.c.key.like('stocked@%')))
+    op.drop_table('location_low_stock_alerts')
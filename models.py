@@ -1,11 +1,16 @@
 from datetime import datetime
-from app import db, login_manager
+from functools import lru_cache
+from flask import current_app
+from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+# The logged-in user is resolved by auth.UserCache, not loaded here
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    # A method with its cost parameters spelled out, as stored in front of the hash
+    return generate_password_hash('', method).split('$', 1)[0]
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -15,11 +20,16 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256))
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # PASSWORD_HASH_METHOD is any Werkzeug method, e.g. 'scrypt' or 'pbkdf2:sha256:600000'
+        self.password_hash = generate_password_hash(password, current_app.config['PASSWORD_HASH_METHOD'])
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def needs_rehash(self):
+        """True when the stored hash was made with another method or cost than configured"""
+        return self.password_hash.split('$', 1)[0] != _hash_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -36,6 +46,8 @@ class Category(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
 
+DEFAULT_REORDER_LEVEL = 10
+
 class Item(db.Model):
     __tablename__ = 'items'
     
@@ -43,17 +55,81 @@ class Item(db.Model):
     code = db.Column(db.String(50), nullable=False, unique=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
-    quantity = db.Column(db.Integer, nullable=False, default=0)
+    # active_history keeps the old value on overwrite so the stock ledger can record the delta
+    quantity = db.column_property(db.Column(db.Integer, nullable=False, default=0), active_history=True)
     unit_price = db.Column(db.Float, nullable=False, default=0.0)
     supplier = db.Column(db.String(200))
+    # Stock below this level raises a low-stock alert
+    reorder_level = db.Column(db.Integer, nullable=False, default=DEFAULT_REORDER_LEVEL)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     
+    # Composite keys backing the keyset-paginated /items sort orders; a
+    # category's items by name: the category filter, item counts per category
+    __table_args__ = (
+        db.Index('ix_items_name_id', 'name', 'id'),
+        db.Index('ix_items_quantity_id', 'quantity', 'id'),
+        db.Index('ix_items_updated_at_id', 'updated_at', 'id'),
+        db.Index('ix_items_category_name', 'category_id', 'name', 'id'),
+    )
+    
+    # The item's balance at one location, filled in by listings scoped to a location
+    location_quantity = db.query_expression()
+    
     def __repr__(self):
         return f'<Item {self.code}: {self.name}>'
 
+# Defined after Item so the subquery can reference it; deferred so it is
+# only computed where a listing asks for it with undefer()
+Category.item_count = db.column_property(
+    db.select(db.func.count(Item.id)).where(Item.category_id == Category.id).correlate_except(Item).scalar_subquery(),
+    deferred=True
+)
+
+class Location(db.Model):
+    """A warehouse or site holding stock; every movement happens at one"""
+    __tablename__ = 'locations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), nullable=False, unique=True)
+    name = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Location {self.code}>'
+
+class StockBalance(db.Model):
+    """Units of an item on hand at one location; an item's balances add up to Item.quantity"""
+    __tablename__ = 'stock_balances'
+    
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    item = db.relationship('Item')
+    location = db.relationship('Location')
+    
+    # The primary key serves a location's balances; an item's balances at
+    # every location: stock checks and the item_id foreign key; a location's
+    # items by quantity: the scoped quantity sort
+    __table_args__ = (
+        db.Index('ix_stock_balances_item_location', 'item_id', 'location_id'),
+        db.Index('ix_stock_balances_location_quantity', 'location_id', 'quantity', 'item_id'),
+    )
+    
+    @property
+    def reorder_level(self):
+        return self.item.reorder_level
+    
+    def __repr__(self):
+        return f'<StockBalance item={self.item_id} location={self.location_id}: {self.quantity}>'
+
+def _received_quantity(context):
+    return context.get_current_parameters()['quantity']
+
 class IncomingItem(db.Model):
     __tablename__ = 'incoming_items'
     
@@ -67,8 +143,27 @@ class IncomingItem(db.Model):
     received_date = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)
     received_by = db.Column(db.String(100), default='System Admin')
+    # Units of this lot still on hand; issues draw it down first-expired-first-out
+    remaining = db.Column(db.Integer, nullable=False, default=_received_quantity)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'))
     
     item = db.relationship('Item', backref='incoming_transactions')
+    location = db.relationship('Location')
+    
+    # Per-item receipts newest first: the FIFO layer scan in reports.py;
+    # all receipts newest first: the /incoming-items listing; expiry dates:
+    # the expiring batches alert; an item's open lots: FEFO allocation in
+    # lots.py, kept small by indexing only lots with stock left; the
+    # listing scoped to one location. remaining is the lot's total over
+    # every location; LotBalance has it per location.
+    __table_args__ = (
+        db.Index('ix_incoming_items_item_received', 'item_id', 'received_date', 'id'),
+        db.Index('ix_incoming_items_received_date', 'received_date', 'id'),
+        db.Index('ix_incoming_items_expiry_date', 'expiry_date'),
+        db.Index('ix_incoming_items_open_lots', 'item_id', 'expiry_date',
+                 sqlite_where=db.text('remaining > 0'), postgresql_where=db.text('remaining > 0')),
+        db.Index('ix_incoming_items_location_received', 'location_id', 'received_date', 'id'),
+    )
     
     @property
     def total_value(self):
@@ -89,8 +184,22 @@ class OutgoingItem(db.Model):
     issued_date = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)
     issued_by = db.Column(db.String(100), default='System Admin')
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'))
     
     item = db.relationship('Item', backref='outgoing_transactions')
+    location = db.relationship('Location')
+    allocations = db.relationship('OutgoingAllocation', back_populates='outgoing',
+                                  cascade='all, delete-orphan', passive_deletes=True)
+    
+    # Issues in a date range grouped by item: turnover and ABC reports, and
+    # the /outgoing-items listing newest first; an item's issues: the
+    # item_id foreign key, looked up whenever an item is deleted; a
+    # location's issues newest first: the scoped listing and dashboard
+    __table_args__ = (
+        db.Index('ix_outgoing_items_issued_item', 'issued_date', 'item_id'),
+        db.Index('ix_outgoing_items_item_issued', 'item_id', 'issued_date'),
+        db.Index('ix_outgoing_items_location_issued', 'location_id', 'issued_date', 'id'),
+    )
     
     @property
     def total_value(self):
@@ -99,6 +208,81 @@ class OutgoingItem(db.Model):
     def __repr__(self):
         return f'<OutgoingItem {self.quantity} of {self.item.name}>'
 
+class OutgoingAllocation(db.Model):
+    """The units of an issue drawn from one lot; incoming_id is None for stock not traced to a receipt"""
+    __tablename__ = 'outgoing_allocations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    outgoing_id = db.Column(db.Integer, db.ForeignKey('outgoing_items.id', ondelete='CASCADE'), nullable=False)
+    incoming_id = db.Column(db.Integer, db.ForeignKey('incoming_items.id'))
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    outgoing = db.relationship('OutgoingItem', back_populates='allocations')
+    lot = db.relationship('IncomingItem')
+    
+    # An issue's lot split; every issue that drew on a lot (recalls)
+    __table_args__ = (
+        db.Index('ix_outgoing_allocations_outgoing_id', 'outgoing_id'),
+        db.Index('ix_outgoing_allocations_incoming_id', 'incoming_id'),
+    )
+    
+    def __repr__(self):
+        return f'<OutgoingAllocation {self.quantity} of lot {self.incoming_id} to {self.outgoing_id}>'
+
+class LotBalance(db.Model):
+    """Units of a lot on hand at one location; a lot's balances add up to IncomingItem.remaining"""
+    __tablename__ = 'lot_balances'
+    
+    incoming_id = db.Column(db.Integer, db.ForeignKey('incoming_items.id', ondelete='CASCADE'), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), primary_key=True)
+    # Copied from the lot so FEFO allocation and expiry alerts read one index
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
+    expiry_date = db.Column(db.Date)
+    remaining = db.Column(db.Integer, nullable=False, default=0)
+    
+    lot = db.relationship('IncomingItem')
+    location = db.relationship('Location')
+    
+    # An item's open lots at a location in FEFO order: allocation of issues
+    # and transfers; a location's open lots by expiry: the scoped expiring
+    # batches alert. Both index only lots with units left there.
+    __table_args__ = (
+        db.Index('ix_lot_balances_open', 'item_id', 'location_id', 'expiry_date', 'incoming_id',
+                 sqlite_where=db.text('remaining > 0'), postgresql_where=db.text('remaining > 0')),
+        db.Index('ix_lot_balances_location_expiry', 'location_id', 'expiry_date',
+                 sqlite_where=db.text('remaining > 0'), postgresql_where=db.text('remaining > 0')),
+    )
+    
+    def __repr__(self):
+        return f'<LotBalance lot={self.incoming_id} location={self.location_id}: {self.remaining}>'
+
+class StockTransfer(db.Model):
+    """Units of an item moved from one location to another; Item.quantity is unchanged"""
+    __tablename__ = 'stock_transfers'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
+    from_location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), nullable=False)
+    to_location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    transferred_date = db.Column(db.DateTime, default=datetime.utcnow)
+    notes = db.Column(db.Text)
+    transferred_by = db.Column(db.String(100), default='System Admin')
+    
+    item = db.relationship('Item')
+    from_location = db.relationship('Location', foreign_keys=[from_location_id])
+    to_location = db.relationship('Location', foreign_keys=[to_location_id])
+    
+    # A location's transfers out and in, newest first: the /transfers listing
+    __table_args__ = (
+        db.Index('ix_stock_transfers_from_date', 'from_location_id', 'transferred_date', 'id'),
+        db.Index('ix_stock_transfers_to_date', 'to_location_id', 'transferred_date', 'id'),
+        db.Index('ix_stock_transfers_item_id', 'item_id'),
+    )
+    
+    def __repr__(self):
+        return f'<StockTransfer {self.quantity} of {self.item_id}: {self.from_location_id} -> {self.to_location_id}>'
+
 class ActivityLog(db.Model):
     __tablename__ = 'activity_logs'
     
@@ -110,5 +294,139 @@ class ActivityLog(db.Model):
     user = db.Column(db.String(100), default='System')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Every listing is newest first by (timestamp, id); each filter gets an
+    # index that leads with the filtered column and ends in that sort key
+    __table_args__ = (
+        db.Index('ix_activity_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_activity_logs_table_record', 'table_name', 'record_id', 'timestamp', 'id'),
+        db.Index('ix_activity_logs_action_timestamp', 'action', 'timestamp', 'id'),
+        db.Index('ix_activity_logs_user_timestamp', 'user', 'timestamp', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<ActivityLog {self.action} on {self.table_name}>'
+
+class DashboardStat(db.Model):
+    """Running totals maintained by stats.py alongside every write"""
+    __tablename__ = 'dashboard_stats'
+    
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DashboardStat {self.key}={self.value}>'
+
+class DailyStat(db.Model):
+    """Per-day movement counts so "last N days" is a sum over N rows"""
+    __tablename__ = 'dashboard_daily_stats'
+    
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DailyStat {self.day} {self.metric}={self.count}>'
+
+class StockLedgerEntry(db.Model):
+    """Append-only record of every change to an item's quantity"""
+    __tablename__ = 'stock_ledger'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the history of an item outlives the item
+    item_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    ref_table = db.Column(db.String(50))
+    ref_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_stock_ledger_item_id', 'item_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<StockLedgerEntry item={self.item_id} {self.delta:+d} {self.reason}>'
+
+class StockSnapshot(db.Model):
+    """An item's quantity after every ledger entry up to ledger_id"""
+    __tablename__ = 'stock_snapshots'
+    
+    item_id = db.Column(db.Integer, primary_key=True)
+    ledger_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_item_taken', 'item_id', 'taken_at'),
+    )
+    
+    def __repr__(self):
+        return f'<StockSnapshot item={self.item_id} @{self.ledger_id}={self.quantity}>'
+
+class ReportJob(db.Model):
+    """A report run in the background; the result is a CSV file under REPORT_DIR"""
+    __tablename__ = 'report_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    rows = db.Column(db.Integer)
+    path = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    requested_by = db.Column(db.String(100), default='System')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.kind} {self.status}>'
+
+class LowStockAlert(db.Model):
+    """The items currently below their reorder level, maintained by alerts.py as stock moves"""
+    __tablename__ = 'low_stock_alerts'
+    
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    reorder_level = db.Column(db.Integer, nullable=False)
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    item = db.relationship('Item')
+    
+    def __repr__(self):
+        return f'<LowStockAlert item={self.item_id} {self.quantity}/{self.reorder_level}>'
+
+class LocationLowStockAlert(db.Model):
+    """The balances currently below their item's reorder level, per location, maintained by alerts.py as stock moves"""
+    __tablename__ = 'location_low_stock_alerts'
+    
+    # Location first: a location's alerts are a range of the primary key
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    reorder_level = db.Column(db.Integer, nullable=False)
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    item = db.relationship('Item')
+    
+    def __repr__(self):
+        return f'<LocationLowStockAlert item={self.item_id} location={self.location_id} {self.quantity}/{self.reorder_level}>'
+
+class ChangeFeedEntry(db.Model):
+    """One insert, update (op 'upsert') or delete of a synced record; the id is the feed cursor"""
+    __tablename__ = 'change_feed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Feeds filtered to some entities; the retention job's cutoff
+    __table_args__ = (
+        db.Index('ix_change_feed_entity_id', 'entity', 'id'),
+        db.Index('ix_change_feed_changed_at', 'changed_at'),
+    )
+    
     def __repr__(self):
-        return f'<ActivityLog {self.action} on {self.table_name}>'
\ No newline at end of file
+        return f'<ChangeFeedEntry {self.id} {self.op} {self.entity} {self.record_id}>'
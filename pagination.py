@@ -0,0 +1,111 @@
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import tuple_
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(values):
+    """Encode the sort key of a row into an opaque URL-safe cursor"""
+    payload = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor produced by encode_cursor, returning None if it is malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """One page of a keyset (seek) paginated query"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def keyset_paginate(query, columns, key, after=None, before=None, per_page=50, descending=False):
+    """Seek-paginate a query ordered by columns.
+
+    The last column must be unique so that the ordering is total. key maps a
+    result row to its sort values. Only one of after/before is honoured; each
+    is a cursor returned on a previous page. One extra row is fetched to know
+    whether another page exists, so no COUNT(*) or OFFSET is ever issued.
+    """
+    after_values = decode_cursor(after)
+    before_values = None if after_values else decode_cursor(before)
+    if after_values is not None and len(after_values) != len(columns):
+        after_values = None
+    if before_values is not None and len(before_values) != len(columns):
+        before_values = None
+
+    row_key = tuple_(*columns)
+    # Walking backwards means flipping both the comparison and the ordering,
+    # then reversing the fetched rows back into display order.
+    backwards = before_values is not None
+    ascending = descending == backwards
+
+    if after_values is not None:
+        query = query.filter(row_key < tuple_(*after_values) if descending else row_key > tuple_(*after_values))
+    elif backwards:
+        query = query.filter(row_key > tuple_(*before_values) if descending else row_key < tuple_(*before_values))
+
+    query = query.order_by(None).order_by(*[c.asc() if ascending else c.desc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = encode_cursor(key(rows[0])), encode_cursor(key(rows[-1]))
+        if backwards:
+            prev_cursor = first if has_more else None
+            next_cursor = last
+        else:
+            next_cursor = last if has_more else None
+            prev_cursor = first if after_values is not None else None
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor, per_page=per_page)
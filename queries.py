@@ -0,0 +1,84 @@
+from flask import g, has_request_context
+from sqlalchemy import desc, event
+from sqlalchemy.orm import joinedload, selectinload, undefer
+from app import db
+from models import Item, Category, IncomingItem, OutgoingItem, OutgoingAllocation
+
+# --- LISTING QUERIES ---
+# Each listing loads everything its template touches up front, so rendering
+# a page costs a fixed number of statements regardless of how many rows it shows.
+
+def item_listing():
+    """Items with their category joined in"""
+    return Item.query.options(joinedload(Item.category).load_only(Category.name))
+
+def categories_with_counts():
+    """Categories with their item count computed by a correlated subquery"""
+    return Category.query.options(undefer(Category.item_count)).order_by(Category.name)
+
+def incoming_history():
+    """Incoming transactions, newest first, with the item's display fields (updated_at keys the row fragment)"""
+    return IncomingItem.query.options(
+        joinedload(IncomingItem.item).load_only(Item.code, Item.name, Item.updated_at)
+    ).order_by(desc(IncomingItem.received_date))
+
+def outgoing_history():
+    """Outgoing transactions, newest first, with the fields total_value needs and their lot split"""
+    return OutgoingItem.query.options(
+        joinedload(OutgoingItem.item).load_only(Item.code, Item.name, Item.unit_price, Item.updated_at),
+        selectinload(OutgoingItem.allocations).joinedload(OutgoingAllocation.lot)
+        .load_only(IncomingItem.batch_number, IncomingItem.expiry_date)
+    ).order_by(desc(OutgoingItem.issued_date))
+
+def category_has_items(category_id):
+    """Existence check that does not load the category's items"""
+    return db.session.query(Item.query.filter_by(category_id=category_id).exists()).scalar()
+
+
+# --- QUERY COUNTING ---
+
+class QueryCounter:
+    """Count SQL statements executed on an engine inside a with block"""
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.engine = self.engine or db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+def _count_request_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+def init_app(app):
+    """Track the number of SQL statements per request.
+
+    The count is kept on flask.g and, when QUERY_COUNT_HEADER is enabled
+    (on by default under TESTING), returned in an X-Query-Count header.
+    """
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _count_request_query)
+
+    @app.before_request
+    def _start_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def _report_query_count(response):
+        # A streamed body runs more statements after the headers; none is better than a short count
+        if app.config.get('QUERY_COUNT_HEADER', app.testing) and 'query_count' in g and not response.is_streamed:
+            response.headers['X-Query-Count'] = str(g.query_count)
+        return response
@@ -0,0 +1,142 @@
+import threading
+from flask import Response, current_app, get_flashed_messages, render_template, stream_template
+from flask_wtf.csrf import generate_csrf
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from cache import MemoryBackend
+
+
+# --- FRAGMENT CACHE ---
+
+class FragmentCacheExtension(Extension):
+    """{% cache 'name', key, ... %}...{% endcache %}: render the body once per key.
+
+    The key parts must cover everything the body shows, e.g. a row id and
+    its updated_at; the template name is added to the key automatically.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.Tuple(parts, 'load')]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        return fragment_cache.fetch(key, caller)
+
+
+class FragmentCache:
+    """Rendered template fragments in a bounded in-process LRU.
+
+    Fragments are keyed on the data they show rather than on entity
+    versions, so nothing needs invalidating: a changed row has a new
+    updated_at and is simply rendered again, and the old entry ages out.
+    FRAGMENT_CACHE_SIZE = 0 renders every fragment.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 3600
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0}
+
+    def init_app(self, app):
+        size = app.config.setdefault('FRAGMENT_CACHE_SIZE', 4096)
+        self.ttl = app.config.setdefault('FRAGMENT_CACHE_TTL', 3600)
+        self.backend = MemoryBackend(size) if size else None
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.extensions['fragment_cache'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def fetch(self, key, render):
+        if self.backend is None:
+            return render()
+        html = self.backend.get(key)
+        if isinstance(html, Markup):
+            self._count('hits')
+            return html
+        self._count('misses')
+        html = Markup(render())
+        self.backend.set(key, html, self.ttl)
+        return html
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def metrics(self):
+        with self._lock:
+            data = dict(self._metrics)
+        data['evictions'] = self.backend.evictions if self.backend is not None else 0
+        return data
+
+
+fragment_cache = FragmentCache()
+
+
+# --- STREAMED PAGES ---
+
+class Deferred:
+    """A value built on first use, so a streamed page can send its header before the query runs"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._built = False
+
+    def _get(self):
+        if not self._built:
+            self._value = self._factory()
+            self._built = True
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __bool__(self):
+        return bool(self._get())
+
+
+def _buffered(chunks, size):
+    # The first chunk goes out as soon as there is one, which is what the
+    # time to first byte measures; later ones are batched into fewer writes.
+    buffer, length, first = [], 0, True
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if first or length >= size:
+            yield ''.join(buffer)
+            buffer, length, first = [], 0, False
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    """Render a page while it is being sent when STREAM_TEMPLATES is on, else all at once.
+
+    Wrap the page query in Deferred and it runs when the template first
+    reaches the rows, after the header and filters are on their way. Its
+    statements are then not known when the response headers go out, so a
+    streamed page sends no X-Query-Count or Server-Timing; request_metrics
+    records the whole request once the body has been sent. The session is
+    saved with the headers, so anything the template would write to it
+    (consumed flash messages, the CSRF token) is done here first.
+    """
+    if not current_app.config.get('STREAM_TEMPLATES', True):
+        return render_template(template_name, **context)
+    get_flashed_messages(with_categories=True)
+    generate_csrf()
+    size = current_app.config.get('STREAM_BUFFER_SIZE', 8192)
+    return Response(_buffered(stream_template(template_name, **context), size), mimetype='text/html')
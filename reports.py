@@ -0,0 +1,307 @@
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, literal, select
+from app import db
+from models import Item, Category, IncomingItem, OutgoingItem, ReportJob
+import ledger
+
+logger = logging.getLogger(__name__)
+
+# Share of consumption value before an item for it to be class A, then B; the rest is C
+ABC_THRESHOLDS = (0.80, 0.95)
+BATCH_SIZE = 5000
+
+
+class ReportError(Exception):
+    """A report that cannot be built from the given parameters"""
+
+
+def month_bounds(month):
+    """First moment of month ('YYYY-MM') and of the month after it"""
+    try:
+        start = datetime.strptime(month, '%Y-%m')
+    except (TypeError, ValueError):
+        raise ReportError(f'Invalid month {month!r}, expected YYYY-MM.')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _months_before(start, months):
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return start
+
+
+# --- BUILDING BLOCKS ---
+# Everything is aggregated by the database: each report is one SELECT whose
+# result has a row per item, never a row per movement.
+
+def _unit_costs(end):
+    """Weighted average receipt cost per item over all receipts before end"""
+    incoming = IncomingItem.__table__
+    return (
+        select(incoming.c.item_id,
+               (func.sum(incoming.c.quantity * incoming.c.unit_price) / func.sum(incoming.c.quantity)).label('unit_cost'))
+        .where(incoming.c.received_date < end, incoming.c.quantity > 0)
+        .group_by(incoming.c.item_id)
+        .subquery('wac')
+    )
+
+
+def _fifo_layers(end, balance):
+    """FIFO cost of each item's stock on hand at end.
+
+    Under FIFO the stock still on hand is made of the newest receipts, so a
+    running total over receipts newest first shows how much of each layer
+    is left. Units not covered by any receipt (opening balances) are
+    reported separately so the caller can value them at the item price.
+    """
+    incoming = IncomingItem.__table__
+    received = func.sum(incoming.c.quantity).over(
+        partition_by=incoming.c.item_id,
+        order_by=(incoming.c.received_date.desc(), incoming.c.id.desc()))
+    layers = (
+        select(incoming.c.item_id, incoming.c.quantity, incoming.c.unit_price, received.label('received'))
+        .where(incoming.c.received_date < end)
+        .subquery('layers')
+    )
+    newer = layers.c.received - layers.c.quantity
+    taken = case((layers.c.received <= balance.c.quantity, layers.c.quantity),
+                 else_=balance.c.quantity - newer)
+    return (
+        select(layers.c.item_id,
+               func.sum(taken).label('units'),
+               func.sum(taken * layers.c.unit_price).label('value'))
+        .join(balance, balance.c.item_id == layers.c.item_id)
+        .where(newer < balance.c.quantity)
+        .group_by(layers.c.item_id)
+        .subquery('fifo')
+    )
+
+
+def _issued(start, end):
+    outgoing = OutgoingItem.__table__
+    return (
+        select(outgoing.c.item_id, func.sum(outgoing.c.quantity).label('units'))
+        .where(outgoing.c.issued_date >= start, outgoing.c.issued_date < end)
+        .group_by(outgoing.c.item_id)
+        .subquery('issued')
+    )
+
+
+# --- REPORTS ---
+# Each returns (columns, statement) for the CSV writer to stream.
+
+def valuation(month):
+    """Quantity on hand at the end of month valued by weighted average cost and by FIFO"""
+    start, end = month_bounds(month)
+    balance = ledger.balances(end - timedelta(microseconds=1)).subquery('balance')
+    costs = _unit_costs(end)
+    fifo = _fifo_layers(end, balance)
+    unit_cost = func.coalesce(costs.c.unit_cost, Item.unit_price)
+    uncovered = balance.c.quantity - func.coalesce(fifo.c.units, 0)
+    statement = (
+        select(Item.code, Item.name, Category.name, balance.c.quantity,
+               unit_cost,
+               balance.c.quantity * unit_cost,
+               func.coalesce(fifo.c.value, 0) + uncovered * Item.unit_price)
+        .select_from(balance)
+        .join(Item, Item.id == balance.c.item_id)
+        .join(Category, Category.id == Item.category_id)
+        .outerjoin(costs, costs.c.item_id == balance.c.item_id)
+        .outerjoin(fifo, fifo.c.item_id == balance.c.item_id)
+        .where(balance.c.quantity != 0)
+        .order_by(Item.code)
+    )
+    columns = ['code', 'name', 'category', 'quantity', 'wac_unit_cost', 'wac_value', 'fifo_value']
+    return columns, statement
+
+
+def turnover(month):
+    """Units issued in month against the average of opening and closing stock"""
+    start, end = month_bounds(month)
+    opening = ledger.balances(start - timedelta(microseconds=1)).subquery('opening')
+    closing = ledger.balances(end - timedelta(microseconds=1)).subquery('closing')
+    issued = _issued(start, end)
+    costs = _unit_costs(end)
+    opening_units = func.coalesce(opening.c.quantity, 0)
+    closing_units = func.coalesce(closing.c.quantity, 0)
+    issued_units = func.coalesce(issued.c.units, 0)
+    average = (opening_units + closing_units) / 2.0
+    days = (end - start).days
+    statement = (
+        select(Item.code, Item.name, Category.name, opening_units, closing_units, issued_units,
+               issued_units * func.coalesce(costs.c.unit_cost, Item.unit_price),
+               case((average > 0, issued_units / average)),
+               case((issued_units > 0, average * days / issued_units)))
+        .join(Category, Category.id == Item.category_id)
+        .outerjoin(opening, opening.c.item_id == Item.id)
+        .outerjoin(closing, closing.c.item_id == Item.id)
+        .outerjoin(issued, issued.c.item_id == Item.id)
+        .outerjoin(costs, costs.c.item_id == Item.id)
+        .where((opening_units != 0) | (closing_units != 0) | (issued_units != 0))
+        .order_by(Item.code)
+    )
+    columns = ['code', 'name', 'category', 'opening_units', 'closing_units', 'issued_units',
+               'cost_of_goods_issued', 'turnover', 'days_of_supply']
+    return columns, statement
+
+
+def abc(month, months=12):
+    """ABC classes by consumption value over the months ending with month.
+
+    Items are ranked by units issued times weighted average cost; a window
+    over that ranking gives each item the share of total value ranked ahead
+    of it. Items with no issues in the period are not listed (class C).
+    """
+    start, end = month_bounds(month)
+    start = _months_before(start, int(months))
+    issued = _issued(start, end)
+    costs = _unit_costs(end)
+    value = issued.c.units * func.coalesce(costs.c.unit_cost, Item.unit_price)
+    ranked = (
+        select(Item.id, Item.code, Item.name, Category.name.label('category'), issued.c.units,
+               value.label('value'),
+               func.sum(value).over(order_by=(value.desc(), Item.id)).label('cumulative'),
+               func.sum(value).over().label('total'))
+        .select_from(issued)
+        .join(Item, Item.id == issued.c.item_id)
+        .join(Category, Category.id == Item.category_id)
+        .outerjoin(costs, costs.c.item_id == issued.c.item_id)
+        .subquery('ranked')
+    )
+    ahead = case((ranked.c.total > 0, (ranked.c.cumulative - ranked.c.value) / ranked.c.total), else_=literal(1.0))
+    statement = (
+        select(ranked.c.code, ranked.c.name, ranked.c.category, ranked.c.units, ranked.c.value,
+               case((ranked.c.total > 0, ranked.c.cumulative / ranked.c.total)),
+               case((ahead < ABC_THRESHOLDS[0], 'A'), (ahead < ABC_THRESHOLDS[1], 'B'), else_='C'))
+        .order_by(ranked.c.value.desc(), ranked.c.id)
+    )
+    columns = ['code', 'name', 'category', 'issued_units', 'consumption_value', 'cumulative_share', 'class']
+    return columns, statement
+
+
+REPORTS = {'valuation': valuation, 'turnover': turnover, 'abc': abc}
+
+
+def build(kind, **params):
+    if kind not in REPORTS:
+        raise ReportError(f'Unknown report {kind!r}.')
+    try:
+        return REPORTS[kind](**params)
+    except (TypeError, ValueError):
+        raise ReportError(f'Invalid parameters for the {kind} report.')
+
+
+def _cell(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def iter_rows(kind, **params):
+    """Yield the header and then every row of a report, fetched in batches"""
+    columns, statement = build(kind, **params)
+    yield columns
+    result = db.session.execute(statement, execution_options={'yield_per': BATCH_SIZE})
+    for partition in result.partitions():
+        for row in partition:
+            yield [_cell(v) for v in row]
+
+
+def write_csv(kind, path, **params):
+    """Write a report to path (atomically, via a temporary file); returns the number of rows"""
+    tmp = f'{path}.part'
+    count = -1
+    with open(tmp, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        for row in iter_rows(kind, **params):
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+# --- BACKGROUND JOBS ---
+
+class ReportJobs:
+    """Run reports on a small thread pool and keep their CSV output for download.
+
+    Job state lives in the report_jobs table, so any worker process can
+    show progress and serve a finished file. REPORT_WORKERS = 0 runs jobs
+    inline, for tests and the CLI.
+
+    A job dies with its worker process, and gunicorn recycles workers, so
+    jobs left queued or running for longer than REPORT_JOB_TIMEOUT are
+    marked failed before jobs are listed. Reports too big to finish in
+    that time belong in `flask run-report`.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self.executor = None
+
+    def init_app(self, app):
+        self.app = app
+        app.config['REPORT_DIR'] = app.config.get('REPORT_DIR') or os.path.join(app.instance_path, 'reports')
+        self.directory = app.config['REPORT_DIR']
+        workers = app.config.setdefault('REPORT_WORKERS', 2)
+        app.config.setdefault('REPORT_JOB_TIMEOUT', 3600)
+        if workers:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report')
+        app.extensions['report_jobs'] = self
+
+    def submit(self, kind, params, user='System'):
+        """Queue a report; parameters are checked up front so bad requests fail immediately"""
+        build(kind, **params)
+        job = ReportJob(kind=kind, params=json.dumps(params), status='queued', requested_by=user)
+        db.session.add(job)
+        db.session.commit()
+        if self.executor:
+            self.executor.submit(self._run, job.id)
+        else:
+            self._run(job.id)
+        return job
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(ReportJob, job_id)
+            job.status, job.started_at = 'running', datetime.utcnow()
+            db.session.commit()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f'{job.kind}-{job.id}.csv')
+                rows = write_csv(job.kind, path, **json.loads(job.params))
+                job.status, job.rows, job.path = 'done', rows, path
+            except Exception as e:
+                logger.exception('Report job %s failed', job_id)
+                db.session.rollback()
+                job = db.session.get(ReportJob, job_id)
+                job.status, job.error = 'failed', str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    def fail_stale(self):
+        """Mark jobs whose worker went away without finishing them as failed"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self.app.config['REPORT_JOB_TIMEOUT'])
+        stale = (ReportJob.__table__.update()
+                 .where(ReportJob.status.in_(('queued', 'running')),
+                        func.coalesce(ReportJob.started_at, ReportJob.created_at) < cutoff)
+                 .values(status='failed', finished_at=now,
+                         error='Abandoned: the worker running it stopped; run large reports with flask run-report.'))
+        count = db.session.execute(stale).rowcount
+        if count:
+            db.session.commit()
+            logger.warning('Marked %d abandoned report job(s) as failed', count)
+        return count
+
+    def recent(self, limit=20):
+        self.fail_stale()
+        return ReportJob.query.order_by(ReportJob.id.desc()).limit(limit).all()
+
+
+report_jobs = ReportJobs()
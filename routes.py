@@ -1,22 +1,34 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, make_response, send_file, Response, stream_with_context
 from app import app, db
-from models import User, Item, Category, ActivityLog, IncomingItem, OutgoingItem
-from forms import LoginForm, RegistrationForm, ItemForm, CategoryForm, IncomingItemForm, OutgoingItemForm
+from models import User, Item, Category, ActivityLog, IncomingItem, OutgoingItem, ReportJob, Location, StockBalance, StockTransfer, DEFAULT_REORDER_LEVEL
+from forms import LoginForm, RegistrationForm, ItemForm, CategoryForm, IncomingItemForm, OutgoingItemForm, ImportForm, IncomingTransactionForm, OutgoingTransactionForm, ReportForm, TransferForm, LocationForm
 from flask_login import current_user, login_user, logout_user, login_required
-from sqlalchemy import or_, desc
-from datetime import datetime
+from sqlalchemy import desc, or_
+from sqlalchemy.orm import joinedload, load_only, with_expression
+import json
+import os
+from datetime import date, datetime, timedelta
+from werkzeug.datastructures import MultiDict
+from pagination import keyset_paginate
+from search import item_search
+import queries
+import stats
+import bulk
+import stock
+import ledger
+import lots
+import alerts
+import locations
+from reports import report_jobs, ReportError
+from activity import activity_writer
+from cache import cache, page_etag, not_modified, with_validators
+from rendering import Deferred, stream_page
+from archive import activity_archive, FILTERS as ARCHIVE_FILTERS
 
 def log_activity(action, table_name, record_id, details=None):
-    """Helper function to log activities"""
-    log = ActivityLog(
-        action=action,
-        table_name=table_name,
-        record_id=record_id,
-        details=details,
-        user=current_user.username if current_user.is_authenticated else 'System'
-    )
-    db.session.add(log)
-    db.session.commit()
+    """Stage an activity log entry; it is written by the caller's next commit"""
+    activity_writer.record(action, table_name, record_id, details,
+                           user=current_user.username if current_user.is_authenticated else 'System')
 
 # --- AUTHENTICATION ROUTES ---
 
@@ -30,6 +42,10 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password', 'danger')
             return redirect(url_for('login'))
+        # Upgrade the stored hash to the configured method while the password is at hand
+        if user.needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
         
         next_page = request.args.get('next')
@@ -62,52 +78,196 @@ def register():
 @app.route('/')
 @login_required
 def dashboard():
-    """Main dashboard with key statistics"""
-    total_items = Item.query.count()
-    total_categories = Category.query.count()
-    
-    from datetime import timedelta
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    total_incoming = IncomingItem.query.filter(IncomingItem.received_date >= thirty_days_ago).count()
-    total_outgoing = OutgoingItem.query.filter(OutgoingItem.issued_date >= thirty_days_ago).count()
+    """Main dashboard with key statistics, for all locations or ?location="""
+    location_filter, locations_list = location_arg()
+    summary = stats.dashboard_summary(days=30, location_id=location_filter)
+    if location_filter:
+        summary['items'] = locations.stocked_count(location_filter)
     
     recent_activities = ActivityLog.query.order_by(desc(ActivityLog.timestamp)).limit(10).all()
     
     return render_template('dashboard.html',
-                         total_items=total_items,
-                         total_categories=total_categories,
-                         total_incoming=total_incoming,
-                         total_outgoing=total_outgoing,
-                         recent_activities=recent_activities)
+                         total_items=summary['items'],
+                         total_categories=summary['categories'],
+                         total_incoming=summary['incoming'],
+                         total_outgoing=summary['outgoing'],
+                         recent_activities=recent_activities,
+                         low_stock=alerts.low_stock(limit=ALERT_LIMIT, location_id=location_filter),
+                         low_stock_count=alerts.low_stock_count(location_filter),
+                         expiring=alerts.expiring_batches(app.config['ALERT_EXPIRY_DAYS'], limit=ALERT_LIMIT,
+                                                          location_id=location_filter),
+                         expiry_days=app.config['ALERT_EXPIRY_DAYS'],
+                         locations=locations_list,
+                         location_filter=location_filter)
+
+ALERT_LIMIT = 10
+ALERT_MAX_LIMIT = 500
+
+@app.route('/alerts')
+@login_required
+def stock_alerts():
+    """Low-stock items and batches expiring within ?days= as JSON, for all locations or ?location="""
+    days = min(max(request.args.get('days', app.config['ALERT_EXPIRY_DAYS'], type=int), 0), 3650)
+    limit = min(max(request.args.get('limit', ALERT_MAX_LIMIT, type=int), 1), ALERT_MAX_LIMIT)
+    location_filter, _ = location_arg()
+    return jsonify({
+        'low_stock': [{
+            'item_id': alert.item_id,
+            'code': alert.item.code,
+            'name': alert.item.name,
+            'quantity': alert.quantity,
+            'reorder_level': alert.reorder_level,
+            'since': alert.since.isoformat(),
+        } for alert in alerts.low_stock(limit=limit, location_id=location_filter)],
+        'low_stock_count': alerts.low_stock_count(location_filter),
+        'expiring': alerts.expiring_batches(days, limit=limit, location_id=location_filter),
+        'expiry_days': days,
+        'location': location_filter,
+    })
+
+def location_arg():
+    """The ?location= id when it names a location (else None), and the location dropdown options"""
+    options = locations.options()
+    location_id = request.args.get('location', type=int)
+    if location_id not in {location['id'] for location in options}:
+        location_id = None
+    return location_id, options
+
+def location_codes(options):
+    """{id: code} of the location options, for labelling rows"""
+    return {location['id']: location['code'] for location in options}
+
+# Sort keys for the item listing; the trailing column keeps each ordering total
+ITEM_SORTS = {
+    'name': ('name', 'id'),
+    'code': ('code',),
+    'quantity': ('quantity', 'id'),
+    'updated_at': ('updated_at', 'id'),
+}
+ITEMS_PER_PAGE = 50
+ITEMS_MAX_PER_PAGE = 200
 
 @app.route('/items')
 @login_required
 def items():
-    """View all items with search and filter functionality"""
-    search = request.args.get('search', '')
+    """View items with search, filter, sorting and keyset pagination"""
+    search = request.args.get('search', '').strip()
     category_filter = request.args.get('category', '')
+    sort = request.args.get('sort', 'relevance' if search else 'name')
+    if sort not in ITEM_SORTS and not (sort == 'relevance' and search):
+        sort = 'name'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    per_page = min(max(request.args.get('per_page', ITEMS_PER_PAGE, type=int), 1), ITEMS_MAX_PER_PAGE)
+    
+    location_filter, locations_list = location_arg()
+    query = queries.item_listing()
+    rank = None
+    sort_columns = {key: getattr(Item, key) for key in ('name', 'code', 'quantity', 'updated_at', 'id')}
+    row_keys = {}
     
-    query = Item.query
+    if location_filter:
+        # Only the items held at the location, with its balance; quantity
+        # sorts and seeks on the location's (location_id, quantity, item_id) index
+        query = (query.join(StockBalance, (StockBalance.item_id == Item.id) & (StockBalance.location_id == location_filter))
+                 .options(with_expression(Item.location_quantity, StockBalance.quantity)))
+        sort_columns.update(quantity=StockBalance.quantity, id=StockBalance.item_id)
+        row_keys['quantity'] = 'location_quantity'
     
     if search:
-        query = query.filter(or_(
-            Item.code.contains(search),
-            Item.name.contains(search),
-            Item.description.contains(search)
-        ))
+        query, rank = item_search.apply(query, search)
     
     if category_filter:
         query = query.filter(Item.category_id == category_filter)
     
-    items_list = query.order_by(Item.name).all()
-    categories_list = Category.query.order_by(Category.name).all()
+    page_args = dict(after=request.args.get('after'),
+                     before=request.args.get('before'),
+                     per_page=per_page,
+                     descending=order == 'desc')
+    if sort == 'relevance' and rank is not None:
+        items_page = Deferred(lambda: _ranked_page(query, rank, **page_args))
+    else:
+        sort_keys = ITEM_SORTS.get(sort, ITEM_SORTS['name'])
+        items_page = Deferred(lambda: keyset_paginate(query, [sort_columns[k] for k in sort_keys],
+                                                      lambda i: [getattr(i, row_keys.get(k, k)) for k in sort_keys],
+                                                      **page_args))
+    categories_list = category_options()
     
-    return render_template('items.html',
-                         items=items_list,
+    # The page query runs while the header and filters are already on their way
+    return stream_page('items.html',
+                         items=items_page,
                          categories=categories_list,
+                         categories_version=cache.version('categories'),
+                         import_form=ImportForm(),
                          search=search,
-                         category_filter=category_filter)
+                         category_filter=category_filter,
+                         locations=locations_list,
+                         location_filter=location_filter,
+                         sort=sort,
+                         order=order,
+                         per_page=per_page,
+                         default_reorder_level=DEFAULT_REORDER_LEVEL)
+
+def _ranked_page(query, rank, **page_args):
+    """Keyset-paginate search results best match first; the item id breaks ties"""
+    page = keyset_paginate(query.add_columns(rank.label('rank')), [rank, Item.id],
+                           lambda row: [row.rank, row[0].id], **page_args)
+    page.items = [row[0] for row in page.items]
+    return page
+
+LOOKUP_LIMIT = 20
+LOOKUP_MAX_LIMIT = 100
+
+@app.route('/items/lookup')
+@login_required
+def item_lookup():
+    """Typeahead source for item pickers: code and name prefix matches as JSON"""
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', LOOKUP_LIMIT, type=int), 1), LOOKUP_MAX_LIMIT)
+    query = Item.query.options(load_only(Item.id, Item.code, Item.name, Item.quantity))
+    if request.args.get('in_stock'):
+        query = query.filter(Item.quantity > 0)
+    
+    page_args = dict(after=request.args.get('after'), per_page=limit)
+    rank = None
+    if q:
+        query, rank = item_search.apply(query, q)
+    if rank is not None:
+        page = _ranked_page(query, rank, **page_args)
+    else:
+        page = keyset_paginate(query, [Item.name, Item.id], lambda i: [i.name, i.id], **page_args)
+    return jsonify({
+        'results': [{
+            'id': item.id,
+            'code': item.code,
+            'name': item.name,
+            'quantity': item.quantity,
+            'label': f'{item.code} - {item.name} (Stock: {item.quantity})'
+        } for item in page.items],
+        'next_cursor': page.next_cursor
+    })
+
+@app.route('/items/<int:id>/stock')
+@login_required
+def item_stock(id):
+    """Quantity on hand now or, with ?as_of=YYYY-MM-DD[THH:MM[:SS]], at that moment, from the stock ledger"""
+    item = Item.query.options(load_only(Item.id, Item.code, Item.quantity)).get_or_404(id)
+    as_of = request.args.get('as_of', '').strip()
+    if not as_of:
+        return jsonify({'id': item.id, 'code': item.code, 'quantity': item.quantity, 'as_of': None})
+    try:
+        at = datetime.fromisoformat(as_of) if 'T' in as_of else date.fromisoformat(as_of)
+    except ValueError:
+        return jsonify({'errors': {'as_of': ['Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.']}}), 400
+    return jsonify({'id': item.id, 'code': item.code, 'quantity': ledger.quantity_as_of(id, at), 'as_of': as_of})
+
+@app.route('/items/<int:id>/lots')
+@login_required
+def item_lots(id):
+    """Quantity on hand broken down by lot, in the order issues will draw on them; at one ?location="""
+    balance = lots.balances(id, request.args.get('location', type=int))
+    if balance is None:
+        abort(404)
+    return jsonify(balance)
 
 @app.route('/items/add', methods=['POST'])
 @login_required
@@ -125,13 +285,15 @@ def add_item():
                 name=form.name.data,
                 description=form.description.data,
                 quantity=form.quantity.data,
+                reorder_level=form.reorder_level.data if form.reorder_level.data is not None else DEFAULT_REORDER_LEVEL,
                 unit_price=form.unit_price.data,
                 supplier=form.supplier.data,
                 category_id=form.category_id.data
             )
             db.session.add(item)
-            db.session.commit()
+            db.session.flush()
             log_activity('CREATE', 'items', item.id, f'Added new item: {item.name}')
+            db.session.commit()
             flash('Item added successfully!', 'success')
     else:
         flash('There was an error with your submission.', 'danger')
@@ -149,18 +311,26 @@ def edit_item(id):
         if existing_item:
             flash('Item code already exists. Please use a different code.', 'error')
         else:
-            old_values = f"Code: {item.code}, Name: {item.name}, Quantity: {item.quantity}"
-            item.code = form.code.data
-            item.name = form.name.data
-            item.description = form.description.data
-            item.quantity = form.quantity.data
-            item.unit_price = form.unit_price.data
-            item.supplier = form.supplier.data
-            item.category_id = form.category_id.data
-            item.updated_at = datetime.utcnow()
-            db.session.commit()
-            log_activity('UPDATE', 'items', item.id, f'Updated item from ({old_values}) to ({item.code}, {item.name}, {item.quantity})')
-            flash('Item updated successfully!', 'success')
+            def edit():
+                old_values = f"Code: {item.code}, Name: {item.name}, Quantity: {item.quantity}"
+                item.code = form.code.data
+                item.name = form.name.data
+                item.description = form.description.data
+                if form.reorder_level.data is not None:
+                    item.reorder_level = form.reorder_level.data
+                item.unit_price = form.unit_price.data
+                item.supplier = form.supplier.data
+                item.category_id = form.category_id.data
+                item.updated_at = datetime.utcnow()
+                # A changed quantity is a stocktake at the chosen location, not an untracked overwrite
+                stock.adjust_stock(item.id, form.quantity.data, form.location_id.data)
+                log_activity('UPDATE', 'items', item.id, f'Updated item from ({old_values}) to ({item.code}, {item.name}, {form.quantity.data})')
+            try:
+                stock.run_in_transaction(edit)
+            except stock.StockError as e:
+                flash(str(e), 'error')
+            else:
+                flash('Item updated successfully!', 'success')
     else:
         flash('There was an error with your submission.', 'danger')
     return redirect(url_for('items'))
@@ -173,17 +343,80 @@ def delete_item(id):
     item_details = f"Code: {item.code}, Name: {item.name}"
     
     db.session.delete(item)
-    db.session.commit()
     log_activity('DELETE', 'items', id, f'Deleted item: {item_details}')
+    db.session.commit()
     flash('Item deleted successfully!', 'success')
     return redirect(url_for('items'))
 
+@app.route('/items/import', methods=['POST'])
+@login_required
+def import_data():
+    """Bulk import items or incoming stock from a CSV/XLSX upload"""
+    form = ImportForm()
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if not form.validate_on_submit():
+        if wants_json:
+            return jsonify({'errors': form.errors}), 400
+        flash('There was an error with your submission.', 'danger')
+        return redirect(url_for('items'))
+    
+    upload = form.file.data
+    try:
+        report = bulk.IMPORTERS[form.kind.data](bulk.read_rows(upload.stream, upload.filename),
+                                                user=current_user.username)
+    except bulk.BulkError as e:
+        if wants_json:
+            return jsonify({'errors': {'file': [str(e)]}}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('items'))
+    
+    if wants_json:
+        return jsonify(report.to_dict())
+    flash(f'Imported {report.rows - report.rejected} of {report.rows} rows '
+          f'({report.created} created, {report.updated} updated).',
+          'warning' if report.rejected else 'success')
+    for error in report.errors[:10]:
+        messages = '; '.join(f"{field}: {' '.join(msgs)}" for field, msgs in error['errors'].items())
+        flash(f"Row {error['row']}: {messages}", 'warning')
+    if report.rejected > 10:
+        flash(f'...and {report.rejected - 10} more rejected rows.', 'warning')
+    return redirect(url_for('items'))
+
+@app.route('/items/export')
+@login_required
+def export_data():
+    """Stream items or stock movements as CSV"""
+    kind = request.args.get('kind', 'items')
+    if kind not in bulk.EXPORTS:
+        abort(404)
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.csv"
+    return Response(stream_with_context(bulk.iter_csv(kind)),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 @app.route('/categories')
 @login_required
 def categories():
     """View all categories"""
-    categories_list = Category.query.order_by(Category.name).all()
-    return render_template('categories.html', categories=categories_list)
+    etag = page_etag('categories', cache.version('categories'), current_user.id)
+    last_modified = cache.last_modified('categories')
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    categories_list = cache.get_or_set('categories', 'categories_with_counts', lambda: [
+        {'id': c.id, 'name': c.name, 'description': c.description,
+         'created_at': c.created_at, 'item_count': c.item_count}
+        for c in queries.categories_with_counts()
+    ])
+    response = make_response(render_template('categories.html', categories=categories_list))
+    return with_validators(response, etag, last_modified)
+
+def category_options():
+    """Category (id, name) pairs for filter and form dropdowns, cached until a category changes"""
+    return cache.get_or_set('categories', 'category_options', lambda: [
+        {'id': id, 'name': name}
+        for id, name in db.session.query(Category.id, Category.name).order_by(Category.name)
+    ])
 
 @app.route('/categories/add', methods=['POST'])
 @login_required
@@ -200,16 +433,17 @@ def add_category():
                 description=form.description.data
             )
             db.session.add(category)
-            db.session.commit()
+            db.session.flush()
             log_activity('CREATE', 'categories', category.id, f'Added new category: {category.name}')
+            db.session.commit()
             flash('Category added successfully!', 'success')
     return redirect(url_for('categories'))
 
 @app.route('/categories/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_category(id):
-    category = Category.query.get_or_404(id)
     if request.method == 'POST':
+        category = Category.query.get_or_404(id)
         form = CategoryForm()
         if form.validate_on_submit():
             existing_category = Category.query.filter(Category.name == form.name.data, Category.id != id).first()
@@ -220,16 +454,26 @@ def edit_category(id):
             old_name = category.name
             category.name = form.name.data
             category.description = form.description.data
-            db.session.commit()
             log_activity('UPDATE', 'categories', category.id, f'Updated category from "{old_name}" to "{category.name}"')
+            db.session.commit()
             flash('Category updated successfully!', 'success')
             return redirect(url_for('categories'))
-    # For GET request, return data as JSON to populate modal via JS
-    return jsonify({
+    # For GET request, return data as JSON to populate modal via JS;
+    # served from the cache (or as a 304) until a category changes
+    etag = page_etag('category', id, cache.version('categories'))
+    last_modified = cache.last_modified('categories')
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    data = cache.get_or_set('categories', f'category:{id}', lambda: _category_json(Category.query.get_or_404(id)))
+    return with_validators(jsonify(data), etag, last_modified)
+
+def _category_json(category):
+    return {
         'id': category.id,
         'name': category.name,
         'description': category.description or ''
-    })
+    }
 
 
 @app.route('/categories/delete/<int:id>', methods=['POST'])
@@ -237,40 +481,80 @@ def edit_category(id):
 def delete_category(id):
     """Delete category"""
     category = Category.query.get_or_404(id)
-    if category.items:
+    if queries.category_has_items(id):
         flash(f'Cannot delete category "{category.name}" because it has items associated with it.', 'error')
     else:
         category_name = category.name
         db.session.delete(category)
-        db.session.commit()
         log_activity('DELETE', 'categories', id, f'Deleted category: {category_name}')
+        db.session.commit()
         flash('Category deleted successfully!', 'success')
     return redirect(url_for('categories'))
 
+ACTIVITY_PER_PAGE = 50
+ACTIVITY_ACTIONS = ['CREATE', 'UPDATE', 'DELETE', 'IMPORT']
+ACTIVITY_TABLES = ['items', 'categories', 'incoming_items', 'outgoing_items']
+
+def _activity_filters():
+    """Filters from the query string, record_id as an int; unparseable values are dropped"""
+    filters = {}
+    for name in ARCHIVE_FILTERS:
+        value = request.args.get(name, '').strip()
+        if not value:
+            continue
+        if name == 'record_id':
+            if not value.isdigit():
+                continue
+            value = int(value)
+        filters[name] = value
+    return filters
+
 @app.route('/activity-log')
 @login_required
 def activity_log():
-    """View activity log"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
-    activities = ActivityLog.query.order_by(desc(ActivityLog.timestamp)).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    return render_template('activity_log.html', activities=activities)
+    """View activity log, live or from a monthly archive, with filters and keyset pagination"""
+    filters = _activity_filters()
+    month = request.args.get('archive', '')
+    months = activity_archive.months()
+    if month and month in months:
+        start = request.args.get('start', 0, type=int)
+        activities = activity_archive.search(month, filters, start=max(start, 0), per_page=ACTIVITY_PER_PAGE)
+    else:
+        month = ''
+        activities = keyset_paginate(ActivityLog.query.filter_by(**filters),
+                                     [ActivityLog.timestamp, ActivityLog.id],
+                                     lambda a: [a.timestamp, a.id],
+                                     after=request.args.get('after'),
+                                     before=request.args.get('before'),
+                                     per_page=ACTIVITY_PER_PAGE,
+                                     descending=True)
+    return render_template('activity_log.html',
+                           activities=activities,
+                           filters=filters,
+                           archive=month,
+                           archive_months=months,
+                           actions=ACTIVITY_ACTIONS,
+                           tables=ACTIVITY_TABLES)
 
 @app.route('/incoming-items')
 @login_required
 def incoming_items():
-    """View all incoming items"""
+    """View all incoming items, or those received at ?location="""
     page = request.args.get('page', 1, type=int)
     per_page = 20
-    incoming = IncomingItem.query.order_by(desc(IncomingItem.received_date)).paginate(
+    location_filter, locations_list = location_arg()
+    query = queries.incoming_history()
+    if location_filter:
+        query = query.filter(IncomingItem.location_id == location_filter)
+    incoming = Deferred(lambda: query.paginate(
         page=page, per_page=per_page, error_out=False
-    )
+    ))
     form = IncomingItemForm()
     # Populate received_by with current user's username
     form.received_by.data = current_user.username
-    return render_template('incoming_items.html', incoming=incoming, form=form)
+    return stream_page('incoming_items.html', incoming=incoming, form=form, batch_form=IncomingTransactionForm(),
+                       locations=locations_list, location_names=location_codes(locations_list),
+                       location_filter=location_filter)
 
 @app.route('/incoming-items/add', methods=['POST'])
 @login_required
@@ -278,24 +562,27 @@ def add_incoming_item():
     """Add new incoming item"""
     form = IncomingItemForm()
     if form.validate_on_submit():
-        item = Item.query.get(form.item_id.data)
-        incoming = IncomingItem(
-            item_id=form.item_id.data,
-            quantity=form.quantity.data,
-            unit_price=form.unit_price.data,
-            supplier=form.supplier.data,
-            batch_number=form.batch_number.data,
-            expiry_date=form.expiry_date.data,
-            notes=form.notes.data,
-            received_by=form.received_by.data
-        )
-        item.quantity += form.quantity.data
-        item.updated_at = datetime.utcnow()
-        db.session.add(incoming)
-        db.session.commit()
-        log_activity('CREATE', 'incoming_items', incoming.id, 
-                    f'Received {form.quantity.data} units of {item.name}')
-        flash(f'Successfully recorded incoming {form.quantity.data} units of {item.name}!', 'success')
+        def receive():
+            incoming = stock.receive_stock(
+                form.item_id.data,
+                form.quantity.data,
+                unit_price=form.unit_price.data,
+                supplier=form.supplier.data,
+                batch_number=form.batch_number.data,
+                expiry_date=form.expiry_date.data,
+                notes=form.notes.data,
+                received_by=form.received_by.data,
+                location_id=form.location_id.data
+            )
+            log_activity('CREATE', 'incoming_items', incoming.id, 
+                        f'Received {form.quantity.data} units of {incoming.item.name}')
+            return incoming.item.name
+        try:
+            item_name = stock.run_in_transaction(receive)
+        except stock.StockError as e:
+            flash(str(e), 'error')
+        else:
+            flash(f'Successfully recorded incoming {form.quantity.data} units of {item_name}!', 'success')
     else:
         flash('There was an error with your submission.', 'danger')
     return redirect(url_for('incoming_items'))
@@ -303,16 +590,22 @@ def add_incoming_item():
 @app.route('/outgoing-items')
 @login_required
 def outgoing_items():
-    """View all outgoing items"""
+    """View all outgoing items, or those issued at ?location="""
     page = request.args.get('page', 1, type=int)
     per_page = 20
-    outgoing = OutgoingItem.query.order_by(desc(OutgoingItem.issued_date)).paginate(
+    location_filter, locations_list = location_arg()
+    query = queries.outgoing_history()
+    if location_filter:
+        query = query.filter(OutgoingItem.location_id == location_filter)
+    outgoing = Deferred(lambda: query.paginate(
         page=page, per_page=per_page, error_out=False
-    )
+    ))
     form = OutgoingItemForm()
     # Populate issued_by with current user's username
     form.issued_by.data = current_user.username
-    return render_template('outgoing_items.html', outgoing=outgoing, form=form)
+    return stream_page('outgoing_items.html', outgoing=outgoing, form=form, batch_form=OutgoingTransactionForm(),
+                       locations=locations_list, location_names=location_codes(locations_list),
+                       location_filter=location_filter)
 
 @app.route('/outgoing-items/add', methods=['POST'])
 @login_required
@@ -320,26 +613,238 @@ def add_outgoing_item():
     """Add new outgoing item"""
     form = OutgoingItemForm()
     if form.validate_on_submit():
-        item = Item.query.get(form.item_id.data)
-        if item.quantity < form.quantity.data:
-            flash(f'Insufficient stock! Available: {item.quantity}, Requested: {form.quantity.data}', 'error')
-        else:
-            outgoing = OutgoingItem(
-                item_id=form.item_id.data,
-                quantity=form.quantity.data,
+        def issue():
+            outgoing = stock.issue_stock(
+                form.item_id.data,
+                form.quantity.data,
                 destination=form.destination.data,
                 purpose=form.purpose.data,
                 request_number=form.request_number.data,
                 notes=form.notes.data,
-                issued_by=form.issued_by.data
+                issued_by=form.issued_by.data,
+                location_id=form.location_id.data
             )
-            item.quantity -= form.quantity.data
-            item.updated_at = datetime.utcnow()
-            db.session.add(outgoing)
-            db.session.commit()
             log_activity('CREATE', 'outgoing_items', outgoing.id,
-                        f'Issued {form.quantity.data} units of {item.name} to {form.destination.data}')
-            flash(f'Successfully recorded outgoing {form.quantity.data} units of {item.name}!', 'success')
+                        f'Issued {form.quantity.data} units of {outgoing.item.name} to {form.destination.data}')
+            return outgoing.item.name
+        try:
+            item_name = stock.run_in_transaction(issue)
+        except stock.StockError as e:
+            flash(str(e), 'error')
+        else:
+            flash(f'Successfully recorded outgoing {form.quantity.data} units of {item_name}!', 'success')
     else:
         flash('There was an error with your submission.', 'danger')
-    return redirect(url_for('outgoing_items'))
\ No newline at end of file
+    return redirect(url_for('outgoing_items'))
+
+
+# --- LOCATIONS AND TRANSFERS ---
+
+TRANSFERS_PER_PAGE = 20
+
+@app.route('/transfers')
+@login_required
+def transfers():
+    """Stock transfers between locations, newest first; ?location= keeps those into or out of one"""
+    page = request.args.get('page', 1, type=int)
+    location_filter, locations_list = location_arg()
+    query = StockTransfer.query.options(joinedload(StockTransfer.item).load_only(Item.code, Item.name))
+    if location_filter:
+        # Each side is a range of its own (location, transferred_date) index
+        query = query.filter(or_(StockTransfer.from_location_id == location_filter,
+                                 StockTransfer.to_location_id == location_filter))
+    history = query.order_by(desc(StockTransfer.transferred_date), desc(StockTransfer.id)).paginate(
+        page=page, per_page=TRANSFERS_PER_PAGE, error_out=False
+    )
+    form = TransferForm()
+    form.transferred_by.data = current_user.username
+    return render_template('transfers.html',
+                         transfers=history,
+                         form=form,
+                         location_form=LocationForm(),
+                         locations=locations_list,
+                         location_names=location_codes(locations_list),
+                         location_filter=location_filter,
+                         location_summary=locations.summary())
+
+@app.route('/transfers/add', methods=['POST'])
+@login_required
+def add_transfer():
+    """Move stock of an item from one location to another"""
+    form = TransferForm()
+    if form.validate_on_submit():
+        item, source, target = form.item_id.obj, form.from_location_id.obj, form.to_location_id.obj
+        def transfer():
+            record = stock.transfer_stock(
+                item.id,
+                form.quantity.data,
+                source.id,
+                target.id,
+                notes=form.notes.data,
+                transferred_by=form.transferred_by.data
+            )
+            log_activity('CREATE', 'stock_transfers', record.id,
+                        f'Transferred {form.quantity.data} units of {item.name} from {source.code} to {target.code}')
+        try:
+            stock.run_in_transaction(transfer)
+        except stock.StockError as e:
+            flash(str(e), 'error')
+        else:
+            flash(f'Successfully transferred {form.quantity.data} units of {item.name} to {target.code}!', 'success')
+    else:
+        flash('There was an error with your submission.', 'danger')
+    return redirect(url_for('transfers'))
+
+@app.route('/locations/add', methods=['POST'])
+@login_required
+def add_location():
+    """Add a new stock location"""
+    form = LocationForm()
+    if form.validate_on_submit():
+        if Location.query.filter_by(code=form.code.data).first():
+            flash('Location code already exists. Please use a different code.', 'error')
+        else:
+            location = Location(
+                code=form.code.data,
+                name=form.name.data,
+                description=form.description.data
+            )
+            db.session.add(location)
+            db.session.flush()
+            log_activity('CREATE', 'locations', location.id, f'Added new location: {location.code}')
+            db.session.commit()
+            flash('Location added successfully!', 'success')
+    else:
+        flash('There was an error with your submission.', 'danger')
+    return redirect(url_for('transfers'))
+
+# --- MULTI-LINE STOCK TRANSACTIONS ---
+
+TRANSACTION_FORMS = {'incoming': IncomingTransactionForm, 'outgoing': OutgoingTransactionForm}
+
+def _transaction_formdata(payload):
+    """Flatten a JSON transaction into the field names the transaction forms expect"""
+    formdata = MultiDict()
+    for key, value in payload.items():
+        if key not in ('type', 'lines') and value is not None:
+            formdata[key] = str(value)
+    for index, line in enumerate(payload.get('lines') or []):
+        for key, value in (line or {}).items():
+            if value is not None:
+                formdata[f'lines-{index}-{key}'] = str(value)
+    return formdata
+
+def _record_transaction(kind, form):
+    """Apply a validated transaction form atomically; returns the new row ids"""
+    header = {name: field.data for name, field in form._fields.items()
+              if name not in ('lines', 'submit', 'csrf_token')}
+    lines = [line.data for line in form.lines]
+    units = sum(line['quantity'] for line in lines)
+    
+    def record():
+        if kind == 'incoming':
+            ids = stock.receive_lines(lines, **header)
+            details = f'Received {units} units over {len(lines)} lines'
+        else:
+            ids = stock.issue_lines(lines, **header)
+            details = f'Issued {units} units over {len(lines)} lines to {header["destination"]}'
+        log_activity('CREATE', f'{kind}_items', ids[0], details)
+        return ids
+    return stock.run_in_transaction(record)
+
+def _stock_error_message(error):
+    if isinstance(error, stock.InsufficientStock):
+        return f'{error.item.code} - {error.item.name}: {error}'
+    return str(error)
+
+@app.route('/stock/transactions', methods=['POST'])
+@login_required
+def stock_transaction():
+    """Record a multi-line incoming or outgoing transaction posted as JSON"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or payload.get('type') not in TRANSACTION_FORMS:
+        return jsonify({'errors': {'type': ['Expected a JSON object with type "incoming" or "outgoing".']}}), 400
+    kind = payload['type']
+    # JSON bodies cannot be sent cross-site without a CORS preflight, so the
+    # form's CSRF token is not required here
+    form = TRANSACTION_FORMS[kind](formdata=_transaction_formdata(payload), meta={'csrf': False})
+    if not form.validate():
+        return jsonify({'errors': form.errors}), 400
+    try:
+        ids = _record_transaction(kind, form)
+    except stock.ItemNotFound as e:
+        return jsonify({'errors': {'lines': [str(e)]}}), 400
+    except stock.StockError as e:
+        return jsonify({'errors': {'lines': [_stock_error_message(e)]}}), 409
+    return jsonify({'type': kind, 'ids': ids, 'lines': len(ids)}), 201
+
+@app.route('/incoming-items/batch', methods=['POST'])
+@login_required
+def add_incoming_batch():
+    """Record several incoming lines from the form in one transaction"""
+    return _record_transaction_form('incoming', 'incoming_items')
+
+@app.route('/outgoing-items/batch', methods=['POST'])
+@login_required
+def add_outgoing_batch():
+    """Record several outgoing lines from the form in one transaction"""
+    return _record_transaction_form('outgoing', 'outgoing_items')
+
+def _record_transaction_form(kind, redirect_endpoint):
+    form = TRANSACTION_FORMS[kind]()
+    if form.validate_on_submit():
+        try:
+            ids = _record_transaction(kind, form)
+        except stock.StockError as e:
+            flash(_stock_error_message(e), 'error')
+        else:
+            flash(f'Successfully recorded {len(ids)} {kind} lines!', 'success')
+    else:
+        flash('There was an error with your submission.', 'danger')
+    return redirect(url_for(redirect_endpoint))
+
+# --- REPORTS ---
+
+@app.route('/reports', methods=['GET', 'POST'])
+@login_required
+def reports():
+    """Request valuation, turnover and ABC reports and download finished ones"""
+    form = ReportForm()
+    if request.method == 'GET' and not form.month.data:
+        form.month.data = (datetime.utcnow().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    if form.validate_on_submit():
+        params = {'month': form.month.data}
+        if form.kind.data == 'abc':
+            params['months'] = form.months.data or 12
+        try:
+            job = report_jobs.submit(form.kind.data, params, user=current_user.username)
+            flash(f'Report #{job.id} queued. It will be ready for download below.', 'success')
+        except ReportError as e:
+            flash(str(e), 'error')
+        return redirect(url_for('reports'))
+    return render_template('reports.html', form=form, jobs=report_jobs.recent())
+
+@app.route('/reports/<int:id>')
+@login_required
+def report_status(id):
+    """Status of a report job as JSON"""
+    job = ReportJob.query.get_or_404(id)
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'rows': job.rows,
+        'error': job.error,
+        'download_url': url_for('report_download', id=job.id) if job.status == 'done' else None
+    })
+
+@app.route('/reports/<int:id>/download')
+@login_required
+def report_download(id):
+    """Download the CSV of a finished report"""
+    job = ReportJob.query.get_or_404(id)
+    if job.status != 'done' or not job.path or not os.path.exists(job.path):
+        abort(404)
+    params = json.loads(job.params)
+    return send_file(job.path, mimetype='text/csv', as_attachment=True,
+                     download_name=f"{job.kind}-{params.get('month', job.id)}.csv")
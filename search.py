@@ -0,0 +1,113 @@
+import re
+from sqlalchemy import case, func, literal, literal_column, or_, select, text
+from app import db
+from models import Item
+
+FTS_TABLE = 'items_fts'
+# Column weights for ranking: code matches outrank name matches, which outrank description
+CODE_WEIGHT, NAME_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 5.0, 1.0
+# Rank given to an exact item code hit so it always sorts first (lower rank is better)
+EXACT_CODE_RANK = -1e9
+
+# The indexed expression created by migration 0002; queries must repeat it exactly to use the index
+_POSTGRES_DOCUMENT = "to_tsvector('simple', coalesce(code, '') || ' ' || coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+_TOKEN_RE = re.compile(r"[\w\-.]+", re.UNICODE)
+
+
+def tokenize(term):
+    """Split a user search string into index tokens"""
+    return [t.lower() for t in _TOKEN_RE.findall(term or '')]
+
+
+class ItemSearch:
+    """Ranked item search backed by the database's native full-text index.
+
+    SQLite uses an external-content FTS5 table kept in sync by triggers;
+    PostgreSQL uses an expression tsvector GIN index plus trigram indexes.
+    Any other backend falls back to LIKE scans.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.dialect = None
+        self._available = None
+
+    def init_app(self, app):
+        """Bind to the app's engine; the index itself is created by a migration"""
+        with app.app_context():
+            self.engine = db.engine
+            self.dialect = self.engine.dialect.name
+        app.extensions['item_search'] = self
+
+    @property
+    def available(self):
+        """Whether the full-text index exists, looked up once per process on first use"""
+        if self._available is None:
+            query = {
+                'sqlite': "SELECT 1 FROM sqlite_master WHERE name = :name",
+                'postgresql': "SELECT 1 FROM pg_indexes WHERE indexname = :name",
+            }.get(self.dialect)
+            name = FTS_TABLE if self.dialect == 'sqlite' else 'ix_items_search_tsv'
+            self._available = False
+            if query:
+                with self.engine.connect() as conn:
+                    self._available = conn.execute(text(query), {'name': name}).first() is not None
+        return self._available
+
+    def rebuild(self):
+        """Rebuild the full-text index from the items table"""
+        if self.dialect == 'sqlite':
+            with self.engine.begin() as conn:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+        elif self.dialect == 'postgresql':
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                for index in ('ix_items_search_tsv', 'ix_items_name_trgm', 'ix_items_code_trgm'):
+                    conn.execute(text(f"REINDEX INDEX {index}"))
+
+    def ranked(self, term):
+        """Return a subquery of (id, rank) for items matching term, best match lowest"""
+        tokens = tokenize(term)
+        if not tokens:
+            return None
+        if self.available and self.dialect == 'sqlite':
+            match = ' '.join('"%s"*' % t.replace('"', '""') for t in tokens)
+            return (
+                select(
+                    literal_column('rowid').label('id'),
+                    func.bm25(literal_column(FTS_TABLE), CODE_WEIGHT, NAME_WEIGHT, DESCRIPTION_WEIGHT).label('rank'),
+                )
+                .select_from(text(FTS_TABLE))
+                .where(text(f"{FTS_TABLE} MATCH :match").bindparams(match=match))
+                .subquery('search')
+            )
+        if self.available and self.dialect == 'postgresql':
+            document = literal_column(_POSTGRES_DOCUMENT)
+            tsquery = func.to_tsquery('simple', ' & '.join('%s:*' % re.sub(r"[^\w\-.]", '', t) for t in tokens))
+            return (
+                select(Item.id.label('id'), (-func.ts_rank_cd(document, tsquery)).label('rank'))
+                .where(or_(document.op('@@')(tsquery), Item.code.ilike(term.strip() + '%')))
+                .subquery('search')
+            )
+        return (
+            select(Item.id.label('id'), literal(0.0).label('rank'))
+            .where(or_(Item.code.contains(term), Item.name.contains(term), Item.description.contains(term)))
+            .subquery('search')
+        )
+
+    def apply(self, query, term):
+        """Restrict an Item query to matches of term.
+
+        Returns the filtered query and a rank expression (lower is better)
+        that callers may order by; exact item code hits always rank first.
+        """
+        ranked = self.ranked(term)
+        if ranked is None:
+            return query, None
+        query = query.join(ranked, ranked.c.id == Item.id)
+        rank = case((Item.code == term.strip(), literal(EXACT_CODE_RANK)), else_=ranked.c.rank)
+        return query, rank
+
+
+item_search = ItemSearch()
@@ -7,6 +7,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize stock status checking
     updateStockStatus();
+    
+    // Initialize typeahead item pickers
+    initItemPickers(document);
 });
 
 // Sidebar functionality
@@ -69,4 +72,87 @@ function updateStockStatus() {
         
         checkStock();
     });
+}
+
+// Multi-line transaction forms: rows are named lines-<n>-<field>
+function renumberLines(tbody) {
+    tbody.querySelectorAll('tr.line-row').forEach((row, index) => {
+        row.querySelectorAll('[name]').forEach(input => {
+            input.name = input.name.replace(/^lines-\d+-/, 'lines-' + index + '-');
+        });
+    });
+}
+
+function addLine(tableId) {
+    const tbody = document.querySelector('#' + tableId + ' tbody');
+    const row = tbody.querySelector('tr.line-row').cloneNode(true);
+    row.querySelectorAll('input, select').forEach(input => { input.value = ''; });
+    row.querySelectorAll('datalist').forEach(list => list.remove());
+    row.querySelectorAll('input.item-picker').forEach(input => {
+        delete input.dataset.pickerReady;
+        input.removeAttribute('list');
+    });
+    tbody.appendChild(row);
+    renumberLines(tbody);
+    initItemPickers(row);
+}
+
+function removeLine(button) {
+    const tbody = button.closest('tbody');
+    if (tbody.querySelectorAll('tr.line-row').length > 1) {
+        button.closest('tr').remove();
+        renumberLines(tbody);
+    }
+}
+
+function resetLines(tableId) {
+    const rows = document.querySelectorAll('#' + tableId + ' tbody tr.line-row');
+    rows.forEach((row, index) => { if (index > 0) row.remove(); });
+}
+
+// Typeahead item pickers: a text input backed by /items/lookup that fills
+// the hidden item id input next to it
+function initItemPickers(root) {
+    root.querySelectorAll('input.item-picker').forEach(attachItemPicker);
+}
+
+function attachItemPicker(input) {
+    if (input.dataset.pickerReady) {
+        return;
+    }
+    input.dataset.pickerReady = '1';
+    const hidden = input.parentElement.querySelector('input.item-picker-id');
+    const list = document.createElement('datalist');
+    list.id = 'item-picker-' + Math.random().toString(36).slice(2);
+    input.setAttribute('list', list.id);
+    input.after(list);
+    
+    const ids = new Map();
+    let timer = null;
+    input.addEventListener('input', function() {
+        hidden.value = ids.get(input.value) || '';
+        clearTimeout(timer);
+        if (hidden.value || input.value.trim().length < 1) {
+            return;
+        }
+        timer = setTimeout(function() {
+            const url = new URL(input.dataset.lookupUrl, window.location.origin);
+            url.searchParams.set('q', input.value.trim());
+            if (input.dataset.inStock) {
+                url.searchParams.set('in_stock', '1');
+            }
+            fetch(url, { headers: { 'Accept': 'application/json' } })
+                .then(response => response.json())
+                .then(data => {
+                    list.innerHTML = '';
+                    data.results.forEach(item => {
+                        ids.set(item.label, item.id);
+                        const option = document.createElement('option');
+                        option.value = item.label;
+                        list.appendChild(option);
+                    });
+                    hidden.value = ids.get(input.value) || '';
+                });
+        }, 200);
+    });
 }
\ No newline at end of file
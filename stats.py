@@ -0,0 +1,132 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from app import db
+from models import Item, Category, IncomingItem, OutgoingItem, DashboardStat, DailyStat, StockBalance
+
+# Running totals keyed by model, and the date column that buckets daily movements
+COUNTERS = {Item: 'items', Category: 'categories'}
+DAILY = {IncomingItem: ('incoming', 'received_date'), OutgoingItem: ('outgoing', 'issued_date')}
+
+
+def scoped(metric, location_id):
+    """A daily metric or counter key covering one location only, e.g. 'incoming@3' or 'stocked@3'"""
+    return f'{metric}@{location_id}'
+
+
+def _upsert(connection, table, keys, column, delta, values=None):
+    """Add delta to table.column for the row identified by keys, creating it if needed.
+
+    values are other columns set only when the row is created.
+    """
+    values = values or {}
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**keys, **values, **{column: delta})
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys),
+                                          set_={column: table.c[column] + stmt.excluded[column]})
+        connection.execute(stmt)
+        return
+    where = [table.c[k] == v for k, v in keys.items()]
+    result = connection.execute(table.update().where(*where).values({column: table.c[column] + delta}))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**keys, **values, **{column: delta}))
+
+
+def _collect(session):
+    counters, daily = Counter(), Counter()
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            model = type(obj)
+            if model in COUNTERS:
+                counters[COUNTERS[model]] += sign
+            elif model in DAILY:
+                metric, column = DAILY[model]
+                when = getattr(obj, column) or datetime.utcnow()
+                daily[(when.date(), metric)] += sign
+                if obj.location_id:
+                    daily[(when.date(), scoped(metric, obj.location_id))] += sign
+    return counters, daily
+
+
+def apply_deltas(connection, counters=None, daily=None):
+    """Add counter deltas ({key: n}) and daily deltas ({(day, metric): n}) on connection.
+
+    The ORM path calls this from after_flush; bulk Core writes that bypass
+    the session call it directly inside their own transaction.
+    """
+    for key, delta in (counters or {}).items():
+        if delta:
+            _upsert(connection, DashboardStat.__table__, {'key': key}, 'value', delta)
+    for (day, metric), delta in (daily or {}).items():
+        if delta:
+            _upsert(connection, DailyStat.__table__, {'day': day, 'metric': metric}, 'count', delta)
+
+
+def _after_flush(session, flush_context):
+    counters, daily = _collect(session)
+    if counters or daily:
+        apply_deltas(session.connection(), counters, daily)
+
+
+def dashboard_summary(days=30, location_id=None):
+    """Totals and movement counts over the last days, read from the summary store.
+
+    With location_id the movement counts are that location's own buckets;
+    the caller replaces the item count with the location's.
+    """
+    counters = dict(db.session.query(DashboardStat.key, DashboardStat.value)
+                    .filter(DashboardStat.key.in_(list(COUNTERS.values()))).all())
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    metrics = {metric if location_id is None else scoped(metric, location_id): metric
+               for metric, _ in DAILY.values()}
+    movements = dict(db.session.query(DailyStat.metric, func.sum(DailyStat.count))
+                     .filter(DailyStat.day >= since, DailyStat.metric.in_(list(metrics)))
+                     .group_by(DailyStat.metric).all())
+    summary = {key: counters.get(key, 0) for key in COUNTERS.values()}
+    summary.update({metric: movements.get(key, 0) or 0 for key, metric in metrics.items()})
+    return summary
+
+
+def reconcile():
+    """Rebuild the summary store from the base tables.
+
+    Needed after writes that bypass the ORM session (bulk Core inserts,
+    manual SQL) and to seed the store for an existing database.
+    """
+    db.session.query(DashboardStat).delete()
+    db.session.query(DailyStat).delete()
+    rows = [{'key': key, 'value': db.session.query(func.count()).select_from(model).scalar()}
+            for model, key in COUNTERS.items()]
+    # Each location's stocked items, kept by locations.py
+    rows += [{'key': scoped('stocked', location_id), 'value': count}
+             for location_id, count in db.session.query(StockBalance.location_id, func.count())
+             .filter(StockBalance.quantity > 0).group_by(StockBalance.location_id)]
+    db.session.execute(DashboardStat.__table__.insert(), rows)
+    for model, (metric, column) in DAILY.items():
+        day = func.date(getattr(model, column))
+        buckets = db.session.query(day, model.location_id, func.count()).group_by(day, model.location_id).all()
+        totals = Counter()
+        for d, location_id, c in buckets:
+            if d is not None:
+                totals[(_as_date(d), metric)] += c
+                if location_id is not None:
+                    totals[(_as_date(d), scoped(metric, location_id))] += c
+        daily_rows = [{'day': d, 'metric': m, 'count': c} for (d, m), c in totals.items()]
+        if daily_rows:
+            db.session.execute(DailyStat.__table__.insert(), daily_rows)
+    db.session.commit()
+
+
+def _as_date(value):
+    # SQLite's date() returns text, PostgreSQL returns a date
+    return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+
+
+def init_app(app):
+    """Keep the summary store in step with every flush (the migration that creates it seeds it)"""
+    event.listen(db.session, 'after_flush', _after_flush)
@@ -0,0 +1,260 @@
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import OperationalError, DBAPIError
+from app import db
+from models import Item, IncomingItem, OutgoingItem, StockTransfer
+import stats
+import ledger
+import alerts
+import locations
+import lots
+from lots import LotAllocator
+from feed import change_feed, ENTITIES as FEED_ENTITIES
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL serialization failure and deadlock; both are safe to retry
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+
+class StockError(Exception):
+    """Base class for stock movements that cannot be applied"""
+
+
+class ItemNotFound(StockError):
+    def __init__(self, item_id):
+        super().__init__(f'Item {item_id} does not exist.')
+        self.item_id = item_id
+
+
+class InsufficientStock(StockError):
+    def __init__(self, item, requested, available=None):
+        # available is the balance at the location drawn from, when less than the item's total
+        available = item.quantity if available is None else available
+        super().__init__(f'Insufficient stock! Available: {available}, Requested: {requested}')
+        self.item = item
+        self.available = available
+        self.requested = requested
+
+
+def _take(item_id, location_id, quantity):
+    if not locations.take(item_id, location_id, quantity):
+        item = db.session.get(Item, item_id)
+        if item is None:
+            raise ItemNotFound(item_id)
+        raise InsufficientStock(item, quantity, locations.available(item_id, location_id))
+
+
+def _adjust(item_id, delta, location_id):
+    """Atomically add delta to an item's quantity at a location, refusing to go below zero.
+
+    The check and the write are one conditional UPDATE, so concurrent
+    movements serialise on the row instead of racing a Python-side read.
+    On PostgreSQL the row lock taken by the UPDATE re-evaluates the WHERE
+    clause against the committed value, giving the same guarantee as
+    SELECT ... FOR UPDATE without the extra round trip. The location's
+    balance is taken from the same way before the item's total moves.
+    """
+    if delta < 0:
+        _take(item_id, location_id, -delta)
+    stmt = update(Item).where(Item.id == item_id)
+    if delta < 0:
+        stmt = stmt.where(Item.quantity >= -delta)
+    stmt = stmt.values(quantity=Item.quantity + delta, updated_at=datetime.utcnow())
+    result = db.session.execute(stmt.execution_options(synchronize_session='fetch'))
+    if result.rowcount == 1:
+        if delta > 0:
+            locations.apply(db.session.connection(), {(item_id, location_id): delta})
+        alerts.mark(db.session, [item_id])
+        change_feed.mark(db.session, 'items', [item_id])
+        return
+    item = db.session.get(Item, item_id)
+    if item is None:
+        raise ItemNotFound(item_id)
+    db.session.refresh(item)
+    raise InsufficientStock(item, -delta)
+
+
+def receive_stock(item_id, quantity, location_id=None, **fields):
+    """Add received stock to an item and record the IncomingItem in the current transaction.
+
+    The stock is booked at location_id, or at the default location.
+    """
+    location_id = locations.resolve(location_id)
+    _adjust(item_id, quantity, location_id)
+    incoming = IncomingItem(item_id=item_id, quantity=quantity, location_id=location_id, **fields)
+    db.session.add(incoming)
+    db.session.flush()
+    return incoming
+
+
+def issue_stock(item_id, quantity, location_id=None, **fields):
+    """Take stock out of an item and record the OutgoingItem in the current transaction.
+
+    Raises InsufficientStock, leaving the item untouched, when fewer than
+    quantity units are on hand at location_id (or the default location) at
+    the moment of the write. The units are drawn from the item's lots
+    first-expired-first-out, from the lots held at that location.
+    """
+    location_id = locations.resolve(location_id)
+    _adjust(item_id, -quantity, location_id)
+    outgoing = OutgoingItem(item_id=item_id, quantity=quantity, location_id=location_id, **fields)
+    db.session.add(outgoing)
+    db.session.flush()
+    allocator = LotAllocator(location_id)
+    allocator.save([outgoing.id], [allocator.allocate(item_id, quantity)])
+    return outgoing
+
+
+def transfer_stock(item_id, quantity, from_location_id, to_location_id, **fields):
+    """Move units of an item between two locations and record the StockTransfer.
+
+    The item's total and the stock ledger are unchanged; the two balances
+    move, and so do the units of the source's lots, first expiry first.
+    Raises InsufficientStock when the source location has fewer than
+    quantity units.
+    """
+    if from_location_id == to_location_id:
+        raise StockError('A transfer needs two different locations.')
+    if db.session.scalar(select(Item.id).where(Item.id == item_id)) is None:
+        raise ItemNotFound(item_id)
+    # Balance rows are locked in ascending location order, as _apply_lines does for items
+    for location_id in sorted((from_location_id, to_location_id)):
+        if location_id == from_location_id:
+            _take(item_id, location_id, quantity)
+        else:
+            locations.apply(db.session.connection(), {(item_id, location_id): quantity})
+    lots.move(item_id, quantity, from_location_id, to_location_id)
+    transfer = StockTransfer(item_id=item_id, quantity=quantity, from_location_id=from_location_id,
+                             to_location_id=to_location_id, **fields)
+    db.session.add(transfer)
+    db.session.flush()
+    return transfer
+
+
+def adjust_stock(item_id, quantity, location_id=None):
+    """Set an item's quantity from a stocktake, booking the difference at location_id (or the default location).
+
+    The change goes to the stock ledger as an adjustment, and a lowered
+    quantity draws down the lots at that location. Raises
+    InsufficientStock, leaving the item untouched, when the location holds
+    fewer units than the quantity is lowered by. Returns the change.
+    """
+    location_id = locations.resolve(location_id)
+    current = db.session.scalar(select(Item.quantity).where(Item.id == item_id))
+    if current is None:
+        raise ItemNotFound(item_id)
+    delta = quantity - current
+    if delta:
+        _adjust(item_id, delta, location_id)
+        # The conditional UPDATE bypasses the session, so the ledger hook never sees it
+        ledger.record(db.session.connection(), [ledger.entry(item_id, delta, 'adjustment', 'items', item_id)])
+        if delta < 0:
+            lots.trim([(item_id, location_id)])
+    return delta
+
+
+def _apply_lines(lines, sign, location_id):
+    """Apply the net quantity of each item in lines, locking rows in ascending id order.
+
+    Every batch takes its row locks in the same order, so two batches that
+    share items wait for each other instead of deadlocking.
+    """
+    totals = Counter()
+    for line in lines:
+        totals[line['item_id']] += line['quantity']
+    found = set(db.session.scalars(select(Item.id).where(Item.id.in_(list(totals)))))
+    missing = sorted(set(totals) - found)
+    if missing:
+        raise ItemNotFound(missing[0])
+    for item_id in sorted(totals):
+        _adjust(item_id, sign * totals[item_id], location_id)
+    return totals
+
+
+def _insert_lines(model, date_column, metric, lines, fields):
+    now = datetime.utcnow()
+    rows = [dict(fields, **line, **{date_column: now}) for line in lines]
+    ids = db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+    # Bulk inserts bypass the session's flush hooks, so bump the dashboard
+    # buckets and append the ledger entries here
+    connection = db.session.connection()
+    stats.apply_deltas(connection, daily={(now.date(), metric): len(rows),
+                                          (now.date(), stats.scoped(metric, fields['location_id'])): len(rows)})
+    sign, reason = ledger.MOVEMENTS[model]
+    ledger.record(connection, [ledger.entry(row['item_id'], sign * row['quantity'], reason, model.__tablename__, id, now)
+                               for row, id in zip(rows, ids)])
+    change_feed.mark(db.session, FEED_ENTITIES[model], ids)
+    return ids
+
+
+def receive_lines(lines, location_id=None, **fields):
+    """Receive several lines in the current transaction; returns the new IncomingItem ids.
+
+    lines are dicts of IncomingItem columns (at least item_id and quantity);
+    fields are columns shared by every line. Every line is received at
+    location_id, or at the default location.
+    """
+    location_id = locations.resolve(location_id)
+    _apply_lines(lines, 1, location_id)
+    fields['location_id'] = location_id
+    ids = _insert_lines(IncomingItem, 'received_date', 'incoming', lines, fields)
+    lots.place(db.session.connection(), [
+        {'incoming_id': id, 'location_id': location_id, 'item_id': line['item_id'],
+         'expiry_date': line.get('expiry_date', fields.get('expiry_date')), 'remaining': line['quantity']}
+        for line, id in zip(lines, ids)])
+    return ids
+
+
+def issue_lines(lines, location_id=None, **fields):
+    """Issue several lines in the current transaction; returns the new OutgoingItem ids.
+
+    Either every line is issued or, on the first item without enough stock,
+    InsufficientStock is raised and the caller's rollback undoes the rest.
+    Lots are allocated after the item rows are locked, so concurrent issues
+    of the same item never draw on the same lot units.
+    """
+    location_id = locations.resolve(location_id)
+    _apply_lines(lines, -1, location_id)
+    fields['location_id'] = location_id
+    ids = _insert_lines(OutgoingItem, 'issued_date', 'outgoing', lines, fields)
+    allocator = LotAllocator(location_id)
+    allocator.save(ids, [allocator.allocate(line['item_id'], line['quantity']) for line in lines])
+    return ids
+
+
+def is_retryable(error):
+    """True for lock contention errors that a fresh attempt can succeed past"""
+    if isinstance(error, OperationalError):
+        message = str(error.orig).lower()
+        if 'database is locked' in message or 'database is busy' in message:
+            return True
+    return isinstance(error, DBAPIError) and getattr(error.orig, 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def run_in_transaction(work, *args, **kwargs):
+    """Run work(*args, **kwargs) and commit, retrying on lock contention.
+
+    Each retry rolls back and starts the unit of work again after an
+    exponential backoff with jitter. StockError and any other failure roll
+    back and propagate immediately.
+    """
+    attempts = current_app.config.get('STOCK_RETRY_ATTEMPTS', 5)
+    backoff = current_app.config.get('STOCK_RETRY_BACKOFF', 0.02)
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work(*args, **kwargs)
+            db.session.commit()
+            return result
+        except Exception as e:
+            db.session.rollback()
+            if attempt == attempts or not is_retryable(e):
+                raise
+            delay = backoff * (2 ** (attempt - 1)) * (0.5 + random.random())
+            logger.debug('Stock transaction contended (attempt %d/%d), retrying in %.3fs', attempt, attempts, delay)
+            time.sleep(delay)
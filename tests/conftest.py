@@ -0,0 +1,72 @@
+"""Shared fixtures: the app on one temporary SQLite database for the whole run.
+
+The app is configured when it is first imported, so the database is chosen
+here, before any test module imports it. Tests share the database and each
+creates the records it checks.
+
+Run with: python -m pytest tests
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_instance = tempfile.mkdtemp(prefix='inventory-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_instance, 'test.db')
+os.environ['REPORT_DIR'] = os.path.join(_instance, 'reports')
+os.environ['ACTIVITY_ARCHIVE_DIR'] = os.path.join(_instance, 'activity_archive')
+
+from app import app as flask_app, db  # noqa: E402
+from models import Category, Item, User  # noqa: E402
+
+PASSWORD = 'test-password'
+_codes = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(WTF_CSRF_ENABLED=False)
+    return flask_app
+
+
+@pytest.fixture
+def ctx(app):
+    """An application context whose session is discarded afterwards"""
+    with app.app_context():
+        yield
+        db.session.remove()
+
+
+@pytest.fixture(scope='session')
+def category(app):
+    with app.app_context():
+        category = Category(name='Tests')
+        db.session.add(category)
+        db.session.commit()
+        return category.id
+
+
+@pytest.fixture(scope='session')
+def make_item(category):
+    """Create and commit an item with an unused code, in the current app context; returns its id"""
+    def make(quantity=0, **fields):
+        item = Item(code=f'T{next(_codes):05d}', name='Test item', quantity=quantity, unit_price=1,
+                    category_id=category, **fields)
+        db.session.add(item)
+        db.session.commit()
+        return item.id
+    return make
+
+
+@pytest.fixture(scope='session')
+def user(app):
+    """Username of an account with password PASSWORD"""
+    with app.app_context():
+        user = User(username='tester', email='tester@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        return user.username
@@ -0,0 +1,61 @@
+"""Cached values are dropped when a committed write changes their entity, and only then."""
+import itertools
+
+from app import db
+from models import Category, Item
+from cache import cache
+import stock
+
+
+_names = itertools.count()
+
+
+def cached(entity):
+    """A fresh value cached under entity; each computation returns the next number"""
+    name, counter = f'test-{next(_names)}', itertools.count()
+    return lambda: cache.get_or_set(entity, name, lambda: next(counter))
+
+
+def test_orm_write_invalidates_on_commit(ctx, make_item):
+    item_id = make_item(1)
+    value = cached('items')
+    assert value() == value() == 0
+    db.session.get(Item, item_id).name = 'Renamed'
+    db.session.flush()
+    assert value() == 0
+    db.session.commit()
+    assert value() == 1
+
+
+def test_rollback_keeps_the_cache(ctx, make_item):
+    item_id = make_item(1)
+    value = cached('items')
+    assert value() == 0
+    db.session.get(Item, item_id).name = 'Renamed'
+    db.session.flush()
+    db.session.rollback()
+    assert value() == 0
+
+
+def test_stock_movement_invalidates_items(ctx, make_item):
+    # The conditional UPDATE bypasses the unit of work; the ORM execute hook catches it
+    item_id = make_item(0)
+    value = cached('items')
+    assert value() == 0
+    stock.run_in_transaction(stock.receive_stock, item_id, 2, unit_price=1)
+    assert value() == 1
+
+
+def test_new_item_invalidates_categories(ctx, make_item):
+    categories, items = cached('categories'), cached('items')
+    assert categories() == items() == 0
+    make_item(1)
+    assert categories() == items() == 1
+
+
+def test_write_leaves_other_entities_cached(ctx, category):
+    items = cached('items')
+    assert items() == 0
+    db.session.get(Category, category).description = 'Changed'
+    db.session.commit()
+    assert items() == 0
@@ -0,0 +1,90 @@
+"""The change feed: one entry per changed record, tombstones for deletes, and 410 for pruned cursors."""
+import pytest
+
+from app import db
+from models import Item
+from feed import change_feed, FeedGone
+from conftest import PASSWORD
+import stock
+
+
+def changes(after):
+    return [(entry.entity, entry.record_id, entry.op) for entry in change_feed.changes(after)]
+
+
+def test_changes_are_coalesced_per_commit(ctx, make_item):
+    head = change_feed.current_head()
+    item_id = make_item(1)
+    assert changes(head) == [('items', item_id, 'upsert')]
+
+    head = change_feed.current_head()
+    item = db.session.get(Item, item_id)
+    item.name = 'Once'
+    db.session.flush()
+    item.name = 'Twice'
+    db.session.commit()
+    assert changes(head) == [('items', item_id, 'upsert')]
+
+
+def test_rollback_records_nothing(ctx, make_item):
+    item_id = make_item(1)
+    head = change_feed.current_head()
+    db.session.get(Item, item_id).name = 'Discarded'
+    db.session.flush()
+    db.session.rollback()
+    assert change_feed.current_head() == head
+
+
+def test_bulk_movements_are_recorded(ctx, make_item):
+    item_id = make_item(0)
+    head = change_feed.current_head()
+    [incoming_id] = stock.run_in_transaction(stock.receive_lines, [{'item_id': item_id, 'quantity': 2, 'unit_price': 1}])
+    assert set(changes(head)) == {('items', item_id, 'upsert'), ('incoming-items', incoming_id, 'upsert')}
+
+
+def test_delete_leaves_a_tombstone(ctx, make_item):
+    item_id = make_item(0)
+    head = change_feed.current_head()
+    db.session.delete(db.session.get(Item, item_id))
+    db.session.commit()
+    assert changes(head) == [('items', item_id, 'delete')]
+
+
+def test_api_lists_tombstones(app, ctx, make_item, user):
+    item_id = make_item(0)
+    head = change_feed.current_head()
+    db.session.delete(db.session.get(Item, item_id))
+    db.session.commit()
+    data = api_get(app, user, f'/api/v1/changes?after={head}').get_json()
+    assert [(c['entity'], c['id'], c['op']) for c in data['changes']] == [('items', item_id, 'delete')]
+
+
+# --- RETENTION ---
+# Pruning empties the shared feed, so these run last
+
+def test_pruned_cursor_is_gone(ctx, make_item):
+    make_item(1)
+    make_item(1)
+    head = change_feed.current_head()
+    assert change_feed.prune(days=0) > 0
+    # The newest entry is kept, so the head survives and is still a valid cursor
+    assert change_feed.current_head() == head
+    assert change_feed.changes(head) == []
+    with pytest.raises(FeedGone):
+        change_feed.changes(1)
+
+
+def test_api_answers_gone_for_pruned_cursor(app, ctx, make_item, user):
+    make_item(1)
+    make_item(1)
+    change_feed.prune(days=0)
+    response = api_get(app, user, '/api/v1/changes?after=1')
+    assert response.status_code == 410
+    head = change_feed.current_head()
+    assert api_get(app, user, f'/api/v1/changes?after={head}').status_code == 200
+
+
+def api_get(app, user, path):
+    client = app.test_client()
+    token = client.post('/api/v1/tokens', json={'username': user, 'password': PASSWORD}).get_json()['token']
+    return client.get(path, headers={'Authorization': f'Bearer {token}'})
@@ -0,0 +1,51 @@
+"""Point-in-time quantities from the stock ledger, before, between and after snapshots."""
+import time
+from datetime import datetime
+
+from app import db
+from models import Item
+import ledger
+import stock
+
+
+def moment():
+    # Ledger entries are stamped to the microsecond; keep them off the instant read back
+    time.sleep(0.002)
+    at = datetime.utcnow()
+    time.sleep(0.002)
+    return at
+
+
+def test_quantity_as_of_across_snapshots(ctx, make_item):
+    before = moment()
+    item_id = make_item(10)
+    opened = moment()
+    stock.run_in_transaction(stock.receive_stock, item_id, 5, unit_price=1)
+    received = moment()
+    assert ledger.take_snapshots() >= 1
+    stock.run_in_transaction(stock.issue_stock, item_id, 3, destination='site')
+    issued = moment()
+    assert ledger.take_snapshots() >= 1
+    item = db.session.get(Item, item_id)
+    item.quantity = 20
+    db.session.commit()
+    edited = moment()
+
+    expected = {before: 0, opened: 10, received: 15, issued: 12, edited: 20}
+    assert {at: ledger.quantity_as_of(item_id, at) for at in expected} == expected
+    assert ledger.quantity_as_of(item_id) == 20
+    assert {at: ledger.quantities_as_of(at).get(item_id, 0) for at in expected} == expected
+
+
+def test_snapshots_without_new_entries_are_skipped(ctx, make_item):
+    make_item(1)
+    ledger.take_snapshots()
+    assert ledger.take_snapshots() == 0
+
+
+def test_ledger_matches_item_quantities(ctx, make_item):
+    item_id = make_item(4)
+    stock.run_in_transaction(stock.issue_stock, item_id, 1, destination='site')
+    stock.run_in_transaction(stock.adjust_stock, item_id, 7)
+    assert ledger.quantity_as_of(item_id) == db.session.get(Item, item_id).quantity == 7
+    assert item_id not in [drift['item_id'] for drift in ledger.check()]
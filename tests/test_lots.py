@@ -0,0 +1,77 @@
+"""First-expired-first-out allocation of issues to lots, and lots trimmed when quantities are edited."""
+from datetime import date
+
+from sqlalchemy import select
+from app import db
+from models import Item, OutgoingAllocation
+import locations
+import lots
+import stock
+
+
+def receive(item_id, quantity, expiry_date=None):
+    return stock.run_in_transaction(stock.receive_stock, item_id, quantity, unit_price=1,
+                                    expiry_date=expiry_date).id
+
+
+def remaining(item_id):
+    return {lot.id: lot.remaining for lot in lots.open_lots(item_id)}
+
+
+def lot_totals(item_id):
+    """Units left in the item's lots, overall and at the default location"""
+    at_default = lots.balances(item_id, locations.default_id())
+    return sum(remaining(item_id).values()), sum(lot['remaining'] for lot in at_default['lots'])
+
+
+def test_issue_splits_over_lots_first_expiry_first(ctx, make_item):
+    item_id = make_item(0)
+    later = receive(item_id, 5, date(2031, 3, 1))
+    sooner = receive(item_id, 5, date(2031, 1, 1))
+    undated = receive(item_id, 5)
+
+    outgoing = stock.run_in_transaction(stock.issue_stock, item_id, 7, destination='site')
+    split = db.session.execute(select(OutgoingAllocation.incoming_id, OutgoingAllocation.quantity)
+                               .where(OutgoingAllocation.outgoing_id == outgoing.id)
+                               .order_by(OutgoingAllocation.id)).all()
+    assert [tuple(row) for row in split] == [(sooner, 5), (later, 2)]
+    assert remaining(item_id) == {later: 3, undated: 5}
+    assert [lot.id for lot in lots.open_lots(item_id)] == [later, undated]
+
+
+def test_units_beyond_the_lots_are_issued_last(ctx, make_item):
+    item_id = make_item(2)
+    lot = receive(item_id, 3, date(2031, 1, 1))
+    outgoing = stock.run_in_transaction(stock.issue_stock, item_id, 4, destination='site')
+    split = db.session.execute(select(OutgoingAllocation.incoming_id, OutgoingAllocation.quantity)
+                               .where(OutgoingAllocation.outgoing_id == outgoing.id)
+                               .order_by(OutgoingAllocation.id)).all()
+    assert [tuple(row) for row in split] == [(lot, 3), (None, 1)]
+    assert remaining(item_id) == {}
+
+
+def test_stocktake_trims_lots_first_expiry_first(ctx, make_item):
+    item_id = make_item(0)
+    later = receive(item_id, 4, date(2031, 3, 1))
+    sooner = receive(item_id, 4, date(2031, 1, 1))
+    stock.run_in_transaction(stock.adjust_stock, item_id, 5)
+    assert remaining(item_id) == {sooner: 1, later: 4}
+    assert lot_totals(item_id) == (5, 5)
+
+
+def test_direct_edit_trims_lots(ctx, make_item):
+    item_id = make_item(0)
+    later = receive(item_id, 4, date(2031, 3, 1))
+    receive(item_id, 4, date(2031, 1, 1))
+    db.session.get(Item, item_id).quantity = 2
+    db.session.commit()
+    assert remaining(item_id) == {later: 2}
+    assert lot_totals(item_id) == (2, 2)
+
+
+def test_raising_the_quantity_leaves_lots_alone(ctx, make_item):
+    item_id = make_item(0)
+    lot = receive(item_id, 4, date(2031, 1, 1))
+    stock.run_in_transaction(stock.adjust_stock, item_id, 9)
+    assert remaining(item_id) == {lot: 4}
+    assert lots.balances(item_id)['untraced'] == 5
@@ -0,0 +1,141 @@
+"""Stock movements: conditional decrements, retries on lock contention and all-or-nothing multi-line issues."""
+import sqlite3
+import threading
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from app import db
+from models import Item, OutgoingItem, StockLedgerEntry
+import stock
+
+
+def quantity(item_id):
+    return db.session.scalar(select(Item.quantity).where(Item.id == item_id))
+
+
+def issued(item_id):
+    return db.session.scalar(select(func.coalesce(func.sum(OutgoingItem.quantity), 0))
+                             .where(OutgoingItem.item_id == item_id))
+
+
+# --- CONDITIONAL DECREMENT ---
+
+def test_issue_refuses_more_than_on_hand(ctx, make_item):
+    item_id = make_item(3)
+    with pytest.raises(stock.InsufficientStock) as error:
+        stock.run_in_transaction(stock.issue_stock, item_id, 5, destination='site')
+    assert (error.value.available, error.value.requested) == (3, 5)
+    assert quantity(item_id) == 3
+    assert issued(item_id) == 0
+
+
+def test_issue_unknown_item(ctx):
+    with pytest.raises(stock.ItemNotFound):
+        stock.run_in_transaction(stock.issue_stock, 999_999, 1, destination='site')
+
+
+def test_concurrent_issues_never_oversell(app, ctx, make_item, monkeypatch):
+    item_id = make_item(20)
+    monkeypatch.setitem(app.config, 'STOCK_RETRY_ATTEMPTS', 50)
+    monkeypatch.setitem(app.config, 'STOCK_RETRY_BACKOFF', 0.001)
+    results = []
+
+    def worker():
+        with app.app_context():
+            for _ in range(5):
+                try:
+                    stock.run_in_transaction(stock.issue_stock, item_id, 1, destination='site')
+                    results.append('issued')
+                except stock.InsufficientStock:
+                    results.append('refused')
+                finally:
+                    db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count('issued') == 20
+    assert results.count('refused') == 20
+    assert quantity(item_id) == 0
+    assert issued(item_id) == 20
+
+
+# --- RETRIES ---
+
+def busy():
+    return OperationalError('UPDATE items', {}, sqlite3.OperationalError('database is locked'))
+
+
+def test_retries_when_database_is_busy(app, ctx, monkeypatch):
+    monkeypatch.setitem(app.config, 'STOCK_RETRY_BACKOFF', 0)
+    calls = []
+
+    def work():
+        calls.append(1)
+        if len(calls) < 3:
+            raise busy()
+        return 'done'
+
+    assert stock.run_in_transaction(work) == 'done'
+    assert len(calls) == 3
+
+
+def test_gives_up_after_the_last_attempt(app, ctx, monkeypatch):
+    monkeypatch.setitem(app.config, 'STOCK_RETRY_ATTEMPTS', 2)
+    monkeypatch.setitem(app.config, 'STOCK_RETRY_BACKOFF', 0)
+    calls = []
+
+    def work():
+        calls.append(1)
+        raise busy()
+
+    with pytest.raises(OperationalError):
+        stock.run_in_transaction(work)
+    assert len(calls) == 2
+
+
+def test_stock_errors_are_not_retried(ctx, make_item):
+    item_id = make_item(1)
+    calls = []
+
+    def work():
+        calls.append(1)
+        return stock.issue_stock(item_id, 2, destination='site')
+
+    with pytest.raises(stock.InsufficientStock):
+        stock.run_in_transaction(work)
+    assert len(calls) == 1
+
+
+# --- MULTI-LINE TRANSACTIONS ---
+
+def test_issue_lines_is_all_or_nothing(ctx, make_item):
+    plenty, scarce = make_item(10), make_item(1)
+    entries = db.session.scalar(select(func.count()).select_from(StockLedgerEntry))
+    lines = [{'item_id': plenty, 'quantity': 4}, {'item_id': scarce, 'quantity': 2}]
+    with pytest.raises(stock.InsufficientStock):
+        stock.run_in_transaction(stock.issue_lines, lines, destination='site')
+    assert (quantity(plenty), quantity(scarce)) == (10, 1)
+    assert issued(plenty) == issued(scarce) == 0
+    assert db.session.scalar(select(func.count()).select_from(StockLedgerEntry)) == entries
+
+
+def test_issue_lines_nets_repeated_items(ctx, make_item):
+    item_id = make_item(5)
+    lines = [{'item_id': item_id, 'quantity': 2}, {'item_id': item_id, 'quantity': 3}]
+    ids = stock.run_in_transaction(stock.issue_lines, lines, destination='site')
+    assert len(ids) == 2
+    assert quantity(item_id) == 0
+    assert issued(item_id) == 5
+
+
+def test_receive_lines_rolls_back_on_unknown_item(ctx, make_item):
+    item_id = make_item(0)
+    lines = [{'item_id': item_id, 'quantity': 3, 'unit_price': 1}, {'item_id': 999_999, 'quantity': 1, 'unit_price': 1}]
+    with pytest.raises(stock.ItemNotFound):
+        stock.run_in_transaction(stock.receive_lines, lines)
+    assert quantity(item_id) == 0
@@ -0,0 +1,77 @@
+"""Streamed listing pages send their first byte before the page query and still record its statements."""
+import pytest
+from sqlalchemy import event
+from app import db
+from metrics import request_metrics
+from conftest import PASSWORD
+import stock
+
+PAGES = [('/items', 'items'), ('/incoming-items', 'incoming_items'), ('/outgoing-items', 'outgoing_items')]
+
+
+@pytest.fixture(scope='module')
+def client(app, user, make_item):
+    app.config.update(QUERY_COUNT_HEADER=True, METRICS_SERVER_TIMING=True)
+    request_metrics.server_timing = True
+    request_metrics.sample_rate = 1.0
+    with app.app_context():
+        item_ids = [make_item(10) for _ in range(30)]
+        stock.run_in_transaction(stock.receive_stock, item_ids[0], 5, unit_price=1, received_by='stream')
+        stock.run_in_transaction(stock.issue_stock, item_ids[0], 2, destination='site', issued_by='stream')
+        db.session.remove()
+    client = app.test_client()
+    client.post('/login', data={'username': user, 'password': PASSWORD})
+    yield client
+    app.config['STREAM_TEMPLATES'] = True
+
+
+def get(client, path, streamed):
+    client.application.config['STREAM_TEMPLATES'] = streamed
+    response = client.get(path)
+    response.get_data()
+    response.close()
+    assert response.status_code == 200
+    return response
+
+
+@pytest.mark.parametrize('path, endpoint', PAGES)
+def test_streamed_page_records_its_queries(client, path, endpoint):
+    # Warm the caches so both renderings run the same statements
+    get(client, path, False)
+    whole = get(client, path, False)
+    before = request_metrics.sql_queries.series.get((endpoint,), [0])[-1]
+    streamed = get(client, path, True)
+    recorded = request_metrics.sql_queries.series[(endpoint,)][-1] - before
+
+    count = int(whole.headers['X-Query-Count'])
+    assert count >= 1
+    assert f'desc="{count} queries"' in whole.headers['Server-Timing']
+    # Not known when a streamed page's headers go out, so not sent at all
+    assert 'X-Query-Count' not in streamed.headers
+    assert 'Server-Timing' not in streamed.headers
+    assert recorded == count
+
+
+@pytest.mark.parametrize('path, table', [('/items', 'items'), ('/incoming-items', 'incoming_items'),
+                                         ('/outgoing-items', 'outgoing_items')])
+def test_page_query_runs_after_first_byte(app, client, path, table):
+    get(client, path, True)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path)
+        chunks = response.iter_encoded()
+        first = next(chunks)
+        before_first = [s for s in statements if f'FROM {table}' in s]
+        b''.join(chunks)
+        response.close()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert first.startswith(b'<!DOCTYPE') or b'<html' in first
+    assert not before_first
+    assert any(f'FROM {table}' in s for s in statements)
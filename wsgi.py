@@ -0,0 +1,8 @@
+"""WSGI entry point for production servers: gunicorn wsgi:app"""
+import os
+
+os.environ.setdefault("APP_ENV", "production")
+
+from app import create_app  # noqa: E402
+
+app = create_app()